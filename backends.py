@@ -0,0 +1,180 @@
+"""多后端路由：把 chat.completions 请求分摊到 config.BACKENDS 里的多个 OpenAI 兼容端点。与 Streamlit 无关。
+
+以前所有请求都走一个 OpenAI(api_key=...)：一个服务商、一个账号的额度。Router 对调用方就是一个客户端
+（router.chat.completions.create(...)，translator 无需区分），每次请求：
+- 选后端：只在提供该模型、未处于冷却的后端里选，得分 = 该模型的平均耗时（秒 / 输出 token，指数滑动平均）
+  × (1 + 进行中的请求数) ÷ 剩余限流额度比例（响应头 x-ratelimit-remaining-* / x-ratelimit-limit-*，
+  没有这些头按满额）。还没有耗时样本的后端先试（得分 0），所以每个后端都会被探测到；
+- 故障转移：429、5xx、超时、连接失败换下一个后端重发，并让出错的后端冷却（429 按 retry-after 或限流重置时间，
+  其余 BACKEND_COOLDOWN 秒、连续出错翻倍）；Key 无效 / 无权限冷却 BACKEND_AUTH_COOLDOWN 秒；
+  模型不存在（404）的后端之后不再派发该模型。其他 4xx 是请求本身的问题，直接抛出。
+  所有后端都试过仍失败时抛出最后一个错误，交给 translator._chat 的退避重试；
+- 额度用尽（剩余 0）的后端冷却到限流重置时间；全部冷却时选最早恢复的那个，不空等。
+返回的响应带 backend 属性（后端名），费用按该后端的价格表计（config.estimate_cost）。
+"""
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from openai import (DEFAULT_MAX_RETRIES, OpenAI, APIConnectionError, APITimeoutError, AuthenticationError,
+                    InternalServerError, NotFoundError, PermissionDeniedError, RateLimitError)
+
+import config
+
+_FAILOVER = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError,
+             AuthenticationError, PermissionDeniedError, NotFoundError)
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+_EWMA = 0.3
+
+
+def parse_duration(text):
+    """限流重置时间（"1s"、"6m0s"、"20ms"、"0.5"）→ 秒；无法解析返回 None。"""
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(text)
+    return sum(float(n) * _UNITS[u] for n, u in parts) if parts else None
+
+
+class Backend:
+    """一个后端的连接与运行状态。状态只在 Router 的锁内修改。"""
+    __slots__ = ("name", "client", "models", "latency", "inflight", "headroom", "cooldown_until", "errors",
+                 "requests", "failures", "missing")
+
+    def __init__(self, spec, client=None, max_retries=DEFAULT_MAX_RETRIES):
+        self.name = spec["name"]
+        self.client = client or OpenAI(api_key=spec["api_key"], base_url=spec.get("base_url"),
+                                       organization=spec.get("organization"), max_retries=max_retries)
+        self.models = set(spec["models"]) if spec.get("models") else None
+        self.latency = {}          # 模型 -> 秒 / 输出 token（滑动平均）
+        self.inflight = 0
+        self.headroom = 1.0        # 剩余限流额度比例（0~1）
+        self.cooldown_until = 0.0
+        self.errors = 0            # 连续出错次数
+        self.requests = self.failures = 0
+        self.missing = set()       # 返回过 404 的模型
+
+    def serves(self, model):
+        return model not in self.missing and (self.models is None or model in self.models)
+
+    def score(self, model):
+        return self.latency.get(model, 0.0) * (1 + self.inflight) / max(self.headroom, 0.05)
+
+    def observe(self, headers):
+        """从响应头更新剩余额度；额度用尽时冷却到重置时间。"""
+        ratios, waits = [], []
+        for kind in ("requests", "tokens"):
+            try:
+                remaining = float(headers[f"x-ratelimit-remaining-{kind}"])
+                limit = float(headers[f"x-ratelimit-limit-{kind}"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if limit > 0:
+                ratios.append(max(0.0, remaining / limit))
+                if remaining <= 0:
+                    waits.append(parse_duration(headers.get(f"x-ratelimit-reset-{kind}")) or config.BACKEND_COOLDOWN)
+        self.headroom = min(ratios) if ratios else 1.0
+        if waits:
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + max(waits))
+
+    def stats(self):
+        return {"requests": self.requests, "failures": self.failures, "inflight": self.inflight,
+                "headroom": round(self.headroom, 3), "cooling": self.cooldown_until > time.monotonic(),
+                "latency_ms_per_token": {m: round(v * 1000, 3) for m, v in self.latency.items()}}
+
+
+class Router:
+    """后端池。线程安全：Step 1 各语言线程与对冲请求共用一个实例。"""
+
+    def __init__(self, backends):
+        if not backends:
+            raise ValueError("没有可用的后端")
+        self.backends = list(backends)
+        self.failovers = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    @classmethod
+    def from_specs(cls, specs):
+        """按 config.backend_specs() 的格式建池。关掉 SDK 自身的重试：多个后端时出错立即换后端；
+        重试统一由 translator._chat 的退避负责，单次请求的截止时间（latency.deadline）才是真实上限。"""
+        return cls([Backend(s, max_retries=0) for s in specs])
+
+    def _pick(self, model, tried):
+        now = time.monotonic()
+        cands = [b for b in self.backends if b.name not in tried and b.serves(model)]
+        if not cands:
+            return None
+        ready = [b for b in cands if b.cooldown_until <= now]
+        if not ready:
+            return min(cands, key=lambda b: b.cooldown_until)
+        return min(ready, key=lambda b: (b.score(model), b.inflight, self.backends.index(b)))
+
+    def _failed(self, b, model, e):
+        b.failures += 1
+        b.errors += 1
+        if isinstance(e, NotFoundError):
+            b.missing.add(model)
+            return
+        if isinstance(e, (AuthenticationError, PermissionDeniedError)):
+            wait = config.BACKEND_AUTH_COOLDOWN
+        else:
+            headers = getattr(getattr(e, "response", None), "headers", None) or {}
+            wait = None
+            if isinstance(e, RateLimitError):
+                ms = headers.get("retry-after-ms")
+                wait = float(ms) / 1000 if ms else parse_duration(headers.get("retry-after"))
+            if wait is None:
+                wait = config.BACKEND_COOLDOWN * 2 ** min(b.errors - 1, 5)
+        b.cooldown_until = max(b.cooldown_until, time.monotonic() + wait)
+
+    def create(self, **kwargs):
+        model = kwargs.get("model")
+        tried, last = set(), None
+        while True:
+            with self._lock:
+                b = self._pick(model, tried)
+                if b is None:
+                    break
+                if tried:
+                    self.failovers += 1
+                tried.add(b.name)
+                b.inflight += 1
+                b.requests += 1
+            t0 = time.perf_counter()
+            try:
+                raw = b.client.chat.completions.with_raw_response.create(**kwargs)
+                resp = raw.parse()
+            except _FAILOVER as e:
+                with self._lock:
+                    b.inflight -= 1
+                    self._failed(b, model, e)
+                last = e
+                continue
+            except BaseException:
+                with self._lock:
+                    b.inflight -= 1
+                raise
+            elapsed = time.perf_counter() - t0
+            usage = getattr(resp, "usage", None)
+            per_token = elapsed / max(1, getattr(usage, "completion_tokens", 0) or 0)
+            with self._lock:
+                b.inflight -= 1
+                b.errors = 0
+                old = b.latency.get(model)
+                b.latency[model] = per_token if old is None else old + _EWMA * (per_token - old)
+                b.observe(raw.headers)
+            resp.backend = b.name
+            return resp
+        if last is None:
+            raise ValueError(f"没有提供模型 {model} 的后端（检查 config.BACKENDS 的 models）")
+        raise last
+
+    def stats(self):
+        with self._lock:
+            return {b.name: b.stats() for b in self.backends}
@@ -0,0 +1 @@
+"""性能基准：翻译吞吐（本地 OpenAI 桩服务）与字幕渲染热点。不随应用运行，按需手动执行。"""
@@ -0,0 +1,268 @@
+"""字幕渲染热点的微基准：换行、缩字、字幕块渲染、ASS 生成与 SRT 解析 / 分块，对比入库基线防止性能回退。
+
+语料为合成的拉丁 / 中文 / 泰文 / 阿拉伯文台词，按字号与「最多行数」组合测量：
+    wrap_text_pil、_wrap_and_fit、render_block（每条字幕，排版与位图缓存每轮清空；位图只取 1/8 的字幕）
+    build_ass（整集，预换行开 / 关）、_chunk_cues（分块并格式化为请求文本）、_parse_srt（整集）
+每项取多轮最小值，按每条字幕的耗时除以同一进程里一段固定纯 Python 负载的耗时（calibration）归一化，
+换机器、换字幕条数（--quick）比较也基本可比。归一化值比基线慢超过 --threshold（默认 50%）即判为回退，退出码 1。
+
+    python benchmarks/bench_render.py                     # 与 benchmarks/baseline_render.json 对比
+    python benchmarks/bench_render.py --update-baseline   # 有意的性能变化确认后，重写基线
+    python benchmarks/bench_render.py --quick --filter cjk
+
+字体：依次在 fonts/ 与系统字体目录里找名称能对上文字的字体（如 *CJK* / Noto*Thai* / *Arabic* / *Naskh*），
+并实际检查语料里的字都有字形；拉丁文可用默认字体。阿拉伯文还要求 Pillow 带 raqm（否则不连写，测的不是真实排版）。
+找不到合适字体的文字只跑与字体无关的 _chunk_cues / _parse_srt，排版与渲染项跳过（结果里 skipped 注明原因），
+不会用缺字的字体测出一组无意义的数字写进基线。基线记录了每项所用字体，字体不同的项只报告、不判定回退。
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import PIL  # noqa: E402
+from PIL import Image, ImageDraw, ImageFont, features  # noqa: E402
+
+import config  # noqa: E402
+import srt_cues  # noqa: E402
+import step3  # noqa: E402
+import subtitle_render  # noqa: E402
+import text_layout  # noqa: E402
+import translator  # noqa: E402
+
+BASELINE = Path(__file__).with_name("baseline_render.json")
+SCRIPTS = ("latin", "cjk", "thai", "arabic")
+_FONT_HINTS = {"latin": (), "cjk": ("cjk", "sc", "hei", "yahei", "pingfang", "jp", "kr", "wqy", "droidsansfallback"),
+               "thai": ("thai",), "arabic": ("arabic", "naskh", "kufi")}
+_SYSTEM_FONT_DIRS = ("/usr/share/fonts", "/usr/local/share/fonts", "~/.local/share/fonts", "~/.fonts",
+                     "/System/Library/Fonts", "/Library/Fonts", "~/Library/Fonts", "C:/Windows/Fonts")
+_NEEDS_RAQM = ("arabic",)   # 不经 raqm 排版就不连写，测出的不是真实字形
+_LATIN = ("you", "never", "told", "me", "about", "the", "contract", "signed", "before", "board", "meeting",
+          "mother", "came", "back", "home", "tonight", "everything", "changed", "because", "of", "him", "what")
+_CJK = "你到底想怎么样我早就知道是做的别走听解释这件事跟没关系明天董事会之前必须把合同签了妈回来他根本不那种人快叫救护车"
+_THAI = ("คุณ", "ต้องการ", "อะไร", "กันแน่", "ฉัน", "รู้", "มานาน", "แล้ว", "ว่า", "เป็น", "คน", "ทำ", "อย่า",
+         "เพิ่ง", "ไป", "ฟัง", "อธิบาย", "ก่อน", "เรื่อง", "นี้", "ไม่", "เกี่ยว", "กับ")
+_ARABIC = ("ماذا", "تريد", "مني", "كنت", "أعرف", "أنك", "فعلت", "ذلك", "لا", "تذهب", "اسمعني", "هذا", "الأمر",
+           "لا", "يعنيك", "غدا", "قبل", "اجتماع", "المجلس", "يجب", "توقيع", "العقد")
+
+
+def corpus(script, n, seed=0):
+    """n 条合成台词。泰文词间多不加空格（只在短语间加），中文不加空格，与真实字幕一致。"""
+    rng = random.Random(f"{script}-{seed}")
+    cues = []
+    for _ in range(n):
+        if script == "cjk":
+            text = "".join(rng.choice(_CJK) for _ in range(rng.randint(8, 40)))
+        elif script == "thai":
+            phrases = ["".join(rng.choice(_THAI) for _ in range(rng.randint(2, 5))) for _ in range(rng.randint(1, 4))]
+            text = " ".join(phrases)
+        else:
+            words = _LATIN if script == "latin" else _ARABIC
+            text = " ".join(rng.choice(words) for _ in range(rng.randint(4, 18)))
+        cues.append(text)
+    return cues
+
+
+def episode_srt(texts):
+    return "\n".join(f"{k + 1}\n00:{k // 30:02d}:{k * 2 % 60:02d},000 --> 00:{k // 30:02d}:{k * 2 % 60 + 1:02d},500\n{t}\n"
+                     for k, t in enumerate(texts))
+
+
+def _font_files(root):
+    root = Path(root).expanduser()
+    if not root.is_dir():
+        return []
+    return sorted(p for p in root.rglob("*") if p.suffix.lower() in (".ttf", ".ttc", ".otf"))
+
+
+def covers(font_path, script):
+    """字体是否有语料里每个字的字形：缺字时 FreeType 画的是 .notdef，与私用区字符的位图相同。"""
+    try:
+        font = ImageFont.truetype(font_path, 32)
+    except OSError:
+        return False
+
+    def bitmap(ch):
+        img = Image.new("L", (64, 64))
+        ImageDraw.Draw(img).text((8, 8), ch, font=font, fill=255)
+        return img.tobytes()
+    notdef = bitmap("\U0010FFFD")
+    chars = {c for text in corpus(script, 50) for c in text if not c.isspace()}
+    return all(bitmap(c) != notdef for c in chars)
+
+
+@lru_cache(maxsize=None)
+def pick_font(script):
+    """返回 (字体路径或 None, 跳过原因)。先 fonts/，再系统字体目录；拉丁文最后用默认字体。"""
+    if script in _NEEDS_RAQM and not features.check("raqm"):
+        return None, "Pillow 未带 raqm，无法连写"
+    candidates = [p for root in (config.FONTS_DIR, *_SYSTEM_FONT_DIRS) for p in _font_files(root)
+                  if any(h in p.stem.lower() for h in _FONT_HINTS[script])]
+    if step3.default_font_path:
+        candidates.append(Path(step3.default_font_path))
+    for p in candidates:
+        if covers(str(p), script):
+            return str(p), None
+    return None, "没有覆盖该文字的字体"
+
+
+def _clear_layout_caches():
+    text_layout.wrap_text_pil.cache_clear()
+    text_layout.fit_text.cache_clear()
+    subtitle_render._render_glyphs.cache_clear()
+
+
+def _once(fn):
+    _clear_layout_caches()   # 每次都是「新的一集」：排版与位图缓存为空，字体与单字宽度缓存保留
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+def _best(fn, repeat, min_time=0.02):
+    """多轮取最小值；单次太快（计时噪声大）的项每轮重复多次取平均，使每轮至少约 min_time 秒。
+    与 timeit 一样计时期间关闭 GC，减少抖动。"""
+    loops = max(1, int(min_time / max(_once(fn), 1e-6)))
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            best = min(best, sum(_once(fn) for _ in range(loops)) / loops)
+        finally:
+            gc.enable()
+    return best
+
+
+def calibrate(repeat=5):
+    """固定的纯 Python 负载（字符串与字典操作为主，接近排版代码的开销构成），用于归一化。"""
+    def work():
+        d = {}
+        for i in range(60_000):
+            s = str(i)
+            d[s] = d.get(s[::-1], 0) + len(s)
+        return sum(d.values())
+    return _best(work, repeat)
+
+
+def _style(font, size, max_lines):
+    return {"font_path": font, "font_size": size, "font_color": "#FFFFFF", "stroke_color": "#000000",
+            "stroke_width": 2, "bold": 1, "bottom_offset": 80, "max_text_width": 1500 * size // 64,
+            "max_lines": max_lines, "shadow_color": "#000000", "shadow_opacity": 0.5, "shadow_offset": (0, 2),
+            "bg_enabled": False}
+
+
+def cases(n, sizes, line_limits, scripts):
+    """产出 (键, 字幕条数, 字体, 可调用对象)。没有合适字体的文字只产出与字体无关的项。"""
+    for script in scripts:
+        font, _ = pick_font(script)
+        texts = corpus(script, n)
+        srt = episode_srt(texts)
+        subs = srt_cues.parse_srt(srt)
+        for size in sizes if font else ():
+            max_w = _style(font, size, 0)["max_text_width"]
+            yield (f"wrap_text_pil/{script}/{size}", n, font,
+                   lambda t=texts, s=size, w=max_w, f=font: [text_layout.wrap_text_pil(x, f, s, w) for x in t])
+            for lines in line_limits:
+                style = _style(font, size, lines)
+                yield (f"_wrap_and_fit/{script}/{size}/l{lines}", n, font,
+                       lambda t=texts, st=style: [step3._wrap_and_fit(x, st) for x in t])
+                few = texts[:max(10, n // 8)]   # 位图渲染每条约数十毫秒，取一部分即可
+                yield (f"render_block/{script}/{size}/l{lines}", len(few), font,
+                       lambda t=few, st=style: [subtitle_render.render_block((1920, 1080), x, st) for x in t])
+        style = _style(font, 48, 2)
+        for prewrap in (False, True) if font else ():
+            yield (f"build_ass/{script}/prewrap{int(prewrap)}", n, font,
+                   lambda sb=subs, st=style, p=prewrap: step3.build_ass(sb, st, 1920, 1080, p))
+        # translate_srt 的分块：已解析的字幕按 CHUNK_CUES 切块，每块格式化为请求里的 SRT
+        yield (f"_chunk_cues/{script}", n, None,
+               lambda sb=subs: [srt_cues.format_srt(c) for c in translator._chunk_cues(sb)])
+        yield f"_parse_srt/{script}", n, None, lambda s=srt: translator._parse_srt(s)
+
+
+def run(n=200, repeat=3, sizes=(32, 48, 64), line_limits=(0, 2), scripts=SCRIPTS, filter_=None):
+    """运行全部基准，返回结果 dict（可直接存为基线）。"""
+    skipped = {s: reason for s in scripts for font, reason in (pick_font(s),) if font is None}
+    calib = calibrate()
+    results = {}
+    for key, count, font, fn in cases(n, sizes, line_limits, scripts):
+        if filter_ and filter_ not in key:
+            continue
+        best = _best(fn, repeat)
+        results[key] = {"per_cue_us": round(best / count * 1e6, 2), "norm": round(best / count / calib * 1e3, 4),
+                        "font": Path(font).name if font else None}
+    return {"benchmark": "render", "python": platform.python_version(), "pillow": PIL.__version__,
+            "platform": platform.platform(), "calibration_s": round(calib, 5),
+            "params": {"cues": n, "repeat": repeat, "sizes": list(sizes), "max_lines": list(line_limits)},
+            "skipped": skipped, "cases": results}
+
+
+def compare(results, baseline, threshold):
+    """对比归一化的每条耗时。返回 (回退 [(键, 比值)], 跳过 [键])；比值 = 本次 / 基线。"""
+    regressions, skipped = [], []
+    for key, cur in results["cases"].items():
+        base = baseline.get("cases", {}).get(key)
+        if base is None or base.get("font") != cur.get("font") or not base.get("norm"):
+            skipped.append(key)
+            continue
+        ratio = cur["norm"] / base["norm"]
+        if ratio > 1 + threshold:
+            regressions.append((key, round(ratio, 2)))
+    return regressions, skipped
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--cues", type=int, default=200, help="每种文字的字幕条数")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--quick", action="store_true", help="少量字幕、单一字号，快速自检")
+    ap.add_argument("--filter", help="只运行键中包含此字符串的项（如 cjk、render_block）")
+    ap.add_argument("--baseline", default=str(BASELINE))
+    ap.add_argument("--threshold", type=float, default=0.5, help="比基线慢超过该比例判为回退（0.5 = 50%%）")
+    ap.add_argument("--update-baseline", action="store_true")
+    ap.add_argument("--out", help="结果 JSON 写入此文件")
+    args = ap.parse_args(argv)
+
+    if args.quick:
+        results = run(n=min(args.cues, 50), repeat=2, sizes=(48,), filter_=args.filter)
+    else:
+        results = run(n=args.cues, repeat=args.repeat, filter_=args.filter)
+    text = json.dumps(results, ensure_ascii=False, indent=1)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    if args.update_baseline:
+        Path(args.baseline).write_text(text + "\n", encoding="utf-8")
+        print(f"基线已写入 {args.baseline}（{len(results['cases'])} 项）")
+        return 0
+
+    try:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        baseline = {}
+    regressions, skipped = compare(results, baseline, args.threshold)
+    for key, cur in results["cases"].items():
+        base = baseline.get("cases", {}).get(key, {})
+        ratio = f"{cur['norm'] / base['norm']:.2f}x" if key not in skipped else "  -  "
+        print(f"{key:<34} {cur['per_cue_us']:>10.1f} µs/条  {ratio}")
+    for script, reason in results["skipped"].items():
+        print(f"{script}: {reason}，排版与渲染项未运行")
+    if skipped:
+        print(f"\n{len(skipped)} 项无可比基线（新增或字体不同），未判定。")
+    if regressions:
+        print(f"\n❌ {len(regressions)} 项比基线慢超过 {args.threshold:.0%}：")
+        for key, ratio in regressions:
+            print(f"  {key}: {ratio}x")
+        return 1
+    print(f"\n✅ 无超过 {args.threshold:.0%} 的性能回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
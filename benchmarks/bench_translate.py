@@ -0,0 +1,195 @@
+"""翻译吞吐基准：本地 OpenAI 桩服务 + 合成多语言剧集，端到端驱动 Step 1 与 translate_srt。
+
+两个场景：
+- step1：与 Step 1 相同的多语言并发（每种语言一个 _process_single_language，含记忆更新、清单与跨集片段复用，
+  --no-segment-reuse 关闭复用以便对比）；
+- translate_srt：单语言逐集只调用 translate_srt（分块翻译 + 格式重试），隔离出纯翻译路径。
+输出 JSON：每个场景的字幕条数、条/秒、请求数、重试（429 / 5xx / 格式错误重问）、失败集数、墙钟时间与估算费用，
+可存为基线，改并发 / 分块后用同样参数重跑对比。每个场景另附按阶段的耗时分布（stages，见 tracing）；
+--trace-dir 时同时写出 Chrome trace 与 Prometheus 文本。
+--stall-rate 注入偶发卡顿（长尾），报告里的对冲次数（hedges / hedge_wins）、各模型耗时分位数与 step1 各语言用时
+可用来对比 --no-hedge 时的尾部延迟。
+
+    python benchmarks/bench_translate.py --episodes 6 --cues 120 --langs English,Thai,Spanish --out base.json
+
+桩服务的 429 / 503 会带 retry-after-ms（SDK 自身的重试在 _chat 里关闭，不会用到），重试只走 translator 的
+指数退避，与真实路径相同；退避基数默认缩短为 0.05 秒（--retry-delay），只缩短等待，不改变重试次数。记忆库、片段存储与耗时样本写到临时目录，不碰 temp/。
+"""
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from openai import OpenAI  # noqa: E402
+
+import config  # noqa: E402
+import latency  # noqa: E402
+import tracing  # noqa: E402
+import translator  # noqa: E402
+from benchmarks.mock_openai import MockOpenAI  # noqa: E402
+from step1 import _process_single_language  # noqa: E402
+
+_LINES = ["你到底想怎么样？", "我早就知道是你做的。", "别走，听我解释！", "这件事跟你没关系。",
+          "明天董事会之前，必须把合同签了。", "妈，我回来了。", "他根本不是你想的那种人。", "快叫救护车！"]
+
+
+def _ts(ms):
+    h, ms = divmod(ms, 3_600_000)
+    m, ms = divmod(ms, 60_000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def synth_episode(n_cues, seed=0):
+    """合成一集 SRT：n_cues 条、每条 1~2 行短台词，时间轴连续不重叠。"""
+    blocks, t = [], 0
+    for k in range(n_cues):
+        text = _LINES[(seed * 7 + k) % len(_LINES)]
+        if k % 5 == 4:
+            text += "\n" + _LINES[(seed + k * 3) % len(_LINES)]
+        blocks.append(f"{k + 1}\n{_ts(t)} --> {_ts(t + 1800)}\n{text}\n")
+        t += 2000
+    return "\n".join(blocks)
+
+
+def synth_season(root, episodes, n_cues):
+    root.mkdir(parents=True, exist_ok=True)
+    names = []
+    for e in range(episodes):
+        name = f"ep{e + 1:02d}.srt"
+        (root / name).write_text(synth_episode(n_cues, e), encoding="utf-8")
+        names.append(name)
+    return names
+
+
+def _summary(server, wall, cues, cost, failed, hedges=(0, 0)):
+    s = dict(server.stats)
+    stats = latency.tracker()
+    return {"cues": cues, "wall_s": round(wall, 3), "cues_per_s": round(cues / wall, 1) if wall else None,
+            "requests": s["requests"], "retries": s["rate_limited"] + s["server_errors"] + s["malformed"],
+            "rate_limited": s["rate_limited"], "server_errors": s["server_errors"], "malformed": s["malformed"],
+            "stalled": s["stalled"], "hedges": stats.hedges - hedges[0], "hedge_wins": stats.hedge_wins - hedges[1],
+            "failed_episodes": failed, "prompt_tokens": s["prompt_tokens"],
+            "completion_tokens": s["completion_tokens"], "cost_usd": round(cost, 6),
+            "latency_ms_per_token": {m: {k: round(v * 1000, 3) if k != "n" else v
+                                         for k, v in stats.percentiles(m).items()} for m in sorted(stats.samples)}}
+
+
+def _hedge_counts():
+    stats = latency.tracker()
+    return stats.hedges, stats.hedge_wins
+
+
+def bench_step1(server, client, args, work):
+    """Step 1 场景：各语言并发（与界面一致，最多 4 个线程），返回统计。"""
+    src = work / "src"
+    names = synth_season(src, args.episodes, args.cues)
+    langs = args.langs.split(",")
+    server.reset_stats()
+    hedges = _hedge_counts()
+    lang_wall = {}
+
+    def one(lang):
+        t = time.perf_counter()
+        out = _process_single_language(lang, names, client, src, work / "out", args.model, args.memory_model, True,
+                                       not args.no_segment_reuse)
+        lang_wall[lang] = round(time.perf_counter() - t, 3)
+        return out
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(len(langs), 4)) as ex:
+        results = list(ex.map(tracing.bind(one), langs))
+    wall = time.perf_counter() - t0
+    failed = sum(1 for logs, _ in results for line in logs if line.startswith("❌"))
+    result = _summary(server, wall, args.episodes * args.cues * len(langs), sum(c for _, c in results), failed,
+                      hedges)
+    result["lang_wall_s"] = lang_wall
+    return result
+
+
+def bench_translate_srt(server, client, args):
+    """translate_srt 场景：单语言逐集翻译，校验每集译文条数与原文一致。"""
+    lang = args.langs.split(",")[0]
+    episodes = [synth_episode(args.cues, e) for e in range(args.episodes)]
+    server.reset_stats()
+    hedges = _hedge_counts()
+    cost, failed = 0.0, 0
+    t0 = time.perf_counter()
+    for srt in episodes:
+        try:
+            out, c = translator.translate_srt(client, srt, lang, args.model, dict(translator.EMPTY_MEMORY))
+            cost += c
+            parsed = translator._parse_srt(out)
+            failed += parsed is None or len(parsed) != args.cues
+        except Exception:
+            failed += 1
+    wall = time.perf_counter() - t0
+    return _summary(server, wall, args.episodes * args.cues, cost, failed, hedges)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--episodes", type=int, default=6)
+    ap.add_argument("--cues", type=int, default=120, help="每集字幕条数")
+    ap.add_argument("--langs", default="English,Thai,Spanish")
+    ap.add_argument("--model", default=config.DEFAULT_TRANSLATE_MODEL)
+    ap.add_argument("--memory-model", default=config.DEFAULT_MEMORY_MODEL)
+    ap.add_argument("--latency", type=float, default=0.05, help="每个请求的固定延迟（秒）")
+    ap.add_argument("--token-rate", type=float, default=2000, help="每秒输出 token 数，0 表示不计生成耗时")
+    ap.add_argument("--rate-429", type=float, default=0.05)
+    ap.add_argument("--rate-5xx", type=float, default=0.02)
+    ap.add_argument("--malformed", type=float, default=0.03, help="翻译请求返回非 SRT 文本的概率")
+    ap.add_argument("--retry-delay", type=float, default=0.05, help="覆盖 config.RETRY_BASE_DELAY（秒）")
+    ap.add_argument("--stall-rate", type=float, default=0.0, help="请求偶发卡顿的概率（模拟长尾）")
+    ap.add_argument("--stall-latency", type=float, default=5.0, help="卡顿的额外延迟（秒）")
+    ap.add_argument("--no-hedge", action="store_true", help="关闭对冲请求（对比尾部延迟）")
+    ap.add_argument("--latency-file", help="沿用并更新此文件里的耗时样本（默认每次从零开始，样本不足时不对冲）")
+    ap.add_argument("--no-segment-reuse", action="store_true", help="step1 场景不复用跨集片段译文")
+    ap.add_argument("--scenario", choices=("all", "step1", "translate_srt"), default="all")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="结果 JSON 写入此文件（同时打印到标准输出）")
+    ap.add_argument("--trace-dir", help="把每个场景的追踪文件（.trace.json / .prom）写到此文件夹")
+    args = ap.parse_args(argv)
+
+    config.RETRY_BASE_DELAY = args.retry_delay
+    config.HEDGE_REQUESTS = not args.no_hedge
+    report = {"benchmark": "translate", "python": platform.python_version(), "platform": platform.platform(),
+              "params": {k: v for k, v in vars(args).items() if k not in ("out", "trace_dir", "latency_file")}, "scenarios": {}}
+    with tempfile.TemporaryDirectory(prefix="lantrans_bench_") as tmp:
+        work = Path(tmp)
+        config.memory_path = lambda lang: work / f"memory_{lang}.json"   # 不覆盖真实的翻译记忆与片段存储
+        config.MEMORY_DB = work / "memory.sqlite3"
+        config.segment_path = lambda lang: work / f"segments_{lang}.json"
+        config.LATENCY_PATH = Path(args.latency_file) if args.latency_file else work / "latency.json"
+        with MockOpenAI(latency=args.latency, token_rate=args.token_rate or None, error_rate=args.rate_429,
+                        server_error_rate=args.rate_5xx, malformed_rate=args.malformed, stall_rate=args.stall_rate,
+                        stall_latency=args.stall_latency, seed=args.seed) as server:
+            client = OpenAI(base_url=server.base_url, api_key="mock")
+            scenarios = {"step1": lambda: bench_step1(server, client, args, work),
+                         "translate_srt": lambda: bench_translate_srt(server, client, args)}
+            for name, bench in scenarios.items():
+                if args.scenario not in ("all", name):
+                    continue
+                tracer = tracing.start_run(f"bench_{name}")
+                try:
+                    result = bench()
+                finally:
+                    tracing.finish_run(tracer, args.trace_dir or work / "traces")
+                result["stages"] = tracer.summary()
+                report["scenarios"][name] = result
+            latency.tracker().save()
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    return report
+
+
+if __name__ == "__main__":
+    main()
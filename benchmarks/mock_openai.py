@@ -0,0 +1,180 @@
+"""本地 OpenAI 兼容桩服务：只实现 POST /v1/chat/completions，供吞吐基准与集成测试使用。与 Streamlit 无关。
+
+- 翻译请求（"Translate the following subtitles:"）：保留序号与时间轴，每行文本前加 [目标语言] 标记；
+- 记忆更新请求（系统提示含 "updates a JSON object"）：把 Previous memory 原样返回，episode_count + 1；
+- 可配置：固定延迟、按输出 token 速率计的生成耗时、429 / 5xx 注入（带 retry-after-ms）、
+  返回格式错误 SRT 的概率、偶发卡顿（长尾延迟）、x-ratelimit-* 限流额度响应头（多后端路由测试用）。随机数固定种子，同样参数的两次运行注入的错误序列相同（并发时按到达顺序）。
+- stats 记录请求数、各类注入次数与 token 用量，基准据此统计重试与费用。
+
+用法：
+    with MockOpenAI(latency=0.05, error_rate=0.05) as server:
+        client = OpenAI(base_url=server.base_url, api_key="mock")
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_LANG_RE = re.compile(r"translate subtitles into (.+?)\.")
+_TIMING_RE = re.compile(r"^\d+:\d+:\d+[,.]\d+\s*-->")
+_MEMORY_RE = re.compile(r"Previous memory: (.*?)\nTranslated SRT:", re.S)
+_SRT_MARK = "Translate the following subtitles:\n"
+MALFORMED = "Sorry, I cannot keep the SRT format for this part."
+
+
+def _tokens(text):
+    """粗略 token 数（约 4 字符一个），只用于模拟 usage 与生成耗时。"""
+    return max(1, len(text) // 4)
+
+
+def fake_translate(srt, lang):
+    """桩翻译：序号、时间轴、空行原样保留，文本行加 [语言] 前缀。"""
+    out = []
+    for line in srt.split("\n"):
+        s = line.strip()
+        out.append(line if not s or s.isdigit() or _TIMING_RE.match(s) else f"[{lang}] {s}")
+    return "\n".join(out)
+
+
+class MockOpenAI:
+    """可配置延迟与故障注入的 OpenAI 兼容桩服务（后台线程运行）。
+
+    latency：每个请求的固定延迟（秒）；token_rate：每秒输出 token 数（None 表示不计生成耗时）；
+    error_rate / server_error_rate：返回 429 / 503 的概率；malformed_rate：翻译请求返回非 SRT 文本的概率；
+    retry_after_ms：429 / 503 响应里建议的重试间隔（OpenAI SDK 会遵守）；
+    stall_rate / stall_latency：请求额外卡住 stall_latency 秒的概率（模拟长尾）；
+    request_limit：每个成功响应带 x-ratelimit-limit / remaining / reset-requests 头，剩余额度 = request_limit
+    减去已成功的请求数（reset_stats 时恢复），None 表示不带这些头。"""
+
+    def __init__(self, latency=0.0, token_rate=None, error_rate=0.0, server_error_rate=0.0, malformed_rate=0.0,
+                 retry_after_ms=10, stall_rate=0.0, stall_latency=5.0, request_limit=None, seed=0,
+                 host="127.0.0.1", port=0):
+        self.latency, self.token_rate = latency, token_rate
+        self.stall_rate, self.stall_latency = stall_rate, stall_latency
+        self.request_limit = request_limit
+        self.error_rate, self.server_error_rate, self.malformed_rate = error_rate, server_error_rate, malformed_rate
+        self.retry_after_ms = retry_after_ms
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {}
+        self.reset_stats()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"requests": 0, "ok": 0, "rate_limited": 0, "server_errors": 0, "malformed": 0,
+                          "stalled": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={"poll_interval": 0.05},
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- 请求处理 ---
+    def _draw(self):
+        """按到达顺序抽签，决定本请求的结果：error / server_error / malformed / ok，以及是否卡顿。"""
+        with self._lock:
+            self.stats["requests"] += 1
+            r = self._rng.random()
+            stall = bool(self.stall_rate) and self._rng.random() < self.stall_rate
+            self.stats["stalled"] += stall
+        stall = self.stall_latency if stall else 0.0
+        if r < self.error_rate:
+            return "rate_limited", stall
+        r -= self.error_rate
+        if r < self.server_error_rate:
+            return "server_errors", stall
+        r -= self.server_error_rate
+        return ("malformed" if r < self.malformed_rate else "ok"), stall
+
+    def _reply(self, body, outcome):
+        system, user = (m.get("content", "") for m in (body["messages"] + [{}, {}])[:2])
+        if "updates a JSON object" in system:
+            m = _MEMORY_RE.search(user)
+            try:
+                memory = json.loads(m.group(1)) if m else {}
+            except json.JSONDecodeError:
+                memory = {}
+            memory["episode_count"] = memory.get("episode_count", 0) + 1
+            return json.dumps(memory, ensure_ascii=False), "ok"
+        if outcome == "malformed":
+            return MALFORMED, outcome
+        m = _LANG_RE.search(system)
+        return fake_translate(user.split(_SRT_MARK, 1)[-1], m.group(1) if m else "xx"), "ok"
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):   # 不往 stderr 刷访问日志
+                pass
+
+            def _send(self, code, payload, headers=()):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in headers:
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    return self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+                outcome, stall = mock._draw()
+                time.sleep(mock.latency + stall)
+                if outcome in ("rate_limited", "server_errors"):
+                    with mock._lock:
+                        mock.stats[outcome] += 1
+                    code, kind = (429, "rate_limit_exceeded") if outcome == "rate_limited" else (503, "server_error")
+                    return self._send(code, {"error": {"message": f"injected {kind}", "type": kind, "code": kind}},
+                                      [("retry-after-ms", str(mock.retry_after_ms))])
+                content, outcome = mock._reply(body, outcome)
+                prompt = sum(_tokens(m.get("content", "")) for m in body.get("messages", []))
+                completion = _tokens(content)
+                if mock.token_rate:
+                    time.sleep(completion / mock.token_rate)
+                with mock._lock:
+                    mock.stats[outcome] += 1
+                    mock.stats["prompt_tokens"] += prompt
+                    mock.stats["completion_tokens"] += completion
+                    served = mock.stats["ok"] + mock.stats["malformed"]
+                headers = []
+                if mock.request_limit is not None:
+                    headers = [("x-ratelimit-limit-requests", str(mock.request_limit)),
+                               ("x-ratelimit-remaining-requests", str(max(0, mock.request_limit - served))),
+                               ("x-ratelimit-reset-requests", "1s")]
+                self._send(200, {
+                    "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+                    "model": body.get("model", "mock"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": prompt, "completion_tokens": completion,
+                              "total_tokens": prompt + completion},
+                }, headers)
+
+        return Handler
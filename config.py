@@ -17,13 +17,25 @@ if _im and not os.path.exists(_im):
 TEMP_DIR = Path("./temp")
 TEMP_DIR.mkdir(exist_ok=True)
 STYLE_FILE = TEMP_DIR / "subtitle_style.json"
+TRACE_DIR = TEMP_DIR / "traces"   # 每次批量翻译 / 烧录的阶段追踪（Chrome trace、Prometheus 文本、耗时汇总）
+TRACE_KEEP = 20                   # 只保留最近这么多次运行的追踪文件
+TRACE_FLUSH_TIMEOUT = 10.0        # 结束追踪时最多等这么多秒，补记仍在运行的对冲副本的用量
+
+
+MEMORY_DB = TEMP_DIR / "memory.sqlite3"   # 各语言的翻译记忆与逐集版本（见 memory_store）
+LATENCY_PATH = TEMP_DIR / "latency.json"  # 各模型请求耗时样本（跨运行沿用，见 latency）
 
 
 def memory_path(lang: str) -> Path:
-    """某语言的翻译记忆文件路径。"""
+    """某语言的旧版 JSON 翻译记忆文件路径（首次读取时由 memory_store 导入）。"""
     return TEMP_DIR / f"drama_memory_{lang}.json"
 
 
+def segment_path(lang: str) -> Path:
+    """某语言的片段译文存储路径（跨集复用，见 segment_store）。"""
+    return TEMP_DIR / f"segments_{lang}.json"
+
+
 # --- 模型与价格（美元 / 每百万 token），核对于 2026-06 ---
 # 来源：openai.com/api/pricing 及多家聚合站。换模型只改这里。
 MODEL_COST = {
@@ -36,6 +48,22 @@ MODEL_COST = {
     "gpt-5-nano": {"input": 0.05, "output": 0.40},
 }
 
+# --- 后端池（OpenAI 兼容端点，见 backends）---
+# 每项一个后端：多个 Key / 组织分摊额度，也可接入自建网关或本地 OpenAI 兼容服务（vLLM、Ollama 等）。
+# api_key_env 为存放 Key 的环境变量（.env），也可直接写 api_key（本地服务随便填）；base_url / organization 可选；
+# models 为该后端可用的模型（省略表示全部）；cost 为该后端的价格表（格式同 MODEL_COST，"*" 匹配任意模型），
+# 表里没有的模型按 MODEL_COST 计。没有 Key 的后端自动忽略。
+BACKENDS = [
+    {"name": "openai", "api_key_env": "OPENAI_API_KEY"},
+    # {"name": "openai-2", "api_key_env": "OPENAI_API_KEY_2", "organization": "org-xxxxxxxx"},
+    # {"name": "gateway", "base_url": "https://llm-gateway.example.com/v1", "api_key_env": "GATEWAY_API_KEY",
+    #  "cost": {"gpt-5.4-mini": {"input": 0.60, "output": 3.60}}},
+    # {"name": "local", "base_url": "http://127.0.0.1:8000/v1", "api_key": "local",
+    #  "models": ["gpt-5.4-nano"], "cost": {"*": {"input": 0.0, "output": 0.0}}},
+]
+BACKEND_COOLDOWN = 15.0        # 后端出错（5xx / 超时 / 连接失败）后暂停派发的秒数，连续出错时翻倍
+BACKEND_AUTH_COOLDOWN = 600.0  # Key 无效 / 无权限时暂停派发的秒数
+
 # 下拉框可选项（推荐项排第一）
 TRANSLATE_MODELS = ["gpt-5.4-mini", "gpt-5.4", "gpt-5.1", "gpt-5-mini", "gpt-5-nano"]
 MEMORY_MODELS = ["gpt-5.4-nano", "gpt-5-nano", "gpt-5.4-mini"]
@@ -72,6 +100,9 @@ PREVIEW_SAMPLES = {
     "Simplified Chinese": "字幕预览：这段文字会展示换行效果。",
 }
 
+# 设计器预览的最大显示宽度（像素）；更宽的源（如 4K）缩小后再合成显示，拖动滑块更流畅
+PREVIEW_MAX_WIDTH = 1280
+
 # 非拉丁文字语言：默认 Arial 字体无法渲染，需上传对应字体。
 NON_LATIN_LANGS = {"Arabic", "Hindi", "Thai", "Japanese", "Korean",
                    "Traditional Chinese", "Simplified Chinese"}
@@ -79,9 +110,21 @@ NON_LATIN_LANGS = {"Arabic", "Hindi", "Thai", "Japanese", "Korean",
 # --- 翻译稳健性 ---
 RETRY_ATTEMPTS = 4            # OpenAI 调用失败时的重试次数
 RETRY_BASE_DELAY = 2.0        # 指数退避基数（秒）：2, 4, 8...
+REQUEST_TIMEOUT_BASE = 30.0   # 单次请求超时 = 此基数 + 预计输出 token / REQUEST_MIN_TOKEN_RATE（秒），超时按可重试错误处理
+REQUEST_MIN_TOKEN_RATE = 10.0  # 可接受的最低输出速度（token/秒），低于此速度视为卡住
+HEDGE_REQUESTS = True         # 请求超过该模型历史 p95 仍未返回时，再发一个相同请求，先返回的为准
+HEDGE_MIN_SAMPLES = 20        # 某模型至少有这么多耗时样本才开始对冲
+HEDGE_MIN_DELAY = 1.0         # 对冲前至少等待的秒数（避免短请求被频繁重复发送）
+LATENCY_WINDOW = 200          # 每个模型保留最近多少个耗时样本
 CHUNK_CUES = 40              # 单次请求的最大字幕条数，超过则分块翻译，防止输出被截断
+ALIGN_TOLERANCE_MS = 500     # 译文时间戳与原文相差不超过此值（毫秒）仍视为同一条（模型抄错时间戳）
+ALIGN_REPAIR_ROUNDS = 2      # 译文对不齐的字幕最多补译几轮（每轮只重发未对齐的字幕）
 MAX_MEMORY_ITEMS = 150       # 翻译记忆中 characters / terminology 各自保留的最大条目数
 MAX_STYLE_NOTES = 800        # style_notes 的最大字符数
+SEGMENT_STORE_MAX = 20000    # 每种语言的片段译文存储最多保留的条目数（超出丢弃最早学到的）
+SEGMENT_FUZZY_THRESHOLD = 0.6  # 近似命中的最低字符二元组 Jaccard 相似度（命中的只作参考译文，不直接套用）
+SEGMENT_HINTS = 3            # 每条新台词最多附几条参考译文
+SHARED_BLOCK_MIN_CUES = 4    # 跨集共享块（回顾 / 片头）至少连续相同的字幕条数
 TRANSLATE_TEMPERATURE = None  # 0~1 可降低随机性；None=用模型默认。注意 GPT-5 系列可能不支持自定义温度
 
 # --- 字幕样式预设（短剧常用风格，一键套用）---
@@ -117,15 +160,43 @@ ENCODE_PRESETS = ["veryfast", "fast", "medium", "slow"]  # 越靠右越慢、压
 DEFAULT_PRESET = "medium"
 # libx264 preset → NVENC preset(p1 最快 … p7 最慢质量最好）
 NVENC_PRESET_MAP = {"veryfast": "p1", "fast": "p3", "medium": "p5", "slow": "p7"}
+VAAPI_DEVICE = "/dev/dri/renderD128"   # Linux VAAPI 硬件编码使用的设备节点
+
+# --- 软字幕封装（Step 3 不重编码模式）---
+# 字幕轨的语言标记（ISO 639-2），播放器据此显示语言名；键为 LANG_OPTIONS 的值
+SUBTITLE_LANG_CODES = {
+    "Arabic": "ara", "English": "eng", "Spanish": "spa", "Portuguese": "por", "German": "ger",
+    "French": "fre", "Italian": "ita", "Indonesian": "ind", "Hindi": "hin", "Thai": "tha", "Malay": "may",
+    "Japanese": "jpn", "Korean": "kor", "Traditional Chinese": "chi", "Simplified Chinese": "chi",
+}
 
-
-def get_api_key() -> str | None:
-    return os.getenv("OPENAI_API_KEY")
-
-
-def estimate_cost(input_tokens: int, output_tokens: int, model: str) -> float:
-    """按真实 token 数估算费用。未知模型返回 0。"""
-    if model not in MODEL_COST:
+# --- 字幕可读性检查（Step 2 批量检查，阈值可按平台规范调整）---
+LINT_MAX_CPS = 20.0           # 每秒字符数上限（不含空白）；Netflix 成人节目约 17~20
+LINT_MIN_DURATION = 0.8       # 单条字幕最短显示时长（秒）
+LINT_MAX_LINES = 2            # 样式未设置「最多行数」时按此行数判断超行
+LINT_REPORT_NAME = "subtitle_lint_report.csv"   # 写入被检查的文件夹
+
+# --- 烧录调度（Step 3 自适应并发）---
+NVENC_MAX_SESSIONS = 3        # 同时运行的 NVENC 会话上限（消费级 N 卡通常 3~5 路）
+NVENC_THREADS = 2             # NVENC 任务分给解码 / 滤镜的 CPU 线程数
+CPU_BUSY_THRESHOLD = 0.85     # 实测 CPU 利用率低于此值时，允许超出线程预算再起一个 CPU 任务
+SCHED_SETTLE_SECONDS = 5.0    # 启动 CPU 任务后至少等这么久再看利用率（等负载体现出来）
+
+
+def backend_specs() -> list[dict]:
+    """BACKENDS 中已配置 Key 的后端（api_key 已从环境变量解析），顺序不变。"""
+    out = []
+    for b in BACKENDS:
+        key = b.get("api_key") or (os.getenv(b["api_key_env"]) if b.get("api_key_env") else None)
+        if key:
+            out.append({**b, "api_key": key})
+    return out
+
+
+def estimate_cost(input_tokens: int, output_tokens: int, model: str, backend: str | None = None) -> float:
+    """按真实 token 数估算费用。backend 为实际处理请求的后端名，优先用它的价格表。未知模型返回 0。"""
+    table = next((b.get("cost") or {} for b in BACKENDS if b.get("name") == backend), {})
+    c = table.get(model) or table.get("*") or MODEL_COST.get(model)
+    if c is None:
         return 0.0
-    c = MODEL_COST[model]
     return input_tokens / 1_000_000 * c["input"] + output_tokens / 1_000_000 * c["output"]
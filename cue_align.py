@@ -0,0 +1,111 @@
+"""译文字幕与原文字幕的逐条对齐：与 Streamlit 无关。
+
+翻译不改时间轴、不增删字幕，但模型偶尔会漏掉一条、把相邻两条并成一条、把一条拆成两条，或抄错时间戳。
+以前一块译文只要能解析就照单全收（条数、时间轴错了也照样写出去），解析失败才整块重发。这里逐条对齐：
+1. 时间轴完全一致 → 对齐；
+2. 剩下的译文若横跨两条及以上原文 → 合并：文本无法可靠拆开，涉及的原文都算未对齐；
+3. 落在同一条原文时间范围内（前后放宽 config.ALIGN_TOLERANCE_MS）的译文 → 一条为时间戳抄错（漂移），
+   几条为拆分：按时间先后拼回一条；
+4. 序号一致、时间轴与原文重叠或两端相差不超过容差 → 漂移，按原文时间轴对齐；
+5. 仍没有译文的原文 → 缺失。
+只有合并与缺失的字幕（unaligned）需要重新请求，见 translator.translate_srt。空文本的原文不需要译文。
+"""
+import config
+
+
+class Alignment:
+    """对齐结果。texts 为 {原文位置: 译文}；drifted / split / merged / missing 为各类情况涉及的原文位置。"""
+    __slots__ = ("texts", "drifted", "split", "merged", "missing")
+
+    def __init__(self):
+        self.texts = {}
+        self.drifted, self.split, self.merged, self.missing = [], [], [], []
+
+    @property
+    def unaligned(self):
+        """需要重新请求的原文位置（升序）。"""
+        return sorted(self.merged + self.missing)
+
+    def counts(self):
+        return {"drifted": len(self.drifted), "split": len(self.split),
+                "merged": len(self.merged), "missing": len(self.missing)}
+
+
+def _near(cue, src, tol):
+    """译文与原文时间轴重叠，或两端都相差不超过 tol 毫秒。"""
+    return (cue.start < src.end and src.start < cue.end) or \
+        (abs(cue.start - src.start) <= tol and abs(cue.end - src.end) <= tol)
+
+
+def _overlap(a, b):
+    return min(a.end, b.end) - max(a.start, b.start)
+
+
+def _within(cue, src, tol):
+    return src.start - tol <= cue.start and cue.end <= src.end + tol
+
+
+def align(source, translated, tolerance_ms=None):
+    """把译文字幕列表 translated 对齐到原文字幕列表 source（均为 srt_cues.Cue），返回 Alignment。"""
+    tol = config.ALIGN_TOLERANCE_MS if tolerance_ms is None else tolerance_ms
+    result = Alignment()
+    used = [False] * len(translated)
+    todo = []
+    for pos, c in enumerate(source):
+        if not c.text.strip():
+            result.texts[pos] = c.text
+        else:
+            todo.append(pos)
+
+    # 1. 时间轴完全一致
+    by_timing = {}
+    for t, c in enumerate(translated):
+        by_timing.setdefault(c.timing, []).append(t)
+    rest = []
+    for pos in todo:
+        hits = by_timing.get(source[pos].timing)
+        if hits:
+            t = hits.pop(0)
+            used[t] = True
+            result.texts[pos] = translated[t].text
+        else:
+            rest.append(pos)
+
+    # 2. 合并 / 3. 拆分（含只是时间戳略有偏移、仍落在原文范围内的单条）
+    pieces, merged = {}, set()   # 原文位置 -> [译文位置]；合并涉及的原文位置
+    for t, c in enumerate(translated):
+        if used[t]:
+            continue
+        covered = [pos for pos in rest if _within(source[pos], c, tol)]
+        if len(covered) >= 2:
+            used[t] = True
+            merged.update(covered)
+            continue
+        homes = [pos for pos in rest if _within(c, source[pos], tol)]
+        if homes:
+            home = max(homes, key=lambda pos: _overlap(c, source[pos]))
+            used[t] = True
+            pieces.setdefault(home, []).append(t)
+
+    # 4. 序号一致、时间戳漂移出原文范围；5. 缺失
+    by_index = {}
+    for t, c in enumerate(translated):
+        if not used[t]:
+            by_index.setdefault(c.index, []).append(t)
+    for pos in rest:
+        if pos in merged:
+            result.merged.append(pos)
+        elif pos in pieces:
+            parts = sorted(pieces[pos], key=lambda t: translated[t].timing)
+            result.texts[pos] = "\n".join(translated[t].text for t in parts)
+            (result.split if len(parts) > 1 else result.drifted).append(pos)
+        else:
+            src = source[pos]
+            t = next((t for t in by_index.get(src.index, ()) if not used[t] and _near(translated[t], src, tol)), None)
+            if t is None:
+                result.missing.append(pos)
+                continue
+            used[t] = True
+            result.texts[pos] = translated[t].text
+            result.drifted.append(pos)
+    return result
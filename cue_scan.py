@@ -0,0 +1,70 @@
+"""字幕超宽 / 超行扫描：用与渲染器同一套排版测量（text_layout.fit_text），
+按渲染宽度与行数给真实 SRT 的每条字幕排序，找出最可能溢出的几条。与 Streamlit 无关。
+
+不需要烧录整集：换行与测量都有缓存，一季几十集的 SRT 扫描只需数秒；
+找出的字幕再由设计器在其时间点 seek 取帧合成预览。
+"""
+from pathlib import Path
+
+from cue_style import load_sidecar, styled
+from srt_cues import parse_srt
+from text_layout import fit_text, get_measurer, safe_text
+
+
+def parse_cues(text):
+    """解析 SRT 文本（srt_cues.parse_srt），返回 [(序号, 开始秒, 结束秒, 文本)]，跳过空字幕与无法识别的块。"""
+    cues = []
+    for c in parse_srt(text):
+        body = safe_text(c.text)
+        if body:
+            cues.append((c.index, c.start / 1000, c.end / 1000, body))
+    return cues
+
+
+def read_cues(path):
+    """读取 SRT 文件（UTF-8，容忍 BOM / CRLF），返回 parse_cues 的结果。"""
+    return parse_cues(Path(path).read_text(encoding="utf-8", errors="replace"))
+
+
+def measure_cue(text, style):
+    """按样式排版一条字幕，返回 {"wrapped", "lines", "width", "font_size", "shrunk", "too_wide", "too_many"}。
+    width 为最宽一行的渲染宽度（含描边 / 伪加粗外扩），与 render_block 的文字区域一致。
+    shrunk：因行数上限被自动缩字；too_wide：有行超出最大宽度（单词过长无法断开）；
+    too_many：缩到最小字号仍超过行数上限。内联样式标注（cue_style）先去掉，字号等覆盖项一并生效。"""
+    text, style = styled(text, style)
+    max_w, max_lines = style["max_text_width"], style.get("max_lines", 0)
+    wrapped, fs = fit_text(text, style["font_path"], style["font_size"], max_w, max_lines)
+    m = get_measurer(style["font_path"], fs)
+    lines = wrapped.split("\n")
+    edge = 2 * (style.get("stroke_width", 0) + style.get("bold", 0))
+    width = max(m.line_width(line) for line in lines) + edge
+    return {"wrapped": wrapped, "lines": len(lines), "width": width, "font_size": fs,
+            "shrunk": fs < style["font_size"], "too_wide": width - edge > max_w,
+            "too_many": bool(max_lines) and len(lines) > max_lines}
+
+
+def severity(metrics):
+    """排序键：先按问题类型（超宽 > 超行 > 缩字），再按行数、宽度，越大越差。"""
+    return (metrics["too_wide"], metrics["too_many"], metrics["shrunk"], metrics["lines"], metrics["width"])
+
+
+def rank_cues(cues, style, top=10, sidecar=None):
+    """cues 为 read_cues 的结果；返回最差的 top 条 [(cue, metrics)]，最差在前。
+    sidecar 为该 SRT 的旁路样式表（cue_style.load_sidecar），其中的字号等覆盖项参与测量。"""
+    scored = [(cue, measure_cue(*styled(cue[3], style, cue[0], sidecar))) for cue in cues]
+    scored.sort(key=lambda item: severity(item[1]), reverse=True)
+    return scored[:top]
+
+
+def scan_paths(paths, style, top=20):
+    """扫描多个 SRT（一季），返回全体中最差的 top 条 [(路径, cue, metrics)] 与读取失败列表 [(路径, 错误)]。"""
+    ranked, errors = [], []
+    for path in paths:
+        try:
+            cues = read_cues(path)
+        except Exception as e:
+            errors.append((Path(path), str(e)))
+            continue
+        ranked += [(Path(path), cue, m) for cue, m in rank_cues(cues, style, top, load_sidecar(path))]
+    ranked.sort(key=lambda item: severity(item[2]), reverse=True)
+    return ranked[:top], errors
@@ -0,0 +1,113 @@
+"""单条字幕的样式覆盖：SRT 内联标注与旁路样式表。与 Streamlit 无关。
+
+支持的 SRT 内联标注（整条生效，标注本身从文本中去掉）：
+- `{\\an1}`~`{\\an9}`：小键盘方位（8=顶部居中，2=底部居中，5=画面正中……），也接受 `{\\a6}` 等旧写法；
+- `<i>…</i>` / `<b>…</b>`：斜体 / 加粗；
+- `<font color="#RRGGBB">…</font>`：文字颜色。
+
+旁路样式表：与 SRT 同名的 `xxx.styles.json`，按字幕序号（或 "12-20" 区间）给出覆盖项，优先于内联标注：
+    {"12": {"position": "top", "font_color": "#FFE000"}, "30-32": {"italic": true, "font_size": 40}}
+可用字段：align（1~9）或 position（top / middle / bottom）、italic、bold、font_color、font_size。
+
+覆盖项以可哈希的元组形式在渲染缓存、叠加轨与清单之间传递；PIL 渲染（render_block）与 libass（build_ass）
+对同一覆盖项给出一致的结果。
+"""
+import json
+import re
+from pathlib import Path
+
+FIELDS = ("align", "italic", "bold", "font_color", "font_size")
+_POSITIONS = {"top": 8, "middle": 5, "center": 5, "bottom": 2}
+_LEGACY_ALIGN = {1: 1, 2: 2, 3: 3, 5: 7, 6: 8, 7: 9, 9: 4, 10: 5, 11: 6}   # SSA 的 \a 编号 → \an
+
+_ALIGN_RE = re.compile(r"\{\\(an?)(\d{1,2})\}")
+_ASS_BLOCK_RE = re.compile(r"\{\\[^}]*\}")
+_FONT_RE = re.compile(r"<font\b[^>]*?color\s*=\s*[\"']?(#?[0-9A-Fa-f]{6})[\"']?[^>]*>", re.I)
+_TAG_RE = re.compile(r"</?(?:i|b|u|s|font)\b[^>]*>", re.I)
+
+
+def parse_annotations(text):
+    """去掉内联标注，返回 (纯文本, 覆盖项 dict)。没有标注时返回原文与空 dict。"""
+    if "<" not in text and "{" not in text:
+        return text, {}
+    overrides = {}
+    m = _ALIGN_RE.search(text)
+    if m:
+        n = int(m.group(2))
+        align = n if m.group(1) == "an" else _LEGACY_ALIGN.get(n)
+        if align and 1 <= align <= 9:
+            overrides["align"] = align
+    if re.search(r"<i\b", text, re.I):
+        overrides["italic"] = True
+    if re.search(r"<b\b", text, re.I):
+        overrides["bold"] = True
+    m = _FONT_RE.search(text)
+    if m:
+        overrides["font_color"] = "#" + m.group(1).lstrip("#").upper()
+    clean = _TAG_RE.sub("", _ASS_BLOCK_RE.sub("", text))
+    return "\n".join(line.strip() for line in clean.split("\n")).strip(), overrides
+
+
+def _normalize(entry):
+    out = {}
+    if "position" in entry and entry["position"] in _POSITIONS:
+        out["align"] = _POSITIONS[entry["position"]]
+    for key in FIELDS:
+        if key in entry and entry[key] is not None:
+            out[key] = entry[key]
+    if "font_color" in out:
+        out["font_color"] = "#" + str(out["font_color"]).lstrip("#").upper()
+    return out
+
+
+def load_sidecar(srt_path):
+    """读取 SRT 同名的 .styles.json，返回 {序号: 覆盖项}；不存在或格式错误时返回 {}。"""
+    path = Path(srt_path).with_suffix(".styles.json")
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return {}
+    table = {}
+    for key, entry in data.items():
+        if not isinstance(entry, dict):
+            continue
+        lo, _, hi = str(key).partition("-")
+        try:
+            indexes = range(int(lo), int(hi or lo) + 1)
+        except ValueError:
+            continue
+        for i in indexes:
+            table.setdefault(i, {}).update(_normalize(entry))
+    return table
+
+
+def resolve(index, text, sidecar=None):
+    """一条字幕的 (纯文本, 覆盖项元组)。旁路样式表优先于内联标注；元组可作缓存键。"""
+    clean, overrides = parse_annotations(text)
+    if sidecar and index in sidecar:
+        overrides.update(sidecar[index])
+    return clean, freeze(overrides)
+
+
+def freeze(overrides):
+    return tuple(sorted(overrides.items()))
+
+
+def apply_overrides(style, overrides):
+    """把覆盖项（dict 或 resolve 得到的元组）并入样式，返回新 dict；无覆盖时原样返回。
+    bold 覆盖映射为 PIL 伪加粗至少 2 档；italic / align 为 render_block 与 build_ass 识别的样式字段。"""
+    if not overrides:
+        return style
+    merged = dict(style)
+    for key, value in dict(overrides).items():
+        if key == "bold":
+            merged["bold"] = max(style.get("bold", 0), 2) if value else 0
+        else:
+            merged[key] = value
+    return merged
+
+
+def styled(text, style, index=None, sidecar=None):
+    """便捷入口：返回 (纯文本, 该条字幕的实际样式)。"""
+    clean, overrides = resolve(index, text, sidecar)
+    return clean, apply_overrides(style, overrides)
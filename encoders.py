@@ -0,0 +1,166 @@
+"""视频编码器注册表：参数映射、可用性探测与自动选择。与 Streamlit 无关。
+
+取代「只认 h264_nvenc / libx264、按 `-encoders` 列表判断可用」：
+- 注册 libx264、libx265、SVT-AV1（CPU）与 NVENC、QSV、VAAPI（硬件），把界面上的 CRF / preset
+  统一映射成各编码器自己的质量与速度参数；
+- ffmpeg 带某个编码器不代表能用（没有显卡 / 驱动 / 设备节点），用 0.2 秒的小测试编码确认，
+  结果按 ffmpeg 可执行文件缓存在 temp/encoder_probe.json，下次启动不再重测；
+- 按策略（兼容 / 速度 / 体积）在可用编码器里自动挑选。只有软件编码器的 Linux 也能完整运行。
+"""
+import json
+import os
+import subprocess
+from functools import lru_cache
+
+import config
+from ffmpeg_utils import NO_WINDOW
+
+PROBE_FILE = config.TEMP_DIR / "encoder_probe.json"
+_SVT_PRESETS = {"veryfast": 10, "fast": 8, "medium": 6, "slow": 4}   # SVT-AV1：0 最慢 … 13 最快
+
+
+class Encoder:
+    """一个视频编码器。speed / efficiency 为相对评分（越大越快 / 同画质体积越小），用于自动选择。
+    input_args 放在 -i 之前（如 VAAPI 设备），upload 为接在滤镜链末尾的上传滤镜（硬件帧）。"""
+    __slots__ = ("name", "label", "codec", "hardware", "speed", "efficiency", "input_args", "upload", "_args")
+
+    def __init__(self, name, label, codec, hardware, speed, efficiency, args, input_args=(), upload=""):
+        self.name, self.label, self.codec, self.hardware = name, label, codec, hardware
+        self.speed, self.efficiency = speed, efficiency
+        self._args, self.input_args, self.upload = args, list(input_args), upload
+
+    def args(self, crf, preset):
+        """界面的 CRF（x264 标度）与 preset → 该编码器的视频参数（不含 -threads）。"""
+        return ["-c:v", self.name, *self._args(crf, preset)]
+
+
+def _x264(crf, preset):
+    return ["-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p"]
+
+
+def _x265(crf, preset):
+    # 同等观感下 x265 的 CRF 约比 x264 高 5；hvc1 标签让苹果设备也能播放 MP4
+    return ["-preset", preset, "-crf", str(min(51, crf + 5)), "-pix_fmt", "yuv420p", "-tag:v", "hvc1",
+            "-x265-params", "log-level=error"]
+
+
+def _svtav1(crf, preset):
+    # SVT-AV1 的 CRF 为 0~63，x264 的 23 大致对应 35
+    return ["-preset", str(_SVT_PRESETS.get(preset, 6)), "-crf", str(min(63, round(crf * 1.5))),
+            "-pix_fmt", "yuv420p"]
+
+
+def _nvenc(crf, preset):
+    # NVENC 默认效率差(码率偏高)，这里开启 AQ / 前瞻 / B帧 / 多遍，显著压低码率、贴近 libx264
+    return ["-preset", config.NVENC_PRESET_MAP.get(preset, "p5"), "-tune", "hq", "-rc", "vbr", "-cq", str(crf),
+            "-b:v", "0", "-multipass", "fullres", "-spatial-aq", "1", "-temporal-aq", "1",
+            "-rc-lookahead", "20", "-bf", "3", "-pix_fmt", "yuv420p"]
+
+
+def _qsv(crf, preset):
+    # ICQ 模式：global_quality 与 CRF 同档对应；QSV 的 preset 名与 x264 相同
+    return ["-preset", preset, "-global_quality", str(crf), "-pix_fmt", "nv12"]
+
+
+def _vaapi(crf, preset):
+    # 恒定 QP；preset 越慢 compression_level 越高（驱动不支持时忽略）
+    level = {"veryfast": 7, "fast": 5, "medium": 4, "slow": 1}.get(preset, 4)
+    return ["-rc_mode", "CQP", "-qp", str(crf), "-compression_level", str(level)]
+
+
+REGISTRY = {e.name: e for e in (
+    Encoder("libx264", "CPU · H.264 (libx264)", "h264", False, 3, 3, _x264),
+    Encoder("libx265", "CPU · H.265 (libx265)", "hevc", False, 1, 4, _x265),
+    Encoder("libsvtav1", "CPU · AV1 (SVT-AV1)", "av1", False, 2, 5, _svtav1),
+    Encoder("h264_nvenc", "GPU · H.264 (NVENC)", "h264", True, 6, 2, _nvenc),
+    Encoder("h264_qsv", "GPU · H.264 (Intel QSV)", "h264", True, 5, 2, _qsv),
+    Encoder("h264_vaapi", "GPU · H.264 (VAAPI)", "h264", True, 5, 1, _vaapi,
+            input_args=["-vaapi_device", config.VAAPI_DEVICE], upload="format=nv12,hwupload"),
+)}
+
+# 自动选择策略：策略名 -> (排序键, 是否只在 H.264 里选)
+POLICIES = {
+    "compat": (lambda e: (e.speed, e.efficiency), True),    # 平台兼容：H.264 里最快的（旧的「自动」）
+    "speed": (lambda e: (e.speed, e.efficiency), False),    # 速度优先
+    "size": (lambda e: (e.efficiency, e.speed), False),     # 体积优先：同画质最小
+}
+
+
+def get(name):
+    """按名称取编码器；未注册的名称按 libx264 参数处理。"""
+    return REGISTRY.get(name, REGISTRY["libx264"])
+
+
+def is_hardware(name):
+    return name in REGISTRY and REGISTRY[name].hardware
+
+
+def video_args(name, crf, preset):
+    return get(name).args(crf, preset)
+
+
+def _exe_key(exe):
+    """缓存键：ffmpeg 路径 + 大小 + 修改时间（换了 ffmpeg 就重测）。"""
+    try:
+        st = os.stat(exe)
+        return f"{os.path.abspath(exe)}|{st.st_size}|{int(st.st_mtime)}"
+    except OSError:
+        return str(exe)
+
+
+def _listed(exe):
+    try:
+        return subprocess.run([exe, "-hide_banner", "-encoders"], capture_output=True, text=True, timeout=15,
+                              stdin=subprocess.DEVNULL, creationflags=NO_WINDOW).stdout
+    except Exception:
+        return ""
+
+
+def trial_encode(exe, name):
+    """用 0.2 秒的黑场小样实际编码一次，能跑通才算可用。"""
+    enc = get(name)
+    vf = ",".join(filter(None, ["format=yuv420p", enc.upload]))
+    cmd = [exe, "-nostdin", "-hide_banner", "-loglevel", "error", *enc.input_args,
+           "-f", "lavfi", "-i", "color=c=black:s=256x144:r=10:d=0.2", "-vf", vf,
+           *enc.args(config.DEFAULT_CRF, config.DEFAULT_PRESET), "-frames:v", "2", "-f", "null", "-"]
+    try:
+        return subprocess.run(cmd, capture_output=True, timeout=30, stdin=subprocess.DEVNULL,
+                              creationflags=NO_WINDOW).returncode == 0
+    except Exception:
+        return False
+
+
+def probe_encoders(exe, refresh=False, cache_file=None):
+    """返回 {编码器名: 是否可用}。先看 `-encoders` 列表，列出的再做测试编码；结果按 ffmpeg 缓存到磁盘。"""
+    if not exe:
+        return {name: False for name in REGISTRY}
+    cache_file = cache_file or PROBE_FILE
+    key = _exe_key(exe)
+    try:
+        cache = json.loads(cache_file.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        cache = {}
+    known = cache.get(key, {})
+    if not refresh and all(name in known for name in REGISTRY):
+        return {name: known[name] for name in REGISTRY}
+    listed = _listed(exe)
+    result = {name: f" {name} " in listed and trial_encode(exe, name) for name in REGISTRY}
+    cache[key] = result
+    try:
+        cache_file.write_text(json.dumps(cache, ensure_ascii=False, indent=1), encoding="utf-8")
+    except OSError:
+        pass
+    return result
+
+
+@lru_cache(maxsize=4)
+def available(exe):
+    """本进程内缓存的可用编码器名元组（按注册顺序）。"""
+    return tuple(name for name, ok in probe_encoders(exe).items() if ok)
+
+
+def choose(policy, usable):
+    """按策略在可用编码器里挑一个；一个都没有时返回 libx264（最后的兜底）。"""
+    rank, h264_only = POLICIES[policy]
+    pool = [REGISTRY[n] for n in usable if n in REGISTRY and (REGISTRY[n].codec == "h264" or not h264_only)]
+    return max(pool, key=rank).name if pool else "libx264"
@@ -0,0 +1,204 @@
+"""ffmpeg 调用的公共逻辑，供 Step 3（烧录）与 Step 4（压缩）共用。与 Streamlit 无关。
+
+- 查找可用 ffmpeg（PATH 优先，其次 moviepy 自带的 imageio-ffmpeg）。
+- 探测时长 / 分辨率 / 帧率（解析 `ffmpeg -i` 输出，无需 ffprobe）。
+- 以流式方式解析 `-progress pipe:1`，实时回报每个任务的 fps、速度倍率与完成百分比。
+- 快速取帧：`-ss` 放在 `-i` 之前按关键帧索引直接跳转，只解码一帧，不随视频长度变慢。
+- BatchProgress 汇总一批任务，给出整体进度与剩余时间（ETA）。
+"""
+import io
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from functools import lru_cache
+
+from PIL import Image
+
+import tracing
+
+# Windows 下不弹黑框
+NO_WINDOW = subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0
+
+
+@lru_cache(maxsize=1)
+def find_ffmpeg():
+    """返回任意可用的 ffmpeg 路径（不要求 libass）；找不到返回 None。"""
+    exe = shutil.which("ffmpeg")
+    if exe:
+        return exe
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return None
+
+
+_DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_VIDEO_RE = re.compile(r"Stream #.*?Video:.*?,\s*(\d{2,5})x(\d{2,5})")
+_FPS_RE = re.compile(r"Stream #.*?Video:.*?,\s*(\d+(?:\.\d+)?)\s*fps")
+
+
+def probe(exe, path):
+    """探测视频时长（秒）、分辨率与帧率，返回 {"duration", "width", "height", "fps"}；取不到的项为 None/0。
+    ffmpeg 只给了 -i 没给输出时会以非零码退出，但信息已打印在 stderr 里，照常解析。"""
+    with tracing.span("ffprobe"):
+        r = subprocess.run([exe, "-hide_banner", "-nostdin", "-i", str(path)], capture_output=True, text=True,
+                           errors="replace", timeout=60, stdin=subprocess.DEVNULL, creationflags=NO_WINDOW)
+    info = {"duration": None, "width": 0, "height": 0, "fps": 0.0}
+    m = _DURATION_RE.search(r.stderr)
+    if m:
+        h, mi, s = m.groups()
+        info["duration"] = int(h) * 3600 + int(mi) * 60 + float(s)
+    m = _VIDEO_RE.search(r.stderr)
+    if m:
+        info["width"], info["height"] = int(m.group(1)), int(m.group(2))
+    m = _FPS_RE.search(r.stderr)
+    if m:
+        info["fps"] = float(m.group(1))
+    return info
+
+
+def extract_frame(exe, path, t, width=None):
+    """取 t 秒处的一帧，返回 PIL RGB 图像。width 不为空时按宽度等比缩放（缩略图用）。
+    seek 在输入端，大文件也只需读取关键帧附近的数据。"""
+    cmd = [exe, "-hide_banner", "-nostdin", "-loglevel", "error", "-ss", f"{max(0.0, t):.3f}", "-i", str(path),
+           "-frames:v", "1"]
+    if width:
+        cmd += ["-vf", f"scale={int(width)}:-2"]
+    cmd += ["-f", "image2pipe", "-vcodec", "png", "-"]
+    r = subprocess.run(cmd, capture_output=True, timeout=120, stdin=subprocess.DEVNULL, creationflags=NO_WINDOW)
+    if r.returncode != 0 or not r.stdout:
+        raise RuntimeError(r.stderr.decode("utf-8", "replace")[-300:] or f"无法在 {t:.2f}s 处取帧")
+    return Image.open(io.BytesIO(r.stdout)).convert("RGB")
+
+
+class ProgressParser:
+    """把 `-progress` 输出的 key=value 行累积成快照；每遇到 `progress=` 行产出一次。
+
+    快照字段：out_time（已编码的媒体秒数）、fps、speed（相对实时的倍率）、
+    percent（0~1，未知时长时为 None）、done（是否结束）。"""
+
+    def __init__(self, duration=None):
+        self.duration = duration
+        self._cur = {}
+
+    def feed(self, line):
+        """喂入一行，若构成完整快照则返回 dict，否则返回 None。"""
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return None
+        if key != "progress":
+            self._cur[key] = value.strip()
+            return None
+        cur, self._cur = self._cur, {}
+        out_us = cur.get("out_time_us") or cur.get("out_time_ms")  # 旧版 ffmpeg 的 out_time_ms 实为微秒
+        try:
+            out_time = max(0.0, int(out_us) / 1e6)
+        except (TypeError, ValueError):
+            out_time = 0.0
+        snap = {"out_time": out_time, "fps": _to_float(cur.get("fps")),
+                "speed": _to_float((cur.get("speed") or "").rstrip("x")),
+                "percent": None, "done": value.strip() == "end"}
+        if self.duration:
+            snap["percent"] = 1.0 if snap["done"] else min(1.0, out_time / self.duration)
+        return snap
+
+
+def _to_float(s):
+    try:
+        return float(s)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def run_ffmpeg(cmd, duration=None, on_progress=None):
+    """运行 ffmpeg 并流式解析进度。cmd[0] 为 ffmpeg 路径，进度参数自动插入。
+    on_progress(snapshot) 在每次进度更新时被调用（在调用方线程中）。
+    返回 (returncode, stderr 文本)。stderr 由后台线程持续读空，避免管道写满卡死。"""
+    cmd = [cmd[0], "-progress", "pipe:1", "-nostats", *cmd[1:]]
+    # -nostdin / stdin=DEVNULL：ffmpeg 默认会读 stdin，被 Streamlit 这类无控制台进程拉起时会卡住
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL,
+                            text=True, errors="replace", creationflags=NO_WINDOW)
+    err_chunks = []
+    drain = threading.Thread(target=lambda: err_chunks.append(proc.stderr.read()), daemon=True)
+    drain.start()
+    parser = ProgressParser(duration)
+    for line in proc.stdout:
+        snap = parser.feed(line)
+        if snap is not None and on_progress is not None:
+            on_progress(snap)
+    proc.wait()
+    drain.join()
+    return proc.returncode, "".join(err_chunks)
+
+
+def format_eta(seconds):
+    """秒数 → 「1h02m」/「3m05s」/「42s」；未知返回 「--」。"""
+    if seconds is None:
+        return "--"
+    s = int(seconds)
+    if s >= 3600:
+        return f"{s // 3600}h{s % 3600 // 60:02d}m"
+    if s >= 60:
+        return f"{s // 60}m{s % 60:02d}s"
+    return f"{s}s"
+
+
+class BatchProgress:
+    """一批编码任务的整体进度。工作线程调用 start/update/finish，主线程读 summary() 刷新界面。
+
+    ETA 按「已处理媒体秒数 / 已用墙钟时间」得到的整体吞吐估算剩余媒体时长所需时间，
+    因此并行任务越多、编码越快，ETA 自然越短。"""
+
+    def __init__(self, durations=None):
+        self._lock = threading.Lock()
+        self._t0 = time.time()
+        self.jobs = {}   # key -> {"duration", "out_time", "fps", "speed", "state"}
+        for key, dur in (durations or {}).items():
+            self.add(key, dur)
+
+    def add(self, key, duration):
+        with self._lock:
+            self.jobs[key] = {"duration": duration or 0.0, "out_time": 0.0, "fps": 0.0, "speed": 0.0,
+                              "state": "pending"}
+
+    def start(self, key, duration=None):
+        with self._lock:
+            job = self.jobs.setdefault(key, {"duration": 0.0, "out_time": 0.0, "fps": 0.0, "speed": 0.0})
+            if duration:
+                job["duration"] = duration
+            job["out_time"], job["state"] = 0.0, "running"
+
+    def update(self, key, snap):
+        with self._lock:
+            job = self.jobs.get(key)
+            if job is not None:
+                job.update(out_time=snap["out_time"], fps=snap["fps"], speed=snap["speed"])
+
+    def finish(self, key, counted=True):
+        """counted=False 表示跳过 / 失败，不计入吞吐，也不再占用剩余量。"""
+        with self._lock:
+            job = self.jobs.get(key)
+            if job is None:
+                return
+            job["state"] = "done" if counted else "dropped"
+            if counted:
+                job["out_time"] = job["duration"]
+
+    def summary(self, pending=0):
+        """返回 {"percent", "eta", "running": [(key, job快照)...]}。
+        pending 为还没加入（尚未探测时长）的任务数，按已知任务的平均时长计入剩余量。"""
+        with self._lock:
+            live = [j for j in self.jobs.values() if j["state"] != "dropped"]
+            total = sum(j["duration"] for j in live)
+            if pending and live:
+                total += pending * total / len(live)
+            done = sum(min(j["out_time"], j["duration"]) for j in live)
+            running = [(k, dict(j)) for k, j in self.jobs.items() if j["state"] == "running"]
+        elapsed = time.time() - self._t0
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (total - done) / rate if rate > 0 else None
+        return {"percent": done / total if total else 0.0, "eta": eta, "running": running}
@@ -0,0 +1,89 @@
+"""libass 烧录前的字体准备：把所选字体子集化为本集字幕用到的字形，单独放进一个 fontsdir。与 Streamlit 无关。
+
+原先把字体所在的整个目录（fonts/ 或系统字体目录）作为 fontsdir，N 个并行 ffmpeg 各自
+扫描、加载其中每个字体，大体积 CJK .ttc 让 libass 启动很慢。现在：
+- 装了 fontTools 时按「字体内容 + 字形集合」缓存子集字体（通常只有几十 KB）；
+- 没装 fontTools 或子集化失败时退回为只放原字体一个文件（按字体内容缓存，仍免去扫描整个目录）；
+- 缓存目录在 temp/font_subsets 下，只保留最近使用的若干个。
+"""
+import hashlib
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import config
+from manifest import file_fingerprint
+
+KEEP_SUBSETS = 32   # 最多保留的子集目录数
+_ALWAYS = "  …—-.,!?'\"():;"   # 常用标点始终保留，重排时插入的字符也能显示
+
+
+def glyph_set(texts):
+    """字幕里用到的全部字符（排序后的字符串，作为缓存键的一部分）。"""
+    chars = set(_ALWAYS)
+    for text in texts:
+        chars.update(text)
+    chars.discard("\n")
+    return "".join(sorted(chars))
+
+
+def _subset(font_path, chars, out_path):
+    """用 fontTools 生成子集字体；保留全部名称表与排版特性，libass 仍按原字体名找到它。"""
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+
+    logging.getLogger("fontTools.subset").setLevel(logging.ERROR)   # 不认识的表直接丢弃，不必刷屏
+    options = subset.Options()
+    options.name_IDs = ["*"]
+    options.name_languages = ["*"]
+    options.layout_features = ["*"]
+    options.notdef_outline = True
+    font = TTFont(font_path, fontNumber=0, lazy=True)   # .ttc 取第一个字体，与 PIL 默认一致
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=[ord(c) for c in chars])
+    subsetter.subset(font)
+    font.save(out_path)
+
+
+def prepare_fontsdir(font_path, texts, cache_dir=None):
+    """返回只含所选字体（子集或原文件）的目录，供 subtitles 滤镜的 fontsdir 使用。"""
+    font_path = Path(font_path)
+    cache_dir = Path(cache_dir or config.TEMP_DIR / "font_subsets")
+    chars = glyph_set(texts)
+    try:
+        import fontTools  # noqa: F401
+        subset_ok = True
+    except ImportError:
+        subset_ok = False
+    key = hashlib.blake2b(f"{file_fingerprint(font_path)}|{chars if subset_ok else ''}".encode("utf-8"),
+                          digest_size=10).hexdigest()
+    target = cache_dir / key
+    if target.is_dir() and any(target.iterdir()):
+        os.utime(target)   # 标记为最近使用
+        return target
+    tmp = cache_dir / f"{key}.part{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    suffix = ".otf" if font_path.suffix.lower() == ".otf" else ".ttf"   # 子集总是单字体文件
+    try:
+        if not subset_ok:
+            raise ImportError
+        _subset(font_path, chars, tmp / f"subset{suffix}")
+    except Exception:
+        for f in tmp.iterdir():
+            f.unlink()
+        shutil.copy2(font_path, tmp / font_path.name)
+    try:
+        tmp.rename(target)
+    except OSError:             # 并行任务已生成同一子集
+        shutil.rmtree(tmp, ignore_errors=True)
+    _prune(cache_dir, keep=target)
+    return target
+
+
+def _prune(cache_dir, keep):
+    dirs = sorted((p for p in cache_dir.iterdir() if p.is_dir() and p != keep and ".part" not in p.name),
+                  key=lambda p: p.stat().st_mtime, reverse=True)
+    for p in dirs[KEEP_SUBSETS - 1:]:
+        shutil.rmtree(p, ignore_errors=True)
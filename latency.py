@@ -0,0 +1,142 @@
+"""模型请求的耗时统计、截止时间与对冲请求：与 Streamlit 无关。
+
+一次卡住的 completion 会占住 Step 1 的一个语言线程好几分钟，最慢的语言决定整批的结束时间。这里：
+- 截止时间：每个请求的超时 = REQUEST_TIMEOUT_BASE + 预计输出 token / REQUEST_MIN_TOKEN_RATE，
+  超时按可重试错误处理（见 translator._chat）；
+- 耗时统计：按模型记录「耗时 / 预计输出 token」，保留最近 LATENCY_WINDOW 个样本，持久化到 config.LATENCY_PATH，
+  下次运行直接沿用；
+- 对冲：某模型样本够 HEDGE_MIN_SAMPLES 个后，请求超过其 p95（按本次预计输出 token 换算）仍未返回，
+  就再发一个相同请求，先成功的为准，另一个作废。
+
+注意：同步 SDK 无法中断已经发出的非流式请求。作废的请求若尚未开始会直接取消，否则在后台线程里跑完
+（受截止时间约束）后丢弃结果，它的 token 照常计费：call 把已发出的作废请求交回调用方，由调用方计入费用
+（见 translator._chat）；只有超过 p95 才对冲，额外请求约占 5%。
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import config
+
+_POOL = ThreadPoolExecutor(max_workers=64, thread_name_prefix="hedge")
+
+
+def estimate_tokens(text):
+    """粗略的 token 数：中日韩等宽字符每字约 1 个，其余约 4 个字符 1 个。"""
+    wide = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return wide + (len(text) - wide) // 4 + 1
+
+
+def deadline(expected_tokens):
+    """按预计输出 token 数换算的单次请求超时（秒）。"""
+    return config.REQUEST_TIMEOUT_BASE + expected_tokens / config.REQUEST_MIN_TOKEN_RATE
+
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class LatencyStats:
+    """各模型的请求耗时样本（秒 / 预计输出 token）。线程安全，Step 1 各语言线程共用一个实例。"""
+
+    def __init__(self, path=None, window=None):
+        self.path = path
+        self.window = window or config.LATENCY_WINDOW
+        self.samples = {}
+        self.hedges = self.hedge_wins = 0   # 本进程内：发出的对冲请求 / 其中先返回的
+        self._lock = threading.Lock()
+        if path is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.samples = {m: [float(x) for x in v][-self.window:]
+                                for m, v in (data.get("models") or {}).items()}
+            except (json.JSONDecodeError, OSError, AttributeError, TypeError, ValueError):
+                pass
+
+    def record(self, model, seconds, expected_tokens):
+        with self._lock:
+            values = self.samples.setdefault(model, [])
+            values.append(seconds / max(1, expected_tokens))
+            del values[:-self.window]
+
+    def _count(self, attr):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def percentiles(self, model):
+        """{"n", "p50", "p90", "p95", "p99"}（秒 / token）；没有样本时只有 n=0。"""
+        with self._lock:
+            values = sorted(self.samples.get(model, ()))
+        if not values:
+            return {"n": 0}
+        return {"n": len(values), **{f"p{q}": _percentile(values, q / 100) for q in (50, 90, 95, 99)}}
+
+    def hedge_delay(self, model, expected_tokens):
+        """该请求等多久还没返回就对冲（秒）；样本不足或未开启对冲时为 None。"""
+        if not config.HEDGE_REQUESTS:
+            return None
+        p = self.percentiles(model)
+        if p["n"] < config.HEDGE_MIN_SAMPLES:
+            return None
+        return max(config.HEDGE_MIN_DELAY, p["p95"] * max(1, expected_tokens))
+
+    def save(self):
+        """原子写入（先写临时文件再替换）。"""
+        if self.path is None:
+            return
+        with self._lock:
+            data = {"version": 1, "models": {m: [round(x, 6) for x in v] for m, v in self.samples.items()}}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def tracker():
+    """进程内共用的耗时统计（config.LATENCY_PATH；路径变了会重新加载）。"""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None or _tracker.path != config.LATENCY_PATH:
+            _tracker = LatencyStats(config.LATENCY_PATH)
+        return _tracker
+
+
+def call(fn, model, expected_tokens, stats=None):
+    """执行 fn()（一次模型请求），必要时对冲。返回 (结果, 是否发出对冲, 结果是否来自对冲请求, 作废的请求)。
+    作废的请求为已经发出、无法取消的 Future 列表（可能仍在运行）：它们同样计费，调用方可从 result() 取用量。
+    每个成功返回的请求（含作废的那个）都记入耗时统计；两个都失败时抛出后失败的那个异常。"""
+    stats = tracker() if stats is None else stats
+
+    def timed():
+        t0 = time.perf_counter()
+        out = fn()
+        stats.record(model, time.perf_counter() - t0, expected_tokens)
+        return out
+
+    delay = stats.hedge_delay(model, expected_tokens)
+    if delay is None:
+        return timed(), False, False, []
+    primary = _POOL.submit(timed)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result(), False, False, []
+    hedge = _POOL.submit(timed)
+    stats._count("hedges")
+    pending, err = {primary, hedge}, None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for f in done:
+            if f.exception() is None:
+                losers = [g for g in ({primary, hedge} - {f}) if not g.cancel()]
+                if f is hedge:
+                    stats._count("hedge_wins")
+                return f.result(), True, f is hedge, losers
+            err = f.exception()
+    raise err
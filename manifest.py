@@ -0,0 +1,134 @@
+"""输出目录的内容指纹清单：判断某个输出是否「过期」，只重做真正需要重做的文件。
+
+取代原先的「输出文件存在就跳过」：源 SRT / 视频 / 字体内容或样式、编码参数一旦变化，
+对应输出就会被重新生成；都没变则直接跳过，既保证增量重建正确，也不浪费重新编码。
+
+- 大文件（视频）用分段采样哈希：文件大小 + 均匀分布的若干小段内容，秒级完成。
+- 设置用稳定序列化后的摘要，字段顺序无关。
+- 清单按输出目录一份（隐藏文件），原子写入，线程安全（Step 1/3 在工作线程里并发记录）。
+"""
+import hashlib
+import json
+import os
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+MANIFEST_NAME = ".lantrans_manifest.json"
+_FULL_HASH_LIMIT = 8 * 1024 * 1024   # 小于此大小的文件整体哈希
+_SAMPLE_COUNT = 16                   # 大文件采样段数（含首尾）
+_SAMPLE_SIZE = 64 * 1024             # 每段字节数
+
+_HASH_CACHE_SIZE = 4096             # 指纹缓存条数上限（Streamlit 进程常驻，不能随文件数无限增长）
+
+
+def _sampled_digest(f, size) -> str:
+    """对可 seek 的二进制流计算指纹：小文件整体哈希，大文件按大小 + 均匀采样段哈希。"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(size).encode())
+    f.seek(0)
+    if size <= _FULL_HASH_LIMIT:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    else:
+        step = (size - _SAMPLE_SIZE) // (_SAMPLE_COUNT - 1)
+        for i in range(_SAMPLE_COUNT):
+            f.seek(i * step)
+            h.update(f.read(_SAMPLE_SIZE))
+    return h.hexdigest()
+
+
+def file_fingerprint(path) -> str:
+    """文件内容指纹。小文件整体哈希；大文件按大小 + 均匀采样段哈希（对视频足够区分且很快）。"""
+    st = os.stat(path)
+    return _cached_digest(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+@lru_cache(maxsize=_HASH_CACHE_SIZE)
+def _cached_digest(path, size, mtime_ns):
+    """按 (路径, 大小, mtime_ns) 缓存的指纹；文件改动后键随之变化，同一次运行里重复检查不再读盘。"""
+    with open(path, "rb") as f:
+        return _sampled_digest(f, size)
+
+
+def stream_fingerprint(f) -> str:
+    """内存 / 上传文件对象的指纹，与同内容文件的 file_fingerprint 相同。读取后把位置复原到开头。"""
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    try:
+        return _sampled_digest(f, size)
+    finally:
+        f.seek(0)
+
+
+def settings_digest(settings: dict) -> str:
+    """设置摘要：排序键后序列化，元组/列表等价，非 JSON 类型按 str 处理。"""
+    blob = json.dumps(settings, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(blob.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def signature(inputs: dict, settings: dict) -> dict:
+    """某个输出的完整签名：{"inputs": {角色: 指纹}, "settings": 摘要}。
+    inputs 的值为文件路径；不存在的路径（如未上传字体）记为空串。"""
+    return {
+        "inputs": {role: (file_fingerprint(p) if p and os.path.isfile(p) else "")
+                   for role, p in sorted(inputs.items())},
+        "settings": settings_digest(settings),
+    }
+
+
+class Manifest:
+    """一个输出目录的指纹清单。
+
+    用法：
+        m = Manifest(output_dir)
+        sig = signature({"srt": src}, {"lang": lang})
+        if m.is_fresh(name, sig): 跳过
+        ... 生成输出 ...
+        m.record(name, sig)
+    """
+
+    def __init__(self, output_dir):
+        self.dir = Path(output_dir)
+        self.path = self.dir / MANIFEST_NAME
+        self._lock = threading.Lock()
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            self.entries = data.get("entries", {}) if isinstance(data, dict) else {}
+        except (json.JSONDecodeError, OSError):
+            self.entries = {}
+
+    def is_fresh(self, name: str, sig: dict, adopt: bool = False) -> bool:
+        """输出存在且签名一致 → True。
+        adopt=True 时，对「有输出但清单里没有记录」的旧产物直接认领（记录当前签名并视为最新），
+        避免升级后第一次运行把历史输出全部重做；否则无记录即视为过期。"""
+        if not (self.dir / name).exists():
+            return False
+        with self._lock:
+            entry = self.entries.get(name)
+        if entry is None:
+            if adopt:
+                self.record(name, sig)
+                return True
+            return False
+        return entry == sig
+
+    def record(self, name: str, sig: dict) -> None:
+        """记录输出签名并立即落盘。"""
+        with self._lock:
+            self.entries[name] = sig
+            self._flush()
+
+    def forget(self, name: str) -> None:
+        """删除某输出的记录（生成失败时调用，下次必定重做）。"""
+        with self._lock:
+            if self.entries.pop(name, None) is not None:
+                self._flush()
+
+    def _flush(self) -> None:
+        """先写临时文件再替换：中途崩溃也不会留下半截清单。调用方须持有锁。"""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"version": 1, "entries": self.entries}, ensure_ascii=False, indent=1),
+                       encoding="utf-8")
+        os.replace(tmp, self.path)
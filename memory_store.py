@@ -0,0 +1,190 @@
+"""翻译记忆的 SQLite 存储：按语言、按集保留版本，写入只记增量。与 Streamlit 无关。
+
+取代每种语言一个、每集整份重写的 drama_memory_<语言>.json：
+- entries 表只追加：(语言, 类别, 键, 值, 版本)。某版本的快照 = 每个键在该版本及之前的最新一行，
+  所以「第 N 集时的记忆」只是一次带上限的查询；
+- latest 表是每个键的当前值，与 entries 在同一事务里更新：读取最新记忆只扫当前的键，不随历史增长；
+- versions 表每次提交一行：来源集、累计集数、style_notes；
+- 提交以读取时的版本为基准算增量（只写这次真正改动的键），基准值只按本次提交涉及的键走主键索引查询，
+  写锁内的开销与改动量成正比而非与历史长度成正比。在 BEGIN IMMEDIATE 事务里追加，
+  Step 1 各语言线程与同时打开的 Step 2 并发写入互不覆盖：别人新加的键不会因为自己没见过而丢失；
+- 读取按最近更新排序，characters / terminology 各取最近 config.MAX_MEMORY_ITEMS 条（见 translator.trim_memory），
+  更早的只是不再进入 prompt，历史仍在。模型返回的记忆里漏掉的键不视为删除。
+
+首次读取某语言时，若存在旧版 JSON 记忆文件（config.memory_path），自动导入为第一个版本。
+"""
+import json
+import sqlite3
+import time
+from contextlib import closing
+
+import config
+from translator import EMPTY_MEMORY, load_memory, trim_memory
+
+KINDS = ("characters", "terminology")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    lang TEXT NOT NULL, version INTEGER NOT NULL, episode TEXT, episode_count INTEGER NOT NULL,
+    style_notes TEXT NOT NULL, changes INTEGER NOT NULL, created REAL NOT NULL,
+    PRIMARY KEY (lang, version));
+CREATE TABLE IF NOT EXISTS entries (
+    lang TEXT NOT NULL, kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, version INTEGER NOT NULL,
+    PRIMARY KEY (lang, kind, key, version));
+CREATE INDEX IF NOT EXISTS entries_by_version ON entries (lang, version);
+CREATE TABLE IF NOT EXISTS latest (
+    lang TEXT NOT NULL, kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, version INTEGER NOT NULL,
+    PRIMARY KEY (lang, kind, key));
+"""
+_SCHEMA_VERSION = 1   # PRAGMA user_version：1 = 有 latest 表（旧库首次打开时从 entries 回填）
+_IN_CHUNK = 500       # IN (...) 每批的键数，低于 SQLite 的参数个数上限
+
+
+def _dump(v):
+    return json.dumps(v, ensure_ascii=False, sort_keys=True)
+
+
+class MemoryStore:
+    """翻译记忆库（默认 config.MEMORY_DB）。每次操作单独开连接，可在任意线程中使用。"""
+
+    def __init__(self, path=None):
+        self.path = path or config.MEMORY_DB
+        with closing(self._connect()) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+            if db.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                db.execute("BEGIN IMMEDIATE")
+                if db.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                    db.execute("INSERT OR REPLACE INTO latest SELECT lang, kind, key, value, MAX(version) "
+                               "FROM entries GROUP BY lang, kind, key")
+                    db.execute(f"PRAGMA user_version={_SCHEMA_VERSION}")
+                db.execute("COMMIT")
+
+    def _connect(self):
+        return sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+
+    # --- 读取 ---
+    def languages(self):
+        with closing(self._connect()) as db:
+            return [r[0] for r in db.execute("SELECT DISTINCT lang FROM versions ORDER BY lang")]
+
+    def latest_version(self, lang):
+        with closing(self._connect()) as db:
+            return db.execute("SELECT COALESCE(MAX(version), 0) FROM versions WHERE lang=?", (lang,)).fetchone()[0]
+
+    @staticmethod
+    def _head(db, lang, version):
+        """版本 version 及之前最后一行 versions：(累计集数, style_notes JSON)；没有时为 None。"""
+        return db.execute("SELECT episode_count, style_notes FROM versions WHERE lang=? AND version<=? "
+                          "ORDER BY version DESC LIMIT 1", (lang, version)).fetchone()
+
+    def _snapshot(self, db, lang, version, latest=False):
+        """某版本的完整记忆（不裁剪），键按最近更新排序（最新的在后）。
+        latest 表示 version 就是当前最新版本：直接读 latest 表，不扫历史。"""
+        head = self._head(db, lang, version)
+        memory = {"episode_count": head[0] if head else 0, "characters": {}, "terminology": {},
+                  "style_notes": json.loads(head[1]) if head else ""}
+        if latest:
+            rows = db.execute("SELECT kind, key, value, version FROM latest WHERE lang=? "
+                              "ORDER BY version, kind, key", (lang,))
+        else:
+            # SQLite 保证与 MAX() 同行的裸列取自取到最大值的那一行
+            rows = db.execute("SELECT kind, key, value, MAX(version) AS v FROM entries WHERE lang=? AND version<=? "
+                              "GROUP BY kind, key ORDER BY v, kind, key", (lang, version))
+        for kind, key, value, _ in rows:
+            memory[kind][key] = json.loads(value)
+        return memory
+
+    @staticmethod
+    def _values_at(db, lang, kind, keys, version):
+        """只查给定键在 version 及之前的值（JSON 文本）：{键: 值}。每个键一次主键索引查找。"""
+        out = {}
+        for i in range(0, len(keys), _IN_CHUNK):
+            part = keys[i:i + _IN_CHUNK]
+            rows = db.execute(f"SELECT key, value, MAX(version) FROM entries WHERE lang=? AND kind=? AND version<=? "
+                              f"AND key IN ({','.join('?' * len(part))}) GROUP BY key",
+                              (lang, kind, version, *part))
+            out.update((key, value) for key, value, _ in rows)
+        return out
+
+    def load(self, lang, version=None):
+        """返回 (记忆, 版本)。version 为 None 时取最新；记忆已按条目上限裁剪，可直接放进 prompt。
+        该语言还没有任何版本、但有旧版 JSON 记忆文件时先导入。"""
+        if version is None and not self.latest_version(lang):
+            self._import_legacy(lang)
+        with closing(self._connect()) as db:
+            db.execute("BEGIN")   # 两次查询在同一个读事务里，看到同一份快照
+            try:
+                newest = db.execute("SELECT COALESCE(MAX(version), 0) FROM versions WHERE lang=?",
+                                    (lang,)).fetchone()[0]
+                if version is None:
+                    version = newest
+                memory = self._snapshot(db, lang, version, latest=version >= newest)
+            finally:
+                db.execute("COMMIT")
+        return trim_memory(memory), version
+
+    def as_of_episode(self, lang, n):
+        """第 n 集翻译完成时的记忆：累计集数不超过 n 的最后一个版本。返回 (记忆, 版本)；没有则为空记忆与 0。"""
+        with closing(self._connect()) as db:
+            version = db.execute("SELECT COALESCE(MAX(version), 0) FROM versions WHERE lang=? AND episode_count<=?",
+                                 (lang, n)).fetchone()[0]
+        return self.load(lang, version) if version else (dict(EMPTY_MEMORY, characters={}, terminology={}), 0)
+
+    def history(self, lang):
+        """各版本概况：[(版本, 来源集, 累计集数, 改动条数, 时间戳)]。"""
+        with closing(self._connect()) as db:
+            return db.execute("SELECT version, episode, episode_count, changes, created FROM versions "
+                              "WHERE lang=? ORDER BY version", (lang,)).fetchall()
+
+    # --- 写入 ---
+    def commit(self, lang, memory, base_version, episode=None, count_episode=True):
+        """以 base_version（读取时的版本）为基准，只把 memory 里相对基准改动过的条目追加为新版本，返回新版本号。
+        episode 为来源集（文件名）；count_episode 时累计集数 + 1（Step 2 的重译不算新的一集）。
+        其他写入者在此期间的改动保留：同一个键两边都改时，后提交的为准。"""
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                head = db.execute("SELECT version, episode_count, style_notes FROM versions WHERE lang=? "
+                                  "ORDER BY version DESC LIMIT 1", (lang,)).fetchone() or (0, 0, _dump(""))
+                version = head[0] + 1
+                delta = []
+                for kind in KINDS:
+                    items = {str(key): value for key, value in (memory.get(kind) or {}).items()}
+                    base = self._values_at(db, lang, kind, list(items), base_version)
+                    delta += [(kind, key, _dump(value)) for key, value in items.items()
+                              if key not in base or json.loads(base[key]) != value]
+                rows = [(lang, kind, key, value, version) for kind, key, value in delta]
+                db.executemany("INSERT INTO entries (lang, kind, key, value, version) VALUES (?, ?, ?, ?, ?)", rows)
+                db.executemany("INSERT OR REPLACE INTO latest (lang, kind, key, value, version) VALUES (?, ?, ?, ?, ?)",
+                               rows)
+                base_head = self._head(db, lang, base_version)
+                notes = memory.get("style_notes") or ""
+                notes = head[2] if notes == (json.loads(base_head[1]) if base_head else "") else _dump(notes)
+                if count_episode and episode is not None:
+                    count = head[1] + 1
+                else:
+                    count = max(head[1], int(memory.get("episode_count") or 0))
+                db.execute("INSERT INTO versions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (lang, version, episode, count, notes, len(delta), time.time()))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return version
+
+    def reset(self, lang):
+        """删除某语言的全部记忆与历史。"""
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM entries WHERE lang=?", (lang,))
+            db.execute("DELETE FROM latest WHERE lang=?", (lang,))
+            db.execute("DELETE FROM versions WHERE lang=?", (lang,))
+            db.execute("COMMIT")
+
+    def _import_legacy(self, lang):
+        path = config.memory_path(lang)
+        if path.exists():
+            memory = load_memory(path)
+            if memory.get("characters") or memory.get("terminology") or memory.get("episode_count"):
+                self.commit(lang, memory, 0, episode="(json)", count_episode=False)
@@ -0,0 +1,229 @@
+"""libass 不可用时的 PIL 烧录引擎。与 Streamlit 无关；不导入 step3，可安全用于子进程。
+
+两种引擎共用同一份预渲染位图（每条字幕用 render_block 只渲染一次，相同文本复用），
+因此输出与预览像素级一致：
+
+1. PNG 叠加轨（burn_with_overlay_track，默认）：把字幕时间轴切成若干区间，每个区间的
+   画面字幕合成一张整帧透明 PNG，用 concat 分离器串成一条图像序列，交给 ffmpeg 原生
+   overlay 滤镜叠加。逐帧工作全部在 ffmpeg 里完成，Python 不碰视频帧，速度接近 libass。
+2. 逐帧合成（burn_with_frames）：ffmpeg 解码为原始 RGB 帧经管道送入，NumPy 只在字幕
+   包围盒内、且只在其显示区间内做 alpha 混合；按帧区间切段多进程并行，最后 concat 拼接。
+   作为叠加轨失败时的兜底。
+"""
+import math
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from ffmpeg_utils import NO_WINDOW, run_ffmpeg
+
+MIN_SEGMENT_SECONDS = 20   # 太短的段拼接开销不划算
+
+
+def clip_overlay(rgba, x, y, w, h):
+    """把贴在 (x, y) 的 RGBA 位图裁到画面内，返回 (rgba, x, y) 或 None（完全在画面外）。"""
+    bh, bw = rgba.shape[:2]
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(w, x + bw), min(h, y + bh)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return rgba[y0 - y:y1 - y, x0 - x:x1 - x], x0, y0
+
+
+def build_overlays(cues, frame_size, render):
+    """cues: [(start秒, end秒, 文本)]；render(frame_size, text) -> (PIL RGBA, x, y)。
+    返回按开始时间排序的 [(start, end, x, y, rgba ndarray)]，相同文本只渲染一次。"""
+    w, h = frame_size
+    cache, out = {}, []
+    for start, end, text in cues:
+        if text not in cache:
+            block, x, y = render(frame_size, text)
+            cache[text] = clip_overlay(np.asarray(block.convert("RGBA")), x, y, w, h)
+        clipped = cache[text]
+        if clipped is not None and end > start:
+            out.append((start, end, clipped[1], clipped[2], clipped[0]))
+    out.sort(key=lambda o: o[0])
+    return out
+
+
+def _prepare(overlays):
+    """预乘 alpha：blend 时只剩一次乘加。返回 [(start, end, x, y, 预乘rgb, 255-alpha)]。"""
+    prepared = []
+    for start, end, x, y, rgba in overlays:
+        a = rgba[..., 3:4].astype(np.uint16)
+        prepared.append((start, end, x, y, rgba[..., :3].astype(np.uint16) * a, 255 - a))
+    return prepared
+
+
+def blend(frame, x, y, premul, inv_alpha):
+    """在 frame（H×W×3 uint8，可写）的包围盒内就地做 alpha 混合。"""
+    bh, bw = inv_alpha.shape[:2]
+    roi = frame[y:y + bh, x:x + bw]
+    roi[:] = ((premul + roi * inv_alpha + 127) // 255).astype(np.uint8)
+
+
+def composite_frames(read_frame, write_frame, first_index, fps, overlays, max_frames=None):
+    """逐帧合成。read_frame() 返回可写帧或 None（流结束）；write_frame(frame) 输出。
+    overlays 已按开始时间排序；用游标维护「当前活跃」集合，每帧只检查少数几条。返回处理帧数。"""
+    prepared = _prepare(overlays)
+    nxt, active, n = 0, [], 0
+    while max_frames is None or n < max_frames:
+        frame = read_frame()
+        if frame is None:
+            break
+        t = (first_index + n) / fps
+        while nxt < len(prepared) and prepared[nxt][0] <= t:
+            active.append(prepared[nxt])
+            nxt += 1
+        if active:
+            active = [o for o in active if o[1] > t]
+            for _, _, x, y, premul, inv in active:
+                blend(frame, x, y, premul, inv)
+        write_frame(frame)
+        n += 1
+    return n
+
+
+def _render_segment(exe, video_path, seg_path, first_frame, n_frames, fps, w, h, overlays, vcodec, threads,
+                    input_args=(), upload=""):
+    """子进程入口：解码 [first_frame, first_frame+n_frames) → 合成 → 编码为无音轨的分段文件。"""
+    t0 = first_frame / fps
+    dec_cmd = [exe, "-nostdin", "-loglevel", "error", "-ss", f"{t0:.6f}", "-i", str(video_path), "-an"]
+    if n_frames is not None:
+        dec_cmd += ["-frames:v", str(n_frames)]
+    dec_cmd += ["-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+    enc_cmd = [exe, "-nostdin", "-loglevel", "error", "-y", *input_args, "-f", "rawvideo", "-pix_fmt", "rgb24",
+               "-s", f"{w}x{h}", "-r", f"{fps}", "-i", "-", *(["-vf", upload] if upload else []),
+               *vcodec, "-threads", str(threads), "-an", str(seg_path)]
+    dec = subprocess.Popen(dec_cmd, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL, creationflags=NO_WINDOW)
+    enc = subprocess.Popen(enc_cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=NO_WINDOW)
+    size = w * h * 3
+
+    def read_frame():
+        buf = bytearray(size)
+        view, got = memoryview(buf), 0
+        while got < size:
+            k = dec.stdout.readinto(view[got:])
+            if not k:
+                return None
+            got += k
+        return np.frombuffer(buf, dtype=np.uint8).reshape(h, w, 3)
+
+    try:
+        n = composite_frames(read_frame, lambda f: enc.stdin.write(f.tobytes()), first_frame, fps, overlays, n_frames)
+    finally:
+        enc.stdin.close()
+        dec.stdout.close()
+        dec.wait()
+        err = enc.stderr.read().decode("utf-8", "replace")
+        enc.wait()
+    if enc.returncode != 0:
+        raise RuntimeError(err[-500:] or "分段编码失败")
+    return n
+
+
+def burn_with_frames(exe, video_path, out_path, overlays, info, vcodec, workers=2, threads=2, on_progress=None,
+                     input_args=(), upload=""):
+    """多进程逐帧烧录。info 为 ffmpeg_utils.probe 结果；vcodec 为视频编码参数（不含 -threads）。
+    input_args / upload 为硬件编码器需要的设备参数与上传滤镜（见 encoders.Encoder）。
+    on_progress(snapshot) 按分段完成情况回报（子进程内的逐帧进度不回传，避免 IPC 开销）。"""
+    w, h, fps, duration = info["width"], info["height"], info["fps"] or 25.0, info["duration"] or 0.0
+    total_frames = max(1, int(round(duration * fps)))
+    n_seg = max(1, min(workers, int(duration // MIN_SEGMENT_SECONDS) or 1))
+    per = math.ceil(total_frames / n_seg)
+    with tempfile.TemporaryDirectory(prefix="lantrans_seg_") as tmp:
+        segs = []
+        for k in range(n_seg):
+            first = k * per
+            count = None if k == n_seg - 1 else per   # 最后一段读到流结束，避免时长估算误差丢帧
+            lo, hi = first / fps, (first + (count or total_frames * 2)) / fps
+            subset = [o for o in overlays if o[1] > lo and o[0] < hi]
+            segs.append((Path(tmp) / f"seg_{k:03d}.mp4", first, count, subset))
+        done = 0
+        ctx = get_context("spawn")   # 与 Streamlit 的多线程进程共存，spawn 比 fork 安全
+        with ProcessPoolExecutor(max_workers=n_seg, mp_context=ctx) as pool:
+            futs = [pool.submit(_render_segment, exe, video_path, p, first, count, fps, w, h, subset, vcodec, threads,
+                                input_args, upload)
+                    for p, first, count, subset in segs]
+            for fut in as_completed(futs):
+                done += fut.result()
+                if on_progress is not None:
+                    pct = min(1.0, done / total_frames)
+                    on_progress({"out_time": pct * duration, "fps": 0.0, "speed": 0.0, "percent": pct,
+                                 "done": False})
+        listing = Path(tmp) / "segments.txt"
+        listing.write_text("".join(f"file '{p.as_posix()}'\n" for p, *_ in segs), encoding="utf-8")
+        err = ""
+        for audio in (["-c:a", "copy"], ["-c:a", "aac"]):
+            cmd = [exe, "-nostdin", "-loglevel", "error", "-y", "-f", "concat", "-safe", "0", "-i", str(listing),
+                   "-i", str(video_path), "-map", "0:v", "-map", "1:a?", "-c:v", "copy", *audio, str(out_path)]
+            code, err = run_ffmpeg(cmd)
+            if code == 0:
+                return
+    raise RuntimeError(err[-500:] if err else "分段拼接失败")
+
+
+def overlay_timeline(overlays):
+    """把（可能重叠的）字幕切成互不重叠的区间：[(start, end, 活跃下标元组)]，空白区间下标为空。
+    重叠时同一区间内多条字幕合成到同一张画面上。"""
+    bounds = sorted({round(t, 3) for o in overlays for t in (o[0], o[1])})
+    spans = []
+    for lo, hi in zip(bounds, bounds[1:]):
+        active = tuple(k for k, o in enumerate(overlays) if o[0] <= lo and o[1] >= hi)
+        if spans and spans[-1][2] == active:
+            spans[-1] = (spans[-1][0], hi, active)   # 相邻同内容区间合并
+        else:
+            spans.append((lo, hi, active))
+    return spans
+
+
+def write_overlay_track(overlays, frame_size, out_dir):
+    """生成叠加轨：每种「活跃字幕组合」一张整帧透明 PNG + ffconcat 清单。返回清单路径。
+    整帧图绝大部分透明，PNG 压缩后只有几 KB。"""
+    out_dir = Path(out_dir)
+    w, h = frame_size
+    blank = out_dir / "blank.png"
+    Image.new("RGBA", (w, h), (0, 0, 0, 0)).save(blank, compress_level=1)
+    images, lines, t = {(): blank}, ["ffconcat version 1.0"], 0.0
+    for start, end, active in overlay_timeline(overlays):
+        if start > t:
+            lines += [f"file '{blank.as_posix()}'", f"duration {start - t:.3f}"]
+        if active not in images:
+            canvas = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+            for k in active:
+                _, _, x, y, rgba = overlays[k]
+                canvas.alpha_composite(Image.fromarray(rgba, "RGBA"), (x, y))
+            images[active] = out_dir / f"cue_{len(images):05d}.png"
+            canvas.save(images[active], compress_level=1)
+        lines += [f"file '{images[active].as_posix()}'", f"duration {end - start:.3f}"]
+        t = end
+    # 结尾补一张空白：清单最后一项的 duration 会被忽略，且字幕结束后需回到无字幕
+    lines += [f"file '{blank.as_posix()}'", "duration 1.000", f"file '{blank.as_posix()}'"]
+    listing = out_dir / "track.ffconcat"
+    listing.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return listing
+
+
+def burn_with_overlay_track(exe, video_path, out_path, overlays, info, vcodec, threads=0, on_progress=None,
+                            input_args=(), upload=""):
+    """用 ffmpeg overlay 滤镜叠加预渲染的 PNG 字幕轨。音频优先流复制，失败回退 aac。
+    input_args / upload 同 burn_with_frames。"""
+    with tempfile.TemporaryDirectory(prefix="lantrans_track_") as tmp:
+        listing = write_overlay_track(overlays, (info["width"], info["height"]), tmp)
+        graph = "[1:v]format=rgba[subs];[0:v][subs]overlay=eof_action=pass:format=auto" + (f",{upload}" if upload else "")
+        head = [exe, "-nostdin", "-loglevel", "error", "-y", *input_args, "-i", str(video_path),
+                "-f", "concat", "-safe", "0", "-i", str(listing),
+                "-filter_complex", graph + "[v]",
+                "-map", "[v]", "-map", "0:a?", *vcodec]
+        tail = ["-threads", str(threads)] if threads else []
+        err = ""
+        for audio in (["-c:a", "copy"], ["-c:a", "aac"]):
+            code, err = run_ffmpeg(head + tail + audio + [str(out_path)], info["duration"], on_progress)
+            if code == 0:
+                return
+    raise RuntimeError(err[-500:] if err else "叠加轨烧录失败")
@@ -0,0 +1,122 @@
+"""设计器预览用的视频取帧：按内容哈希跨会话缓存到磁盘。与 Streamlit 无关。
+
+取代「整段上传视频写临时文件 + VideoFileClip 打开取一帧」：
+- 先对上传内容做采样哈希（与 manifest 同一算法）；帧和视频信息已缓存时完全不落盘视频；
+- 需要时才把上传内容分块写到 temp/preview_src/（同一内容只写一次，保留最近几个供时间轴预览复用）；
+- 取帧用 ffmpeg 输入端 seek，只解码一帧；缩略图条按需懒生成，同样缓存（只保留最近使用的若干张）。
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+
+from PIL import Image
+
+import config
+from ffmpeg_utils import extract_frame, find_ffmpeg, probe
+from manifest import stream_fingerprint
+
+KEEP_SOURCES = 3          # temp/preview_src 下最多保留几个预览源视频
+KEEP_FRAMES = 256         # temp/preview_frames 下最多保留的帧 / 缩略图数
+THUMB_WIDTH = 240         # 缩略图宽度（像素）
+
+
+class FrameSource:
+    """一个预览视频（上传文件对象或本地路径）的取帧入口。
+
+    用法：
+        src = FrameSource(uploaded_file)
+        info = src.info()                 # {"duration", "width", "height", "fps"}
+        frame = src.frame(1.0)            # PIL RGB
+        for t, thumb in src.thumbnails(8): ...
+    """
+
+    def __init__(self, upload=None, path=None, suffix=None, cache_dir=None):
+        if (upload is None) == (path is None):
+            raise ValueError("upload 与 path 必须且只能给一个")
+        self.upload = upload
+        self.path = Path(path) if path is not None else None
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                self.key = stream_fingerprint(f)
+        else:
+            self.key = stream_fingerprint(upload)
+        name = getattr(upload, "name", "") if upload is not None else self.path.name
+        self.suffix = suffix or Path(name).suffix.lower() or ".mp4"
+        self.cache_dir = Path(cache_dir or config.TEMP_DIR / "preview_frames")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.exe = find_ffmpeg()
+        self._info = None
+
+    # --- 源文件 ---
+    def source_path(self):
+        """ffmpeg 可读取的视频路径。上传文件按内容哈希落盘一次（分块复制，不整体复制到内存）。"""
+        if self.path is not None:
+            return self.path
+        src_dir = config.TEMP_DIR / "preview_src"
+        src_dir.mkdir(parents=True, exist_ok=True)
+        target = src_dir / f"{self.key}{self.suffix}"
+        if not target.exists():
+            tmp = target.with_suffix(target.suffix + ".part")
+            self.upload.seek(0)
+            with open(tmp, "wb") as out:
+                shutil.copyfileobj(self.upload, out, 4 << 20)
+            self.upload.seek(0)
+            tmp.replace(target)
+            _prune_sources(src_dir, keep=target)
+        self.path = target
+        return target
+
+    # --- 信息与取帧 ---
+    def info(self):
+        if self._info is None:
+            meta = self.cache_dir / f"{self.key}.json"
+            try:
+                self._info = json.loads(meta.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError):
+                self._info = probe(self.exe, self.source_path())
+                meta.write_text(json.dumps(self._info), encoding="utf-8")
+        return self._info
+
+    def default_time(self):
+        """默认代表帧时间：与旧逻辑一致，取 min(1 秒, 时长一半)。"""
+        return min(1.0, (self.info().get("duration") or 0) / 2)
+
+    def frame(self, t, width=None):
+        """取 t 秒处的帧（width 给定时为缩略图），优先读磁盘缓存。"""
+        cached = self.cache_dir / f"{self.key}_{int(round(t * 1000))}_{width or 0}.png"
+        if cached.exists():
+            try:
+                with Image.open(cached) as im:
+                    img = im.convert("RGB")
+                os.utime(cached)   # 标记为最近使用
+                return img
+            except OSError:
+                cached.unlink(missing_ok=True)
+        img = extract_frame(self.exe, self.source_path(), t, width)
+        img.save(cached, compress_level=1)
+        _prune_frames(self.cache_dir, keep=cached)
+        return img
+
+    def thumbnails(self, count=8):
+        """均匀分布的 count 张缩略图，逐张产出 (时间, 图)，调用方可边生成边显示。"""
+        duration = self.info().get("duration") or 0
+        for k in range(count):
+            t = duration * (k + 0.5) / count
+            yield t, self.frame(t, THUMB_WIDTH)
+
+
+def _prune_sources(src_dir, keep):
+    """只保留最近使用的几个预览源视频，避免 temp 目录无限增长。"""
+    files = sorted((p for p in src_dir.iterdir() if p.is_file() and p != keep and not p.name.endswith(".part")),
+                   key=lambda p: p.stat().st_mtime, reverse=True)
+    for p in files[KEEP_SOURCES - 1:]:
+        p.unlink(missing_ok=True)
+
+
+def _prune_frames(cache_dir, keep):
+    """帧缓存只保留最近使用的 KEEP_FRAMES 张（视频信息 .json 很小，不计入）。"""
+    frames = sorted((p for p in cache_dir.glob("*.png") if p != keep),
+                    key=lambda p: p.stat().st_mtime, reverse=True)
+    for p in frames[KEEP_FRAMES - 1:]:
+        p.unlink(missing_ok=True)
@@ -0,0 +1,153 @@
+"""烧录任务的自适应调度器。与 Streamlit 无关，主线程驱动、任务在线程池里跑。
+
+取代固定并发 + 固定「每任务线程数 = 核数 // 并发」的 ThreadPoolExecutor：
+- 最长任务优先（LPT，按 时长 × 像素数 估算工作量），缩短整批完工时间（makespan）。
+- 硬件编码（NVENC / QSV / VAAPI）会话数单独限流（消费级显卡同时编码会话有限），GPU 满载时
+  其余任务可溢出到 CPU 编码器吃掉空闲核心（仅自动模式）。
+- CPU 任务按线程预算分配核心；实测 CPU 利用率偏低（解码 / IO 瓶颈）时允许超额再起一个任务。
+- 每次有任务结束都重新计算：后启动的任务按当时剩余任务数拿到更多线程，尾部不再闲置核心。
+"""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import config
+from encoders import is_hardware
+
+
+class BurnJob:
+    """一个待烧录任务。cost 为相对工作量（秒 × 像素），prefer_gpu 表示优先硬件编码。"""
+    __slots__ = ("key", "cost", "prefer_gpu", "payload")
+
+    def __init__(self, key, cost, prefer_gpu=False, payload=None):
+        self.key, self.cost, self.prefer_gpu, self.payload = key, cost, prefer_gpu, payload
+
+
+class CpuSampler:
+    """按 /proc/stat 差分测量整机 CPU 利用率（0~1）。无 /proc 时退回 loadavg，都没有返回 None。"""
+
+    def __init__(self):
+        self._last = self._read()
+
+    @staticmethod
+    def _read():
+        try:
+            with open("/proc/stat", encoding="ascii") as f:
+                vals = [int(v) for v in f.readline().split()[1:]]
+            idle = vals[3] + (vals[4] if len(vals) > 4 else 0)   # idle + iowait
+            return sum(vals), idle
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def sample(self):
+        cur = self._read()
+        if cur is None or self._last is None:
+            try:
+                return min(1.0, os.getloadavg()[0] / (os.cpu_count() or 1))
+            except (AttributeError, OSError):
+                return None
+        (t0, i0), (t1, i1) = self._last, cur
+        self._last = cur
+        if t1 <= t0:
+            return None
+        return 1.0 - (i1 - i0) / (t1 - t0)
+
+
+def order_jobs(jobs):
+    """最长任务优先（LPT）。"""
+    return sorted(jobs, key=lambda j: j.cost, reverse=True)
+
+
+class AdaptiveScheduler:
+    """按编码器类型与实测 CPU 利用率动态决定并发与每任务线程数。
+
+    用法：
+        sched = AdaptiveScheduler(max_jobs=4, spill_to_cpu=True)
+        for job, result in sched.run(jobs, fn):   # fn(job, encoder, threads) -> result
+            if job is None: 刷新界面（定时心跳）
+            else: 处理 result
+    """
+
+    def __init__(self, max_jobs, cpu_count=None, nvenc_sessions=None, spill_to_cpu=False,
+                 busy_threshold=None, load_fn=None, settle=None):
+        self.max_jobs = max(1, max_jobs)
+        self.cpu_count = cpu_count or os.cpu_count() or 4
+        self.nvenc_sessions = config.NVENC_MAX_SESSIONS if nvenc_sessions is None else nvenc_sessions
+        self.spill_to_cpu = spill_to_cpu
+        self.busy_threshold = config.CPU_BUSY_THRESHOLD if busy_threshold is None else busy_threshold
+        self.load_fn = load_fn if load_fn is not None else CpuSampler().sample
+        self.settle = config.SCHED_SETTLE_SECONDS if settle is None else settle
+        self.running = {}          # future -> (job, encoder, threads)
+        self._last_cpu_launch = 0.0
+
+    # --- 资源账本 ---
+    def _gpu_running(self):
+        return sum(1 for _, enc, _ in self.running.values() if is_hardware(enc))
+
+    def _cpu_threads_used(self):
+        return sum(th for _, enc, th in self.running.values() if not is_hardware(enc))
+
+    def threads_for(self, encoder, queued_cpu):
+        """新任务的线程数。硬件编码只需少量线程做解码 / 滤镜；
+        CPU 任务平分剩余核心——分母为「正在跑 + 还可能同时跑」的 CPU 任务数，越到尾部线程越多。"""
+        if is_hardware(encoder):
+            return config.NVENC_THREADS
+        free = self.cpu_count - self._cpu_threads_used() - config.NVENC_THREADS * self._gpu_running()
+        if free <= 0:   # 超额放行（实测利用率低）：与在跑的 CPU 任务平分
+            cpu_running = sum(1 for _, enc, _ in self.running.values() if not is_hardware(enc))
+            return max(1, self.cpu_count // (cpu_running + 1))
+        slots = max(1, min(self.max_jobs - len(self.running), queued_cpu))
+        return max(1, free // slots)
+
+    def pick(self, queue, gpu_encoder, cpu_encoder="libx264"):
+        """从队列（已按 LPT 排序）里挑下一个可启动的任务，返回 (job, encoder, threads) 或 None。
+        队首任务因 CPU 忙而等待时继续往后找：硬件编码还有空闲会话就先起 GPU 任务，不让它空等。"""
+        if len(self.running) >= self.max_jobs or not queue:
+            return None
+        gpu_free = self._gpu_running() < self.nvenc_sessions
+        cpu_jobs = [j for j in queue if not j.prefer_gpu or self.spill_to_cpu]
+        cpu_ok = None   # 一轮内只判断一次 CPU 是否放行（可能要采样利用率）
+        for job in queue:
+            if job.prefer_gpu and gpu_encoder:
+                if gpu_free:
+                    return job, gpu_encoder, self.threads_for(gpu_encoder, 0)
+                if not self.spill_to_cpu:
+                    continue   # GPU 满且不允许溢出：看后面有没有纯 CPU 任务
+            if cpu_ok is None:
+                cpu_ok = self._cpu_admits()
+            if cpu_ok:
+                return job, cpu_encoder, self.threads_for(cpu_encoder, len(cpu_jobs))
+            if not gpu_free or not gpu_encoder:
+                return None   # CPU 与 GPU 都没有空位，后面的任务也起不来
+        return None
+
+    def _cpu_admits(self):
+        """线程预算内直接放行；预算用尽时，若实测利用率仍低于阈值（且距上次启动已稳定一段时间，
+        让刚起的任务先把负载体现出来）再超额放行一个，否则等待。"""
+        if self._cpu_threads_used() < self.cpu_count:
+            return True
+        if time.time() - self._last_cpu_launch < self.settle:
+            return False
+        load = self.load_fn()
+        return load is not None and load < self.busy_threshold
+
+    def run(self, jobs, fn, gpu_encoder=None, poll=1.0, cpu_encoder="libx264"):
+        """调度执行全部任务。逐个产出 (job, result)；每个心跳周期额外产出 (None, None) 供界面刷新。
+        gpu_encoder 为硬件编码器名（None 表示不用硬件），cpu_encoder 为 CPU 任务（含溢出）使用的编码器。"""
+        queue = order_jobs(jobs)
+        with ThreadPoolExecutor(max_workers=self.max_jobs) as ex:
+            while queue or self.running:
+                while True:
+                    choice = self.pick(queue, gpu_encoder, cpu_encoder)
+                    if choice is None:
+                        break
+                    job, enc, threads = choice
+                    queue.remove(job)
+                    if not is_hardware(enc):
+                        self._last_cpu_launch = time.time()
+                    self.running[ex.submit(fn, job, enc, threads)] = choice
+                done, _ = wait(list(self.running), timeout=poll, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    job, _, _ = self.running.pop(fut)
+                    yield job, fut.result()
+                yield None, None
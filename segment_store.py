@@ -0,0 +1,198 @@
+"""跨集的片段翻译记忆：按语言保存「规范化的源字幕文本 → 已采用的译文」，与 Streamlit 无关。
+
+短剧重复很多（上集回顾、口头禅、「妈」「嗯」这类一两个字的台词），逐集逐语言重新翻译既费 token 又拖时间：
+- 精确命中：规范化文本完全相同 → 直接填入已有译文，不送模型；
+- 近似命中：字符 n-gram 的 MinHash 签名按 LSH 分桶取候选，再按真实 Jaccard 相似度筛选，
+  作为参考译文附在请求里（只作提示，不直接套用）；
+- 其余新台词才送模型。译文被采用（Step 1 写出文件）后用 learn 按时间轴配对写回存储；
+  Step 2 重译改正的台词用 correct 替换存储里的旧译文。
+
+存储为 temp/segments_<语言>.json（见 config.segment_path），条目数上限 config.SEGMENT_STORE_MAX，
+超出时丢弃最早学到的。save 只写回本实例自加载以来改过的条目（先重新读取文件再合并），
+Step 1 逐集保存时不会覆盖同时运行的 Step 2 写回的改正。规范化只去掉格式标签、统一全半角与空白、转小写，保留标点（标点会影响译文语气）。
+"""
+import json
+import os
+import random
+import re
+import threading
+import unicodedata
+import zlib
+
+import numpy as np
+
+import config
+import translator
+
+NGRAM = 2             # 字符二元组：中日韩按字、拉丁文按字母对都适用
+PERMS, BANDS = 32, 8  # 32 个哈希函数分 8 段（每段 4 个）：相似度 0.6 的两条约 65% 概率落入同桶，0.8 以上几乎必中
+_ROWS = PERMS // BANDS
+_PRIME = (1 << 31) - 1
+_rng = random.Random(20240601)
+_A = np.array([_rng.randrange(1, _PRIME) for _ in range(PERMS)], dtype=np.int64)
+_B = np.array([_rng.randrange(0, _PRIME) for _ in range(PERMS)], dtype=np.int64)
+
+_save_lock = threading.Lock()   # 同一进程内（Streamlit 多会话）读取-合并-写回串行
+
+_TAG_RE = re.compile(r"\{[^}]*\}|</?[a-zA-Z][^>]*>")
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize(text):
+    """去掉 {\\an8} / <i> 等格式标签，NFKC（全角转半角），空白折叠为单个空格，转小写。"""
+    text = unicodedata.normalize("NFKC", _TAG_RE.sub("", text))
+    return _WS_RE.sub(" ", text).strip().lower()
+
+
+def shingles(norm):
+    """规范化文本的字符 n-gram 集合；短于 n 的整体作为一个。"""
+    return frozenset(norm[i:i + NGRAM] for i in range(len(norm) - NGRAM + 1)) or frozenset((norm,))
+
+
+def minhash(grams):
+    """n-gram 集合的 MinHash 签名（PERMS 个 31 位整数）。"""
+    x = np.array([zlib.crc32(g.encode("utf-8")) & _PRIME for g in grams], dtype=np.int64)
+    return ((_A[:, None] * x[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class SegmentStore:
+    """某一语言的片段存储。精确表是有序 dict（插入顺序 = 学到的先后），近似索引在内存里按需维护。
+    不是线程安全的：Step 1 每种语言一个线程、各自一个实例。"""
+
+    def __init__(self, path=None, max_items=None):
+        self.path = path
+        self.max_items = max_items or config.SEGMENT_STORE_MAX
+        self.entries = {}
+        self._changed = {}   # 自加载 / 上次保存以来本实例改过的条目，save 时合并到文件里的最新内容之上
+        self._grams = {}
+        self._buckets = {}
+        self.hits = self.hinted = self.misses = 0   # 累计：精确命中 / 带参考译文 / 无参考的新台词
+        if path is not None:
+            for src, tgt in self._read().items():
+                self._put(src, tgt)
+            self._changed.clear()
+            self._trim()
+
+    @classmethod
+    def for_lang(cls, lang):
+        return cls(config.segment_path(lang))
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return dict(json.load(f).get("segments") or {})
+        except (json.JSONDecodeError, OSError, AttributeError, TypeError, ValueError):
+            return {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    # --- 索引 ---
+    def _keys(self, sig):
+        return [(b, hash(sig[b * _ROWS:(b + 1) * _ROWS].tobytes())) for b in range(BANDS)]
+
+    def _put(self, norm, tgt):
+        if self.entries.get(norm) != tgt:
+            self._changed[norm] = tgt   # 原样重学（如精确命中的旧译文）不算改动，不会盖掉别处的改正
+        if norm in self.entries:
+            del self.entries[norm]   # 重新学到的移到末尾，最后被淘汰
+        else:
+            grams = shingles(norm)
+            self._grams[norm] = grams
+            for key in self._keys(minhash(grams)):
+                self._buckets.setdefault(key, set()).add(norm)
+        self.entries[norm] = tgt
+
+    def _drop(self, norm):
+        del self.entries[norm]
+        grams = self._grams.pop(norm)
+        for key in self._keys(minhash(grams)):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(norm)
+                if not bucket:
+                    del self._buckets[key]
+
+    def _trim(self):
+        while len(self.entries) > self.max_items:
+            self._drop(next(iter(self.entries)))
+
+    # --- 查询与学习 ---
+    def lookup(self, text):
+        """精确命中返回译文，否则 None。"""
+        return self.entries.get(normalize(text))
+
+    def near(self, text, k=None, threshold=None):
+        """近似命中：返回至多 k 条 (相似度, 规范化原文, 译文)，按相似度降序，不含精确命中本身。"""
+        k = config.SEGMENT_HINTS if k is None else k
+        threshold = config.SEGMENT_FUZZY_THRESHOLD if threshold is None else threshold
+        norm = normalize(text)
+        if not norm or not self.entries:
+            return []
+        grams = shingles(norm)
+        cands = set()
+        for key in self._keys(minhash(grams)):
+            cands |= self._buckets.get(key, set())
+        cands.discard(norm)
+        scored = sorted(((jaccard(grams, self._grams[c]), c) for c in cands), reverse=True)
+        return [(round(s, 3), c, self.entries[c]) for s, c in scored[:k] if s >= threshold]
+
+    def add(self, src, tgt):
+        norm = normalize(src)
+        if norm and tgt.strip():
+            self._put(norm, tgt.strip())
+            self._trim()
+
+    def learn(self, source_srt, translated_srt):
+        """按时间轴把源字幕与译文配对写入存储（翻译不改时间轴）；原样未译的不记。返回写入条数。"""
+        src, out = translator._parse_srt(source_srt), translator._parse_srt(translated_srt)
+        if src is None or out is None:
+            return 0
+        by_time = {c.timing: c.text for c in out}
+        n = 0
+        for c in src:
+            tgt = by_time.get(c.timing)
+            if tgt and normalize(tgt) != normalize(c.text):
+                self.add(c.text, tgt)
+                n += 1
+        return n
+
+    def correct(self, old_srt, new_srt):
+        """Step 2 重译后把改正写回：按时间轴配对旧译文与新译文，存储里以旧译文为译文的条目改为新译文，
+        之后各集精确命中时不再沿用错译。Step 2 只有译文文件、没有源字幕，所以按译文反查条目。返回改动条数。"""
+        old, new = translator._parse_srt(old_srt), translator._parse_srt(new_srt)
+        if old is None or new is None:
+            return 0
+        by_time = {c.timing: c.text.strip() for c in new}
+        fixes = {}
+        for c in old:
+            tgt = by_time.get(c.timing)
+            if tgt and tgt != c.text.strip():
+                fixes[c.text.strip()] = tgt
+        n = 0
+        for norm, tgt in list(self.entries.items()):
+            if tgt in fixes:
+                self._put(norm, fixes[tgt])
+                n += 1
+        return n
+
+    def save(self):
+        """重新读取文件，把本实例改过的条目合并上去后原子写入（先写临时文件再替换）。
+        其他实例（如 Step 2 的改正）在此期间写入的条目保留，并同步到本实例。"""
+        with _save_lock:
+            for norm, tgt in self._read().items():
+                if norm not in self._changed and self.entries.get(norm) != tgt:
+                    self._put(norm, tgt)
+            self._trim()
+            self._changed.clear()
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "segments": self.entries}, f, ensure_ascii=False, indent=0)
+            os.replace(tmp, self.path)
+
+    def stats(self):
+        return {"hits": self.hits, "hinted": self.hinted, "misses": self.misses}
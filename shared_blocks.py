@@ -0,0 +1,110 @@
+"""跨集共享字幕块（上集回顾、片头曲）的检测：与 Streamlit 无关。
+
+很多剧每集开头是同一段回顾或片头曲字幕，Step 1 逐集逐语言重复翻译。这里在翻译前扫一遍整个输入文件夹：
+- 每条字幕按 segment_store.normalize 规范化后取哈希，整集成为一个哈希序列；
+- 在序列上用 Rabin-Karp 滚动哈希取长度为 min_cues 的窗口，找出出现在两集及以上的窗口（逐条比对原文排除碰撞）；
+- 每条被这些窗口覆盖的字幕记下它在各集里对应的位置（相对偏移）。相邻两条对应的集与偏移完全一致时属于同一段，
+  在共享窗口的起止处（对应关系变化处）断开：回顾只和 A、B 两集共享、片头只和 B、C 两集共享时，
+  B 集里紧挨着的回顾与片头分成两段；
+- 不短于 min_cues、规范化文本完全相同、出现在两集及以上的段即为一个共享块。
+
+每个共享块每种语言只翻译一次（带第一次出现时的上下文与时间轴），再按各集自己的时间轴填回（见 step1）。
+"""
+import zlib
+
+import config
+from segment_store import normalize
+from srt_cues import format_srt, parse_srt
+
+_MOD = (1 << 61) - 1
+_BASE = 1_000_003
+
+
+class Block:
+    """一个共享块：texts 为规范化文本序列，occurrences 为 [(文件名, 起始位置)]，srt 为第一次出现的原文片段。"""
+    __slots__ = ("texts", "occurrences", "srt")
+
+    def __init__(self, texts, occurrences, srt):
+        self.texts, self.occurrences, self.srt = texts, occurrences, srt
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __repr__(self):
+        return f"Block({len(self.texts)} cues × {len(self.occurrences)} episodes)"
+
+
+def _windows(hashes, k):
+    """序列上所有长度为 k 的窗口的滚动哈希，返回 [(起始位置, 哈希)]。"""
+    if len(hashes) < k:
+        return []
+    top = pow(_BASE, k - 1, _MOD)
+    h = 0
+    for x in hashes[:k]:
+        h = (h * _BASE + x) % _MOD
+    out = [(0, h)]
+    for i in range(1, len(hashes) - k + 1):
+        h = ((h - hashes[i - 1] * top) * _BASE + hashes[i + k - 1]) % _MOD
+        out.append((i, h))
+    return out
+
+
+def find_blocks(episodes, min_cues=None):
+    """episodes 为 {文件名: SRT 文本}；返回共享块列表（按第一次出现的文件名与位置排序）。无法解析的集忽略。"""
+    k = min_cues or config.SHARED_BLOCK_MIN_CUES
+    cues, texts = {}, {}
+    for name, content in episodes.items():
+        subs = parse_srt(content)
+        if not subs:
+            continue
+        cues[name] = subs
+        texts[name] = [normalize(c.text) for c in subs]
+
+    seen = {}   # 窗口哈希 -> [(文件名, 位置)]
+    for name, seq in texts.items():
+        hashes = [zlib.crc32(t.encode("utf-8")) for t in seq]
+        for i, h in _windows(hashes, k):
+            seen.setdefault(h, []).append((name, i))
+
+    # 每条字幕对应的 {(文件名, 相对偏移)}：经某个共享窗口对上的其他位置（含自身）
+    partners = {name: [set() for _ in seq] for name, seq in texts.items()}
+    for hits in seen.values():
+        while hits:
+            first_name, first_i = hits[0]
+            ref = texts[first_name][first_i:first_i + k]
+            same = [(n, i) for n, i in hits if texts[n][i:i + k] == ref]
+            hits = [h for h in hits if h not in same]   # 哈希碰撞的其余窗口另成一组
+            if len({n for n, _ in same}) < 2:
+                continue
+            for n, i in same:
+                rel = {(n2, i2 - i) for n2, i2 in same}
+                for o in range(k):
+                    partners[n][i + o] |= rel
+
+    runs = {}   # 规范化文本元组 -> [(文件名, 起始位置)]
+    for name in sorted(texts):
+        marks, i = partners[name], 0
+        while i < len(marks):
+            if not marks[i]:
+                i += 1
+                continue
+            j = i + 1
+            while j < len(marks) and marks[j] == marks[i]:
+                j += 1
+            if j - i >= k:
+                runs.setdefault(tuple(texts[name][i:j]), []).append((name, i))
+            i = j
+
+    blocks = []
+    for key, occ in runs.items():
+        if len({n for n, _ in occ}) < 2:
+            continue
+        name, start = occ[0]
+        srt = format_srt(cues[name][start:start + len(key)])
+        blocks.append(Block(key, occ, srt))
+    return sorted(blocks, key=lambda b: b.occurrences[0])
+
+
+def episode_blocks(blocks, name):
+    """某一集包含的共享块：[(块序号, 起始位置)]。"""
+    return [(b, i) for b, block in enumerate(blocks) for n, i in block.occurrences if n == name]
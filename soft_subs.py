@@ -0,0 +1,73 @@
+"""软字幕封装：字幕作为独立轨道放进视频容器，视频 / 音频流直接复制、不重新编码。与 Streamlit 无关。
+
+- MP4 / MOV：mov_text 字幕轨（兼容性最好；只保留文字与斜体、加粗等基本样式）；
+- MKV：ASS 字幕轨（保留设计器里的字体、颜色、描边与位置），所用字体（子集）作为附件一并封装；
+- 一个容器可放多条语言轨：SRT 文件夹下按语言分的子文件夹（即 Step 1 的输出根目录）里的同名 SRT 各成一轨。
+只需把文件读写一遍，每集通常几秒完成。
+"""
+from pathlib import Path
+
+import config
+from ffmpeg_utils import run_ffmpeg
+
+SUBTITLE_CODECS = {".mp4": "mov_text", ".m4v": "mov_text", ".mov": "mov_text", ".mkv": "ass"}
+_FONT_MIMETYPES = {".otf": "application/vnd.ms-opentype"}   # 其余（.ttf / .ttc）按 TrueType
+
+
+def subtitle_codec(out_path):
+    """按输出容器选字幕编码；不支持的容器抛 ValueError。"""
+    suffix = Path(out_path).suffix.lower()
+    if suffix not in SUBTITLE_CODECS:
+        raise ValueError(f"软字幕不支持 {suffix or '无扩展名'} 容器，请输出 MP4 或 MKV")
+    return SUBTITLE_CODECS[suffix]
+
+
+def subtitle_tracks(srt_dir, srt_name):
+    """找出一个视频的全部字幕轨，返回 [(SRT 路径, 语言名或 None)]。
+    srt_dir 下的同名 SRT 为一轨（文件夹名是语言名时记为该语言）；srt_dir 的各语言子文件夹
+    （名称为 config.LANG_OPTIONS 的值，如 Step 1 的输出）里的同名 SRT 各为一轨，按 LANG_OPTIONS 顺序排列。"""
+    srt_dir = Path(srt_dir)
+    langs = list(config.LANG_OPTIONS.values())
+    tracks = []
+    direct = srt_dir / srt_name
+    if direct.is_file():
+        tracks.append((direct, srt_dir.name if srt_dir.name in langs else None))
+    for lang in langs:
+        path = srt_dir / lang / srt_name
+        if path.is_file():
+            tracks.append((path, lang))
+    return tracks
+
+
+def mux_command(exe, video_path, out_path, tracks, fonts=()):
+    """组装封装命令。tracks：[(字幕文件, 语言名或 None)]，第一轨设为默认轨；
+    fonts：作为附件封装的字体文件（仅 MKV 有效，ASS 轨按字体名引用）。"""
+    codec = subtitle_codec(out_path)
+    cmd = [exe, "-nostdin", "-loglevel", "error", "-y", "-i", str(video_path)]
+    for sub_path, _ in tracks:
+        cmd += ["-i", str(sub_path)]
+    cmd += ["-map", "0:v", "-map", "0:a?"]
+    for k in range(len(tracks)):
+        cmd += ["-map", f"{k + 1}:0"]
+    cmd += ["-c:v", "copy", "-c:a", "copy", "-c:s", codec]
+    for k, (_, lang) in enumerate(tracks):
+        cmd += [f"-metadata:s:s:{k}", f"language={config.SUBTITLE_LANG_CODES.get(lang, 'und')}",
+                f"-disposition:s:{k}", "default" if k == 0 else "0"]
+        if lang:
+            cmd += [f"-metadata:s:s:{k}", f"title={lang}"]
+    if codec == "ass":
+        for k, font in enumerate(fonts):
+            cmd += ["-attach", str(font), f"-metadata:s:t:{k}",
+                    f"mimetype={_FONT_MIMETYPES.get(Path(font).suffix.lower(), 'application/x-truetype-font')}"]
+    else:
+        cmd += ["-movflags", "+faststart"]
+    return cmd + [str(out_path)]
+
+
+def mux_subtitles(exe, video_path, out_path, tracks, fonts=(), duration=None, on_progress=None):
+    """封装软字幕（流复制）。on_progress 同 ffmpeg_utils.run_ffmpeg；失败抛 RuntimeError。"""
+    if not tracks:
+        raise ValueError("没有可封装的字幕轨")
+    code, err = run_ffmpeg(mux_command(exe, video_path, out_path, tracks, fonts), duration, on_progress)
+    if code != 0:
+        raise RuntimeError(err[-500:] if err else "ffmpeg 封装失败")
@@ -0,0 +1,76 @@
+"""字幕条的紧凑表示与快速 SRT 读写，翻译（translator）、烧录（step3）与扫描（cue_scan）共用。与 Streamlit 无关。
+
+一条字幕是一个带 __slots__ 的 Cue：序号、开始 / 结束（整数毫秒）、文本。
+解析一次得到列表，分块、校验、对齐、生成 ASS 都直接用它，不再在 pysrt 对象与 SRT 文本之间来回转换；
+str(cue) / format_srt 的输出与 pysrt 的序列化格式一致（「序号\\n时间 --> 时间\\n文本\\n」，块间空一行）。
+
+解析是宽松的：容忍 BOM、CRLF、小数点分隔毫秒、缺失序号行；无法识别的块跳过（与 pysrt 的默认行为一致）。
+"""
+import re
+from pathlib import Path
+
+_BLOCK_RE = re.compile(r"\s*(?:(\d+)[ \t]*\n)?\s*(\d+):(\d+):(\d+)[,.](\d+)\s*-->\s*(\d+):(\d+):(\d+)[,.](\d+)[^\n]*"
+                       r"(?:\n(.*))?", re.S)
+_BLANK_LINE_RE = re.compile(r"\n[ \t]*\n")
+
+
+class Cue:
+    """一条字幕。start / end 为毫秒整数。"""
+    __slots__ = ("index", "start", "end", "text")
+
+    def __init__(self, index, start, end, text):
+        self.index, self.start, self.end, self.text = index, start, end, text
+
+    @property
+    def timing(self):
+        """(开始, 结束) 毫秒，翻译不改时间轴，可用来对齐原文与译文。"""
+        return self.start, self.end
+
+    def __str__(self):
+        return f"{self.index}\n{format_time(self.start)} --> {format_time(self.end)}\n{self.text}\n"
+
+    def __repr__(self):
+        return f"Cue({self.index}, {self.start}, {self.end}, {self.text!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, Cue) and (self.index, self.start, self.end, self.text) == \
+            (other.index, other.start, other.end, other.text)
+
+
+def format_time(ms):
+    """毫秒 → SRT 时间 HH:MM:SS,mmm（负数按 0）。"""
+    ms = max(0, int(ms))
+    h, ms = divmod(ms, 3_600_000)
+    m, ms = divmod(ms, 60_000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def parse_srt(text):
+    """解析 SRT 文本，返回 [Cue]（保留空文本的字幕；缺序号的按位置编号）。"""
+    cues = []
+    for block in _BLANK_LINE_RE.split(text.replace("\r\n", "\n").lstrip("\ufeff")):
+        m = _BLOCK_RE.match(block)
+        if m is None:
+            continue
+        g = m.groups()
+        start = ((int(g[1]) * 60 + int(g[2])) * 60 + int(g[3])) * 1000 + int(g[4])
+        end = ((int(g[5]) * 60 + int(g[6])) * 60 + int(g[7])) * 1000 + int(g[8])
+        cues.append(Cue(int(g[0]) if g[0] else len(cues) + 1, start, end, (g[9] or "").strip("\n")))
+    return cues
+
+
+def read_srt(path):
+    """读取 SRT 文件（UTF-8，容忍 BOM / CRLF）。"""
+    return parse_srt(Path(path).read_text(encoding="utf-8", errors="replace"))
+
+
+def format_srt(cues):
+    return "\n".join(str(c) for c in cues)
+
+
+def renumber(cues):
+    """序号重排为 1..n（就地），返回 cues。"""
+    for k, c in enumerate(cues, 1):
+        c.index = k
+    return cues
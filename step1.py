@@ -5,50 +5,101 @@ from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import config
-from translator import get_client, load_memory, save_memory, translate_srt, update_memory, trim_memory
-from ui_utils import validate_dir
+import latency
+import tracing
+from manifest import Manifest, signature
+from memory_store import MemoryStore
+from segment_store import SegmentStore
+from shared_blocks import episode_blocks, find_blocks
+from translator import AlignmentError, get_client, translate_srt, update_memory, _parse_srt
+from ui_utils import show_trace, validate_dir
 
 
 def _natural_sort_key(s):
     return [int(t) if t.isdigit() else t.lower() for t in re.split(r'([0-9]+)', s)]
 
 
-def _process_single_language(lang, srt_files, client, input_dir, output_root, translate_model, memory_model, reset):
-    """翻译某一种语言的所有 SRT，返回 (日志列表, 该语言总费用)。在工作线程中运行。"""
+def _translate_block(client, block, lang, model, memory, store):
+    """翻译一个跨集共享块（见 shared_blocks），返回 (逐条译文或 None, 费用)。
+    补译后仍对不齐时返回 None（费用照计）：这一块在各集里按普通字幕翻译。"""
+    try:
+        translated, cost = translate_srt(client, block.srt, lang, model, memory, store=store)
+    except AlignmentError as e:
+        return None, e.cost
+    parsed = _parse_srt(translated)
+    if parsed is None or len(parsed) != len(block):
+        return None, cost
+    return [c.text for c in parsed], cost
+
+
+def _process_single_language(lang, srt_files, client, input_dir, output_root, translate_model, memory_model, reset,
+                             reuse_segments=True, blocks=()):
+    """翻译某一种语言的所有 SRT，返回 (日志列表, 该语言总费用)。在工作线程中运行。
+    reuse_segments 时跨集复用已采用的片段译文（见 segment_store）：重复台词不再送模型。
+    blocks 为预扫描找到的跨集共享块（回顾 / 片头）：每块在本语言第一次用到时翻译一次，之后各集直接填入。"""
     logs = [f"### 🟢 开始处理语言: **{lang}**"]
     lang_cost = 0.0
+    block_texts = {}   # 块序号 -> 逐条译文（None 表示该块按普通字幕翻译）
 
-    mem_path = config.memory_path(lang)
     output_dir = Path(output_root) / lang
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    if reset and mem_path.exists():
-        mem_path.unlink()
-    memory = load_memory(mem_path)
+    memories = MemoryStore()
+    if reset:
+        memories.reset(lang)
+        config.memory_path(lang).unlink(missing_ok=True)
+        config.segment_path(lang).unlink(missing_ok=True)
+    memory, mem_version = memories.load(lang)
+    store = SegmentStore.for_lang(lang) if reuse_segments else None
+    manifest = Manifest(output_dir)
 
     for srt_file in srt_files:
         output_path = output_dir / srt_file
-        if output_path.exists():
-            logs.append(f"➡️ 跳过 {lang} - {srt_file}")
+        src_path = Path(input_dir) / srt_file
+        # 源 SRT 内容或翻译设置变了才重译；旧版本留下的输出（清单无记录）直接认领，不重复花钱
+        sig = signature({"srt": src_path}, {"lang": lang, "model": translate_model})
+        if manifest.is_fresh(srt_file, sig, adopt=True):
+            logs.append(f"➡️ 跳过 {lang} - {srt_file}（未变化）")
             continue
         try:
-            srt_content = (Path(input_dir) / srt_file).read_text(encoding="utf-8")
-            translated, cost = translate_srt(client, srt_content, lang, translate_model, memory)
-            lang_cost += cost
-            output_path.write_text(translated, encoding="utf-8")
-            logs.append(f"✅ 完成 {lang} - {srt_file} (费用: ${cost:.4f})")
-
-            # 更新记忆（失败不影响译文）
-            new_memory, mem_cost, err = update_memory(client, translated, memory, memory_model)
-            lang_cost += mem_cost
-            if new_memory is not None:
-                memory.update(new_memory)
-                trim_memory(memory)
-                save_memory(memory, mem_path)
-            elif err:
-                logs.append(f"⚠️ {srt_file}: {err}，本次记忆未更新。")
+            with tracing.span("episode", lang=lang, file=srt_file):
+                srt_content = src_path.read_text(encoding="utf-8")
+                cost, prefilled = 0.0, {}
+                for b, start in episode_blocks(blocks, srt_file):
+                    if b not in block_texts:
+                        with tracing.span("shared_block", lang=lang, cues=len(blocks[b])):
+                            block_texts[b], block_cost = _translate_block(client, blocks[b], lang, translate_model,
+                                                                          memory, store)
+                        cost += block_cost
+                        lang_cost += block_cost   # 每笔费用花掉即计入，本集后面失败也不丢
+                    prefilled.update((start + j, t) for j, t in enumerate(block_texts[b] or ()))
+                hits = store.hits if store is not None else 0
+                translated, episode_cost = translate_srt(client, srt_content, lang, translate_model, memory,
+                                                         store=store, prefilled=prefilled)
+                cost += episode_cost
+                lang_cost += episode_cost
+                output_path.write_text(translated, encoding="utf-8")
+                manifest.record(srt_file, sig)
+                reused = len(prefilled) + (store.hits - hits if store is not None else 0)
+                reused = f"，复用 {reused} 条" if reused else ""
+                logs.append(f"✅ 完成 {lang} - {srt_file} (费用: ${cost:.4f}{reused})")
+                if store is not None:
+                    store.learn(srt_content, translated)
+                    store.save()
+
+                # 更新记忆（失败不影响译文）
+                new_memory, mem_cost, err = update_memory(client, translated, memory, memory_model)
+                lang_cost += mem_cost
+                if new_memory is not None:
+                    # 只提交相对读取时的增量；重新读取以合并同时写入的其他会话（如 Step 2）
+                    memories.commit(lang, {**memory, **new_memory}, mem_version, srt_file)
+                    memory, mem_version = memories.load(lang)
+                elif err:
+                    logs.append(f"⚠️ {srt_file}: {err}，本次记忆未更新。")
         except Exception as e:
-            logs.append(f"❌ {lang} - {srt_file} 翻译失败: {e}")
+            spent = getattr(e, "cost", 0.0)   # 失败的一集（对不齐、API 错误）：已完成的块与补译同样计费
+            lang_cost += spent
+            logs.append(f"❌ {lang} - {srt_file} 翻译失败: {e}" + (f"（已花费 ${spent:.4f}）" if spent else ""))
             continue
 
     logs.append(f"💰 **{lang}** 总费用: **${lang_cost:.4f}**")
@@ -58,7 +109,7 @@ def _process_single_language(lang, srt_files, client, input_dir, output_root, tr
 def run():
     client = get_client()
     if client is None:
-        st.error("未检测到 OPENAI_API_KEY，请检查项目根目录下的 .env 文件。")
+        st.error("未检测到 API Key（OPENAI_API_KEY 或 config.BACKENDS 中配置的后端），请检查项目根目录下的 .env 文件。")
         return
 
     with st.container(border=True):
@@ -89,8 +140,14 @@ def run():
                             help="勾选将删除所选语言的翻译记忆，从头开始。")
         reset_confirmed = True
         if reset:
-            st.warning("⚠️ 此操作会删除所选语言已有的翻译记忆，且无法恢复。")
+            st.warning("⚠️ 此操作会删除所选语言已有的翻译记忆（含已译片段），且无法恢复。")
             reset_confirmed = st.checkbox("我已了解，确认清除记忆", key="reset_confirm")
+        share_blocks = st.checkbox("回顾 / 片头只翻译一次", value=True,
+                                   help="开始前扫描所有集，找出多集共有的连续字幕段（上集回顾、片头曲等），"
+                                        "每种语言只翻译一次，再按各集自己的时间轴填入。")
+        reuse_segments = st.checkbox("复用已译片段（跨集）", value=True,
+                                     help="之前各集译过的相同台词直接沿用译文、不再送模型；相似台词的译文作为参考附在请求里。"
+                                          "回顾、口头禅多的剧能省下不少费用与时间。")
 
     st.divider()
 
@@ -106,30 +163,42 @@ def run():
             return
 
         srt_files = sorted(srt_files, key=_natural_sort_key)
+        blocks = []
+        if share_blocks:
+            episodes = {f: (Path(input_dir) / f).read_text(encoding="utf-8", errors="replace") for f in srt_files}
+            blocks = find_blocks(episodes)
+            if blocks:
+                shared = sum(len(b) * len(b.occurrences) for b in blocks)
+                st.info(f"🔁 发现 {len(blocks)} 段跨集共享字幕（回顾 / 片头，共 {shared} 条），每种语言只翻译一次。")
         total = len(target_langs)
         progress = st.progress(0, text="任务准备就绪...")
         # 每种语言一个独立折叠状态块，互不干扰
         status_blocks = {lang: st.status(f"⏳ 等待中：{lang}", state="running") for lang in target_langs}
         done, total_cost = 0, 0.0
-
-        with ThreadPoolExecutor(max_workers=min(total, 4)) as executor:
-            futures = {executor.submit(_process_single_language, lang, srt_files, client, input_dir,
-                                       output_root, translate_model, memory_model, reset): lang
-                       for lang in target_langs}
-            for future in as_completed(futures):
-                lang = futures[future]
-                block = status_blocks[lang]
-                try:
-                    logs, cost = future.result()
-                    total_cost += cost
-                    for msg in logs:
-                        block.markdown(msg)
-                    block.update(label=f"✅ 完成：{lang}（${cost:.4f}）", state="complete")
-                except Exception as e:
-                    block.markdown(f"严重错误: {e}")
-                    block.update(label=f"❌ 失败：{lang}", state="error")
-                done += 1
-                progress.progress(done / total, text=f"已完成 {done}/{total} 种语言")
-
-        st.balloons()
-        st.success(f"🎉 所有翻译任务完成！总预估费用: ${total_cost:.4f}")
+        tracer = tracing.start_run("translate")
+        try:
+            with ThreadPoolExecutor(max_workers=min(total, 4)) as executor:
+                work = tracing.bind(_process_single_language)   # 语言线程里的 span 记入本次运行
+                futures = {executor.submit(work, lang, srt_files, client, input_dir, output_root, translate_model,
+                                           memory_model, reset, reuse_segments, blocks): lang
+                           for lang in target_langs}
+                for future in as_completed(futures):
+                    lang = futures[future]
+                    block = status_blocks[lang]
+                    try:
+                        logs, cost = future.result()
+                        total_cost += cost
+                        for msg in logs:
+                            block.markdown(msg)
+                        block.update(label=f"✅ 完成：{lang}（${cost:.4f}）", state="complete")
+                    except Exception as e:
+                        block.markdown(f"严重错误: {e}")
+                        block.update(label=f"❌ 失败：{lang}", state="error")
+                    done += 1
+                    progress.progress(done / total, text=f"已完成 {done}/{total} 种语言")
+
+            latency.tracker().save()   # 各模型耗时样本留给下次运行定对冲时机
+            st.balloons()
+            st.success(f"🎉 所有翻译任务完成！总预估费用: ${total_cost:.4f}")
+        finally:
+            show_trace(tracer)   # 出错或被停止时也结束追踪，不让它留在当前会话里继续累积
@@ -1,23 +1,85 @@
 import streamlit as st
+import json
 import os
+import time
 from pathlib import Path
 
 import config
-from translator import get_client, load_memory, save_memory, translate_srt, update_memory, trim_memory
+import latency
+from subtitle_lint import lint_paths, read_report, write_report
+from memory_store import MemoryStore
+from segment_store import SegmentStore
+from translator import get_client, translate_srt, update_memory, concise_instructions, retranslate_cues
+
+RETRANSLATED_PREFIX = "retranslated_"   # 重译结果的文件名前缀；这些是输出，不再参与检查 / 重译
+
+
+def _source_srts(output_dir):
+    """Step 1 产出的 SRT 文件名（排除重译输出），按名排序。"""
+    return sorted(f for f in os.listdir(output_dir)
+                  if f.lower().endswith(".srt") and not f.startswith(RETRANSLATED_PREFIX))
+
+
+def _saved_style():
+    """读取 Step 3 保存的字幕样式；未设置或字体不存在时返回 None（只做时间类检查）。"""
+    try:
+        style = json.loads(config.STYLE_FILE.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return None
+    return style if style.get("font_path") and os.path.exists(style["font_path"]) else None
+
+
+def _learn_corrections(lang, old_srt, new_srt):
+    """把重译的改正写回跨集片段存储（Step 1 开启了片段复用时才有），之后各集不再沿用旧译文。返回改动条数。"""
+    if not config.segment_path(lang).exists():
+        return 0
+    store = SegmentStore.for_lang(lang)
+    n = store.correct(old_srt, new_srt)
+    if n:
+        store.save()
+    return n
+
+
+def _lint_panel(output_dir, srt_file):
+    """可读性检查：扫描整个文件夹写出报告，返回当前文件被标记、且被勾选的字幕序号。"""
+    report_path = Path(output_dir) / config.LINT_REPORT_NAME
+    style = _saved_style()
+    with st.container(border=True):
+        st.subheader("🩺 可读性检查")
+        st.caption(f"检查语速（>{config.LINT_MAX_CPS:g} 字/秒）、时长（<{config.LINT_MIN_DURATION:g}s）、时间重叠"
+                   + ("，以及按 Step 3 样式排版后的超宽 / 超行 / 自动缩字。" if style else
+                      "；未找到 Step 3 样式（或其字体），跳过排版类检查。"))
+        if st.button("检查整个文件夹", use_container_width=True):
+            t0 = time.time()
+            rows, total, errors = lint_paths([Path(output_dir) / f for f in _source_srts(output_dir)], style)
+            write_report(rows, report_path)
+            for name, err in errors:
+                st.warning(f"读取失败：{name}：{err}")
+            st.success(f"检查 {total} 条字幕，标记 {len(rows)} 条，用时 {time.time() - t0:.1f}s；"
+                       f"报告已保存为 `{report_path}`")
+        flagged = read_report(report_path).get(srt_file, [])
+        if not flagged:
+            if report_path.exists():
+                st.info("当前文件在检查报告中没有被标记的字幕。")
+            return []
+        labels = {index: f"#{index}【{issues}】{text[:40]}" for index, issues, text in flagged}
+        return st.multiselect("勾选需要定向重译的字幕（默认全部被标记的字幕）", list(labels),
+                              default=list(labels), format_func=labels.get)
 
 
 def run():
     client = get_client()
     if client is None:
-        st.error("未检测到 OPENAI_API_KEY，请检查项目根目录下的 .env 文件。")
+        st.error("未检测到 API Key（OPENAI_API_KEY 或 config.BACKENDS 中配置的后端），请检查项目根目录下的 .env 文件。")
         return
 
     with st.container(border=True):
         st.subheader("🎯 选择目标文件")
 
-        # 扫描 temp 下已有记忆文件
-        memory_files = sorted(config.TEMP_DIR.glob("drama_memory_*.json"))
-        lang_memories = {f.stem.replace("drama_memory_", ""): f for f in memory_files}
+        # 记忆库里已有的语言，加上尚未导入的旧版 JSON 记忆文件
+        memories = MemoryStore()
+        lang_memories = sorted(set(memories.languages()) | {f.stem.replace("drama_memory_", "")
+                                                             for f in config.TEMP_DIR.glob("drama_memory_*.json")})
         if not lang_memories:
             st.info("尚未发现任何语言的翻译记忆，请先在 Step 1 中运行翻译。")
             return
@@ -26,7 +88,7 @@ def run():
 
         srt_file = None
         if output_dir and os.path.isdir(output_dir):
-            srt_files = sorted(f for f in os.listdir(output_dir) if f.lower().endswith(".srt"))
+            srt_files = _source_srts(output_dir)
             if srt_files:
                 srt_file = st.selectbox("选择需要重新翻译的 SRT 文件：", srt_files)
             else:
@@ -36,17 +98,38 @@ def run():
 
         col1, col2 = st.columns(2)
         with col1:
-            target_lang = st.selectbox("选择目标语言：", list(lang_memories.keys()),
+            target_lang = st.selectbox("选择目标语言：", lang_memories,
                                        help="确保选中的语言在 Step 1 中已生成过记忆文件。")
         with col2:
             translate_model = st.selectbox("翻译模型", config.TRANSLATE_MODELS, index=0)
 
+    picked = _lint_panel(output_dir, srt_file) if srt_file else []
+
     st.divider()
 
+    if picked and st.button(f"🎯 只重译选中的 {len(picked)} 条字幕", use_container_width=True) and target_lang:
+        srt_path = Path(output_dir) / srt_file
+        style = _saved_style()
+        max_lines = (style or {}).get("max_lines") or config.LINT_MAX_LINES
+        with st.spinner("定向重译中，请稍候..."):
+            try:
+                srt_content = srt_path.read_text(encoding="utf-8")
+                translated, cost, replaced = retranslate_cues(
+                    client, srt_content, picked, target_lang, translate_model,
+                    memories.load(target_lang)[0],
+                    concise_instructions(target_lang, config.LINT_MAX_CPS, max_lines))
+                output_path = Path(output_dir) / f"{RETRANSLATED_PREFIX}{srt_file}"
+                output_path.write_text(translated, encoding="utf-8")
+                latency.tracker().save()
+                fixed = _learn_corrections(target_lang, srt_content, translated)
+                st.success(f"🎉 已替换 {replaced}/{len(picked)} 条字幕，费用约 ${cost:.4f}，已保存为: `{output_path}`"
+                           + (f"；片段存储中 {fixed} 条旧译文已更新" if fixed else ""))
+            except Exception as e:
+                st.error(f"翻译过程中发生错误: {e}")
+
     if st.button("🔄 开始重新翻译", type="primary", use_container_width=True) and srt_file and target_lang:
         srt_path = Path(output_dir) / srt_file
-        mem_path = lang_memories.get(target_lang)
-        memory = load_memory(mem_path)
+        memory, mem_version = memories.load(target_lang)
 
         with st.spinner("翻译中，请稍候..."):
             try:
@@ -55,17 +138,19 @@ def run():
 
                 # 更新记忆（失败不影响译文）
                 new_memory, mem_cost, err = update_memory(client, translated, memory, config.DEFAULT_MEMORY_MODEL)
-                if new_memory is not None:
-                    memory.update(new_memory)
-                    trim_memory(memory)
-                    save_memory(memory, mem_path)
+                if new_memory is not None:   # 重译不算新的一集；只提交增量，不覆盖 Step 1 同时写入的条目
+                    memories.commit(target_lang, {**memory, **new_memory}, mem_version, srt_file,
+                                    count_episode=False)
                 elif err:
                     st.warning(f"⚠️ {err}，本次未更新记忆。")
 
-                output_path = Path(output_dir) / f"retranslated_{srt_file}"
+                output_path = Path(output_dir) / f"{RETRANSLATED_PREFIX}{srt_file}"
                 output_path.write_text(translated, encoding="utf-8")
+                latency.tracker().save()
+                fixed = _learn_corrections(target_lang, srt_content, translated)
 
-                st.success(f"🎉 重新翻译完成！费用约 ${cost + mem_cost:.4f}，已保存为: `{output_path}`")
+                st.success(f"🎉 重新翻译完成！费用约 ${cost + mem_cost:.4f}，已保存为: `{output_path}`"
+                           + (f"；片段存储中 {fixed} 条旧译文已更新" if fixed else ""))
                 with st.expander("查看新生成的 SRT 内容 📖"):
                     st.code(translated, language="srt")
             except Exception as e:
@@ -1,22 +1,33 @@
 import streamlit as st
 import json
-import math
 import os
 import shutil
 import subprocess
 import sys
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import lru_cache
 from pathlib import Path
 
 import config  # 必须先于 moviepy 导入：config 会清理无效的 IMAGEMAGICK_BINARY
-from ui_utils import validate_dir
-
-import numpy as np
-from moviepy.editor import VideoFileClip, ImageClip, CompositeVideoClip
-from PIL import Image, ImageFont, ImageDraw
-import pysrt
+import encoders
+import tracing
+from cue_scan import scan_paths
+from cue_style import apply_overrides, load_sidecar, resolve, styled
+from ffmpeg_utils import BatchProgress, find_ffmpeg, format_eta, probe, run_ffmpeg
+from font_subset import prepare_fontsdir
+from manifest import Manifest, signature
+from preview_frames import FrameSource
+from pil_burn import build_overlays, burn_with_frames, burn_with_overlay_track
+from scheduler import AdaptiveScheduler, BurnJob
+from soft_subs import mux_subtitles, subtitle_codec, subtitle_tracks
+from srt_cues import read_srt
+# 排版与测量在 text_layout（与 Streamlit 无关）；这里重新导出，保持 step3.wrap_text_pil 等旧入口可用
+from text_layout import (_LEADING_FORBIDDEN, _get_font, _is_combining_mark, _wrap_and_fit,  # noqa: F401
+                         safe_text, wrap_text_pil)
+from subtitle_render import PreviewCompositor, _hex_to_rgb, render_block, render_preview_pil  # noqa: F401
+from ui_utils import show_trace, validate_dir
+
+from PIL import ImageFont, ImageDraw
 
 # --- Configuration & Helpers ---
 # 字幕渲染统一用 PIL（见 render_block），不再依赖 ImageMagick/TextClip：
@@ -34,107 +45,6 @@ _FONT_CANDIDATES = {
 default_font_path = next((p for p in _FONT_CANDIDATES if os.path.exists(p)), None)
 
 
-def srt_time_to_seconds(t):
-    return t.hours * 3600 + t.minutes * 60 + t.seconds + t.milliseconds / 1000
-
-
-def safe_text(text):
-    if not text:
-        return ""
-    cleaned = "".join(ch for ch in text if ord(ch) >= 32 or ch in "\n\t")
-    return cleaned.strip()
-
-
-def _is_breakable_char(ch):
-    """无空格断行语言（中日韩、泰文及全角标点）——可在字符之间换行。"""
-    o = ord(ch)
-    return (0x4E00 <= o <= 0x9FFF or   # CJK 统一表意文字
-            0x3040 <= o <= 0x30FF or   # 日文平假名 / 片假名
-            0xAC00 <= o <= 0xD7A3 or   # 韩文谚文
-            0x0E00 <= o <= 0x0E7F or   # 泰文
-            0x3000 <= o <= 0x303F or   # CJK 标点
-            0xFF00 <= o <= 0xFFEF)     # 全角字符
-
-
-def _is_combining_mark(ch):
-    """组合附加符号 / 泰文元音声调符号——不应出现在行首，需附着到前一字符。"""
-    o = ord(ch)
-    return (0x0300 <= o <= 0x036F or
-            o == 0x0E31 or 0x0E34 <= o <= 0x0E3A or 0x0E47 <= o <= 0x0E4E)
-
-
-# 避头尾：这些标点不应出现在行首，需并入上一行行尾
-_LEADING_FORBIDDEN = "，。、！？；：）】》」』’”·.,!?;:)]}>"
-
-
-def _apply_kinsoku(lines):
-    """把出现在行首的收尾标点移到上一行末尾（中日韩避头尾规则的简化版）。"""
-    out = []
-    for line in lines:
-        while out and line and line[0] in _LEADING_FORBIDDEN:
-            out[-1] += line[0]
-            line = line[1:]
-        if line:
-            out.append(line)
-    return out
-
-
-@lru_cache(maxsize=16)
-def _get_font(font_path, font_size):
-    """缓存字体对象，避免一集数百条字幕时反复从磁盘加载。"""
-    return ImageFont.truetype(font_path, font_size)
-
-
-def wrap_text_pil(text, font_path, font_size, max_width):
-    """按像素宽度换行。拉丁文按单词换行；中日韩/泰文等无空格语言按字符换行。"""
-    font = _get_font(font_path, font_size)
-
-    def width(s):
-        try:
-            return font.getlength(s)
-        except AttributeError:
-            bbox = font.getbbox(s)
-            return bbox[2] - bbox[0]
-
-    lines = []
-    for paragraph in text.split('\n'):
-        # 切成原子：空格、拉丁单词、单个 CJK/泰文字符
-        atoms, buf = [], ""
-        for ch in paragraph:
-            if _is_combining_mark(ch):
-                if buf:
-                    buf += ch
-                elif atoms:
-                    atoms[-1] += ch
-                else:
-                    buf += ch
-            elif ch == ' ' or _is_breakable_char(ch):
-                if buf:
-                    atoms.append(buf)
-                    buf = ""
-                atoms.append(ch)
-            else:
-                buf += ch
-        if buf:
-            atoms.append(buf)
-
-        para_lines, current = [], ""
-        for atom in atoms:
-            if atom == ' ' and not current:
-                continue  # 跳过行首空格
-            tentative = current + atom
-            if not current or width(tentative) <= max_width:
-                current = tentative
-            else:
-                para_lines.append(current.rstrip())
-                current = "" if atom == ' ' else atom
-        if current.strip():
-            para_lines.append(current.rstrip())
-        # 避头尾仅在同一段（同一原始行）内处理，避免跨行合并
-        lines.extend(_apply_kinsoku(para_lines))
-    return "\n".join(lines)
-
-
 @lru_cache(maxsize=1)
 def _ffmpeg_with_libass():
     """返回带 subtitles(libass) 滤镜的 ffmpeg 路径；找不到返回 None。"""
@@ -156,16 +66,9 @@ def _ffmpeg_with_libass():
     return None
 
 
-@lru_cache(maxsize=4)
 def _has_encoder(exe, name):
-    """ffmpeg 是否包含某编码器（如 h264_nvenc）。"""
-    flags = subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0
-    try:
-        out = subprocess.run([exe, "-hide_banner", "-encoders"], capture_output=True, text=True,
-                             timeout=15, stdin=subprocess.DEVNULL, creationflags=flags).stdout
-        return name in out
-    except Exception:
-        return False
+    """编码器（如 h264_nvenc）是否真正可用：经测试编码确认，结果跨会话缓存（见 encoders）。"""
+    return name in encoders.available(exe)
 
 
 @lru_cache(maxsize=16)
@@ -186,8 +89,56 @@ def _ass_time(t):
     return f"{int(t) // 3600}:{(int(t) // 60) % 60:02d}:{int(t) % 60:02d}.{cs:02d}"
 
 
-def build_ass(subs, style, w, h):
-    """把 SRT + 样式转成 ASS（libass 烧录用）。PlayRes=视频尺寸，字号即像素。"""
+@lru_cache(maxsize=16)
+def _ass_em_scale(font_path):
+    """libass 的字号对应字体的 ascender+descender 高度，PIL 的字号对应 em；返回两者之比。"""
+    try:
+        asc, desc = _get_font(font_path, 1000).getmetrics()
+        return (asc + desc) / 1000
+    except Exception:
+        return 1.0
+
+
+def _ass_size(font_path, size):
+    """与 PIL 字号 size 同样大小的 ASS 字号。"""
+    return round(size * _ass_em_scale(font_path), 2)
+
+
+def _ass_pos(style, w, h):
+    """与 render_block 相同的定位规则，写成 \\anN\\pos(x,y)（顶 / 底行以文字顶部为基准）。"""
+    align = style.get("align") or 2
+    col = (align - 1) % 3
+    side = max(0, (w - style.get("max_text_width", int(w * 0.8))) // 2)
+    x = (side, w // 2, w - side)[col]
+    if 4 <= align <= 6:
+        return f"\\an{4 + col}\\pos({x},{h // 2})"
+    y = style.get("bottom_offset", 80) if align >= 7 else h - style.get("bottom_offset", 80)
+    return f"\\an{7 + col}\\pos({x},{y})"
+
+
+def _ass_override_tags(overrides, prewrap):
+    """单条字幕覆盖项 → ASS 覆盖标签（不含花括号）。prewrap 时方位与字号由调用方按排版结果写入。"""
+    tags = ""
+    if "align" in overrides and not prewrap:
+        tags += f"\\an{overrides['align']}"
+    if "italic" in overrides:
+        tags += f"\\i{int(bool(overrides['italic']))}"
+    if "bold" in overrides:
+        tags += f"\\b{int(bool(overrides['bold']))}"
+    if "font_color" in overrides:
+        tags += f"\\c&H{_ass_color(overrides['font_color'])[4:]}&"   # \c 只取 BBGGRR
+    if "font_size" in overrides and not prewrap:
+        tags += f"\\fs{overrides['font_size']}"
+    return tags
+
+
+def build_ass(subs, style, w, h, prewrap=False, sidecar=None):
+    """把字幕（srt_cues.Cue 列表）+ 样式转成 ASS（libass 烧录用）。PlayRes=视频尺寸，字号即像素。
+    prewrap=True 时每条字幕先用预览同一套排版（按像素换行、避头尾、按行数上限缩字）排好，
+    以 \\N 写死换行并关闭 libass 自动换行（WrapStyle: 2），缩字的条目加 \\fs 覆盖；
+    字号按 em 换算、位置按预览的「文字顶部 = H - 距底部距离」定位，libass 输出与预览一致。
+    单条字幕的样式覆盖（内联 {\\an8} / <i> / <font color> 或旁路样式表 sidecar，见 cue_style）
+    写成 ASS 覆盖标签。"""
     fam = _font_family(style["font_path"])
     bold = -1 if style.get("bold", 0) > 0 else 0
     if style.get("bg_enabled"):
@@ -201,84 +152,117 @@ def build_ass(subs, style, w, h):
         back_col = _ass_color(style.get("shadow_color", "#000000"), style.get("shadow_opacity", 0.5))
     primary = _ass_color(style.get("font_color", "#FFFFFF"))
     side = max(0, (w - style.get("max_text_width", int(w * 0.8))) // 2)
+    font_size = _ass_size(style["font_path"], style["font_size"]) if prewrap else style["font_size"]
     header = f"""[Script Info]
 ScriptType: v4.00+
 PlayResX: {w}
 PlayResY: {h}
-WrapStyle: 0
+WrapStyle: {2 if prewrap else 0}
 ScaledBorderAndShadow: yes
 
 [V4+ Styles]
 Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
-Style: Default,{fam},{style['font_size']},{primary},&H000000FF,{outline_col},{back_col},{bold},0,0,0,100,100,0,0,{border_style},{outline},{shadow},2,{side},{side},{style.get('bottom_offset', 80)},1
+Style: Default,{fam},{font_size},{primary},&H000000FF,{outline_col},{back_col},{bold},0,0,0,100,100,0,0,{border_style},{outline},{shadow},2,{side},{side},{style.get('bottom_offset', 80)},1
 
 [Events]
 Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
 """
     rows = []
     for sub in subs:
-        txt = safe_text(sub.text).replace("\n", "\\N")
-        if txt:
-            rows.append(f"Dialogue: 0,{_ass_time(srt_time_to_seconds(sub.start))},"
-                        f"{_ass_time(srt_time_to_seconds(sub.end))},Default,,0,0,0,,{txt}")
+        txt, overrides = resolve(sub.index, safe_text(sub.text), sidecar)
+        if not txt:
+            continue
+        tags = _ass_override_tags(dict(overrides), prewrap)
+        if prewrap:
+            cue_style = apply_overrides(style, overrides)
+            wrapped, fs = _wrap_and_fit(txt, cue_style)
+            if fs != style["font_size"]:
+                tags += f"\\fs{_ass_size(style['font_path'], fs)}"
+            txt = "{" + _ass_pos(cue_style, w, h) + tags + "}" + wrapped.replace("\n", "\\N")
+        else:
+            txt = ("{" + tags + "}" if tags else "") + txt.replace("\n", "\\N")
+        rows.append(f"Dialogue: 0,{_ass_time(sub.start / 1000)},{_ass_time(sub.end / 1000)},Default,,0,0,0,,{txt}")
     return header + "\n".join(rows) + "\n"
 
 
 def _vcodec_args(encoder, crf, preset):
-    """按编码器返回视频参数。NVENC 用 -cq 控质量，与 CRF 同档对应。
-    NVENC 默认效率差(码率偏高)，这里开启 AQ / 前瞻 / B帧 / 多遍，显著压低码率、贴近 libx264。"""
-    if encoder == "h264_nvenc":
-        return ["-c:v", "h264_nvenc", "-preset", config.NVENC_PRESET_MAP.get(preset, "p5"),
-                "-tune", "hq", "-rc", "vbr", "-cq", str(crf), "-b:v", "0",
-                "-multipass", "fullres",      # 两遍编码，码率分配更准
-                "-spatial-aq", "1", "-temporal-aq", "1",  # 自适应量化，省码率
-                "-rc-lookahead", "20", "-bf", "3",        # 前瞻 + B帧，提升压缩率
-                "-pix_fmt", "yuv420p"]
-    return ["-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p"]
-
-
-def burn_with_ffmpeg(exe, video_path, ass_path, out_path, crf, preset, fontsdir=None, threads=0, encoder="libx264"):
-    """用 libass 一趟烧录。视频按 encoder 选 CPU/GPU；NVENC 运行失败自动回退 libx264。
-    音频默认直接复制(更快、无损)，失败则回退到 aac。"""
+    """按编码器返回视频参数：CRF / preset 映射到各编码器自己的质量与速度参数（见 encoders.REGISTRY）。"""
+    return encoders.video_args(encoder, crf, preset)
+
+
+def burn_with_ffmpeg(exe, video_path, ass_path, out_path, crf, preset, fontsdir=None, threads=0, encoder="libx264",
+                     duration=None, on_progress=None):
+    """用 libass 一趟烧录。视频按 encoder 选编码器；硬件 / 非 libx264 编码失败自动回退 libx264。
+    音频默认直接复制(更快、无损)，失败则回退到 aac。
+    on_progress(snapshot) 实时接收 fps / 速度 / 百分比（见 ffmpeg_utils.ProgressParser）。"""
     def esc(p):  # subtitles 滤镜里需转义反斜杠与冒号
         return str(p).replace("\\", "/").replace(":", "\\:")
     vf = f"subtitles='{esc(ass_path)}'"
     if fontsdir:
         vf += f":fontsdir='{esc(fontsdir)}'"
-    flags = subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0  # Windows 下不弹黑框
-    # -nostdin / stdin=DEVNULL：ffmpeg 默认会读 stdin，被 Streamlit 这类无控制台进程拉起时
-    # 会卡在等待输入（不报错、不出文件）。务必关掉。
-    head = [exe, "-nostdin", "-loglevel", "error", "-y", "-i", str(video_path), "-vf", vf]
     tail = (["-threads", str(threads)] if threads else [])
     err = ""
-    encoders = [encoder, "libx264"] if encoder != "libx264" else ["libx264"]  # GPU 失败回退 CPU
-    for enc in encoders:
+    for enc in ([encoder, "libx264"] if encoder != "libx264" else ["libx264"]):  # 失败回退 libx264
+        spec = encoders.get(enc)
+        head = [exe, "-nostdin", "-loglevel", "error", "-y", *spec.input_args, "-i", str(video_path),
+                "-vf", ",".join(filter(None, [vf, spec.upload]))]
         for audio in (["-c:a", "copy"], ["-c:a", "aac"]):
             cmd = head + _vcodec_args(enc, crf, preset) + tail + audio + [str(out_path)]
-            r = subprocess.run(cmd, capture_output=True, text=True,
-                               stdin=subprocess.DEVNULL, creationflags=flags)
-            if r.returncode == 0:
+            code, err = run_ffmpeg(cmd, duration, on_progress)
+            if code == 0:
                 return
-            err = r.stderr
     raise RuntimeError(err[-500:] if err else "ffmpeg 失败")
 
 
-def generate_subtitle_clips(subs, w, h, style):
-    """为每条字幕生成一个【紧凑】定位的透明 ImageClip（与预览同一套 PIL 渲染）。"""
-    clips = []
-    for sub in subs:
-        safe_txt = safe_text(sub.text)
-        if not safe_txt:
-            continue
-        block, x, y = render_block((w, h), safe_txt, style)
-        start, end = srt_time_to_seconds(sub.start), srt_time_to_seconds(sub.end)
-        clip = ImageClip(np.array(block), transparent=True).set_position((x, y)).set_start(start).set_end(end)
-        clips.append(clip)
-    return clips
+def burn_with_pil(exe, video_path, out_path, subs, style, info, crf, preset, threads=0, encoder="libx264",
+                  on_progress=None, engine="overlay", sidecar=None):
+    """无需 libass 的烧录：每条字幕用 render_block 渲染一次，与预览同一套 PIL 渲染，像素级一致。
+    engine="overlay"：预渲染 PNG 叠加轨 + ffmpeg overlay 滤镜（快，失败自动改用逐帧合成）；
+    engine="frames"：pil_burn 多进程逐帧合成。非 libx264 编码失败自动回退 libx264。
+    sidecar 为旁路样式表（cue_style.load_sidecar），与内联标注一起生成单条字幕的样式变体。"""
+    # 每条字幕以 (文本, 覆盖项) 为键：相同文本、相同覆盖项只渲染一次
+    cues = [(s.start / 1000, s.end / 1000, resolve(s.index, safe_text(s.text), sidecar)) for s in subs]
+    overlays = build_overlays([c for c in cues if c[2][0]], (info["width"], info["height"]),
+                              lambda size, key: render_block(size, key[0], apply_overrides(style, key[1])))
+    threads = threads or (os.cpu_count() or 4)
+    workers = max(1, threads // 2)   # 逐帧合成：每段一个解码 + 一个编码进程，各分约 2 线程
+    err = None
+    for enc in ([encoder, "libx264"] if encoder != "libx264" else ["libx264"]):
+        vcodec, spec = _vcodec_args(enc, crf, preset), encoders.get(enc)
+        if engine == "overlay":
+            try:
+                return burn_with_overlay_track(exe, video_path, out_path, overlays, info, vcodec, threads, on_progress,
+                                               spec.input_args, spec.upload)
+            except RuntimeError as e:
+                err = e
+        try:
+            return burn_with_frames(exe, video_path, out_path, overlays, info, vcodec,
+                                    workers, max(1, threads // workers), on_progress, spec.input_args, spec.upload)
+        except RuntimeError as e:
+            err = e
+    raise err
+
 
+# Step 3 烧录引擎：显示名 -> 内部名（None 表示自动）
+_ENGINES = {"自动": None, "libass（最快）": "libass", "PNG 叠加轨（与预览一致）": "overlay",
+            "逐帧合成（兜底）": "frames", "软字幕封装（不重编码）": "mux"}
+# 编码器自动策略：显示名 -> encoders.POLICIES 的键（「自动」沿用旧名，清单里的旧记录仍有效）
+_ENCODER_POLICIES = {"自动": "compat", "自动 · 速度优先": "speed", "自动 · 体积优先": "size"}
+# 软字幕封装的输出容器：显示名 -> 扩展名（None 表示沿用原视频容器）
+_CONTAINERS = {"沿用原容器（MP4 / MOV → mov_text）": None, "MKV（ASS，保留设计样式）": ".mkv"}
 
-def _burn_one(i, video_name, video_dir, srt_dir, output_dir, match_mode, srt_files, style, crf, preset, ffexe, threads, encoder="libx264"):
+
+def _burn_one(i, video_name, video_dir, srt_dir, output_dir, match_mode, srt_files, style, crf, preset, ffexe, threads,
+              encoder="libx264", manifest=None, progress=None, encoder_policy=None, engine="libass", prewrap=False,
+              container=None):
     """烧录单个视频。纯函数、不调用 st.*（在工作线程中运行）。
+    engine ∈ {libass, overlay, frames, mux}；libass 需 ffexe 可用，否则按 overlay 处理。
+    mux 不烧录、不重编码：把字幕封装为软字幕轨（见 _mux_one），container 为输出扩展名（None 沿用原视频）。
+    prewrap 影响 libass 与 MKV 软字幕：按预览排版预先换行（见 build_ass）。
+    传入 manifest 时，视频 / SRT / 字体内容与样式、编码设置都未变化的输出直接跳过。
+    encoder_policy 为用户选择的编码策略（如「自动」）：调度器可能把同一任务分到 GPU 或 CPU，
+    清单按策略而非实际编码器记录，避免下次仅因分配不同而重烧。
+    传入 progress（BatchProgress）时以 video_name 为键实时上报编码进度。
     返回 (video_name, status, msg)，status ∈ {ok, skip, error}。"""
     video_path = Path(video_dir) / video_name
     output_path = Path(output_dir) / video_name
@@ -289,99 +273,138 @@ def _burn_one(i, video_name, video_dir, srt_dir, output_dir, match_mode, srt_fil
     else:
         return video_name, "skip", "没有对应的 SRT（按顺序对应不足）"
     srt_path = Path(srt_dir) / srt_name
+    if engine == "mux":
+        return _mux_one(i, video_name, video_path, srt_dir, srt_name, output_dir, style, container, prewrap,
+                        manifest, progress)
     if not srt_path.exists():
         return video_name, "skip", f"对应的 SRT（{srt_name}）未找到"
+    if engine == "libass" and not ffexe:
+        engine = "overlay"
+    styles_path = srt_path.with_suffix(".styles.json")   # 可选的旁路样式表（见 cue_style）
+    sig = None
+    if manifest is not None:
+        settings = {"style": style, "crf": crf, "preset": preset, "encoder": encoder_policy or encoder,
+                    "engine": engine}
+        if prewrap and engine == "libass":
+            settings["prewrap"] = True   # 只在开启时写入，旧清单里关闭预换行的输出仍视为最新
+        inputs = {"video": video_path, "srt": srt_path, "font": style.get("font_path")}
+        if styles_path.exists():
+            inputs["styles"] = styles_path
+        sig = signature(inputs, settings)
+        if manifest.is_fresh(video_name, sig):
+            if progress is not None:
+                progress.finish(video_name, counted=False)
+            return video_name, "skip", "输入与设置均未变化"
     try:
         t0 = time.time()
-        subs = pysrt.open(str(srt_path), encoding='utf-8')
-        if ffexe:
-            with VideoFileClip(str(video_path)) as vc:  # 仅读分辨率
-                vw, vh = vc.size
+        subs = read_srt(srt_path)
+        sidecar = load_sidecar(srt_path)
+        exe = ffexe or find_ffmpeg()
+        if not exe:
+            raise RuntimeError("未找到 ffmpeg")
+        info = probe(exe, video_path)  # 仅读分辨率与时长，比打开 VideoFileClip 快得多
+        if progress is not None:
+            progress.start(video_name, info["duration"])
+        on_progress = (lambda snap: progress.update(video_name, snap)) if progress is not None else None
+        if engine == "libass":
             ass_path = config.TEMP_DIR / f"_burn_{i}.ass"  # 按序号唯一，避免并行互相覆盖
-            ass_path.write_text(build_ass(subs, style, vw, vh), encoding="utf-8")
-            fontsdir = str(Path(style["font_path"]).parent) if os.path.isfile(style["font_path"]) else None
-            burn_with_ffmpeg(ffexe, video_path, ass_path, output_path, crf, preset, fontsdir, threads, encoder)
+            with tracing.span("ass_build", cues=len(subs), prewrap=prewrap):
+                ass_path.write_text(build_ass(subs, style, info["width"], info["height"], prewrap, sidecar),
+                                    encoding="utf-8")
+            fontsdir = None
+            if os.path.isfile(style["font_path"]):
+                # 只放本集用到字形的子集字体：libass 不再扫描整个字体目录（见 font_subset）
+                try:
+                    with tracing.span("font_subset"):
+                        fontsdir = str(prepare_fontsdir(style["font_path"], [s.text for s in subs]))
+                except OSError:
+                    fontsdir = str(Path(style["font_path"]).parent)
+            with tracing.span("encode", engine=engine, encoder=encoder, video=video_name, duration_s=info["duration"]):
+                burn_with_ffmpeg(ffexe, video_path, ass_path, output_path, crf, preset, fontsdir, threads, encoder,
+                                 info["duration"], on_progress)
         else:
-            with VideoFileClip(str(video_path)) as video_clip:
-                clips = generate_subtitle_clips(subs, video_clip.w, video_clip.h, style)
-                final = CompositeVideoClip([video_clip, *clips])
-                final.write_videofile(str(output_path), codec="libx264", audio_codec="aac", preset=preset,
-                                      ffmpeg_params=["-crf", str(crf)], threads=threads or 4, logger=None)
-                final.close()
+            with tracing.span("encode", engine=engine, encoder=encoder, video=video_name, duration_s=info["duration"]):
+                burn_with_pil(exe, video_path, output_path, subs, style, info, crf, preset, threads, encoder,
+                              on_progress, engine, sidecar)
+        if manifest is not None:
+            manifest.record(video_name, sig)
+        if progress is not None:
+            progress.finish(video_name)
         return video_name, "ok", f"完成（耗时 {time.time() - t0:.0f}s）"
     except Exception as e:
+        if progress is not None:
+            progress.finish(video_name, counted=False)
         return video_name, "error", f"出错: {e}"
 
 
-def _hex_to_rgb(hex_color):
-    h = hex_color.lstrip("#")
-    return tuple(int(h[i:i + 2], 16) for i in (0, 2, 4))
-
-
-def _wrap_and_fit(text, style):
-    """换行，并在设置了 max_lines 时自动缩小字号以满足行数上限。
-    返回 (换行后文本, 实际字号)。"""
-    fs = style["font_size"]
-    max_lines = style.get("max_lines", 0)
-    while True:
-        wrapped = wrap_text_pil(text, style["font_path"], fs, style["max_text_width"])
-        if not max_lines or wrapped.count("\n") + 1 <= max_lines or fs <= 12:
-            return wrapped, fs
-        fs -= 2
-
-
-_SCRATCH = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
-
-
-def render_block(frame_size, text, style):
-    """把单条字幕渲染成一张【紧凑】RGBA 小图（背景条+阴影+描边+伪加粗+文字），
-    返回 (img, x, y) 左上角粘贴坐标。预览与烧录共用，保证所见即所得。
-    用小图而非整帧图层：合成成本随文字块大小而非画面分辨率，烧录才不会慢。"""
-    W, H = frame_size
-    wrapped, fs = _wrap_and_fit(text, style)
-    font = _get_font(style["font_path"], fs)
-    bold = style.get("bold", 0)
-    outline = style.get("stroke_width", 0)
-    spacing = style.get("line_spacing", max(2, int(fs * 0.2)))
-    total = outline + bold
-    sx, sy = style.get("shadow_offset", (0, 2)) if style.get("shadow_opacity", 0) > 0 else (0, 0)
-    common = dict(font=font, anchor="la", align="center", spacing=spacing)
-
-    l, t, r, b = _SCRATCH.multiline_textbbox((0, 0), wrapped, stroke_width=total, **common)
-    # 某些 Pillow 版本 textbbox 返回 float；取整避免 Image.new/坐标报 'float' object cannot be interpreted as an integer
-    l, t, r, b = math.floor(l), math.floor(t), math.ceil(r), math.ceil(b)
-    pad = style.get("bg_padding", 12) if style.get("bg_enabled") else max(2, total)
-    bw = (r - l) + 2 * pad + abs(sx)
-    bh = (b - t) + 2 * pad + abs(sy)
-    block = Image.new("RGBA", (bw, bh), (0, 0, 0, 0))
-    d = ImageDraw.Draw(block)
-    tx = pad - l + max(0, -sx)   # 文字绘制基点，使内容含 pad 并为阴影方向留白
-    ty = pad - t + max(0, -sy)
+def _mux_one(i, video_name, video_path, srt_dir, srt_name, output_dir, style, container, prewrap, manifest, progress):
+    """软字幕封装单个视频（_burn_one 的 mux 分支）。各语言子文件夹里的同名 SRT 各成一轨（见 soft_subs）；
+    MP4 直接封装 SRT 为 mov_text，MKV 先按设计样式生成 ASS 并附带子集字体。清单以输出文件名为键。"""
+    tracks = subtitle_tracks(srt_dir, srt_name)
+    if not tracks:
+        return video_name, "skip", f"对应的 SRT（{srt_name}）未找到"
+    output_path = Path(output_dir) / video_name
+    output_path = output_path.with_suffix(container or output_path.suffix.lower())
+    try:
+        as_ass = subtitle_codec(output_path) == "ass"
+    except ValueError as e:
+        return video_name, "error", f"出错: {e}"
+    sig = None
+    if manifest is not None:
+        inputs = {"video": video_path}
+        for path, lang in tracks:
+            inputs[f"srt:{lang or ''}"] = path
+            if as_ass and path.with_suffix(".styles.json").exists():
+                inputs[f"styles:{lang or ''}"] = path.with_suffix(".styles.json")
+        settings = {"engine": "mux"}
+        if as_ass:   # 只有 ASS 轨带样式；mov_text 与样式无关，改样式不必重新封装
+            inputs["font"] = style.get("font_path")
+            settings.update(style=style, prewrap=bool(prewrap))
+        sig = signature(inputs, settings)
+        if manifest.is_fresh(output_path.name, sig):
+            if progress is not None:
+                progress.finish(video_name, counted=False)
+            return video_name, "skip", "输入与设置均未变化"
+    try:
+        t0 = time.time()
+        exe = find_ffmpeg()
+        if not exe:
+            raise RuntimeError("未找到 ffmpeg")
+        info = probe(exe, video_path)
+        if progress is not None:
+            progress.start(video_name, info["duration"])
+        on_progress = (lambda snap: progress.update(video_name, snap)) if progress is not None else None
+        fonts = []
+        if as_ass:
+            texts = []
+            for k, (path, lang) in enumerate(tracks):
+                subs = read_srt(path)
+                ass_path = config.TEMP_DIR / f"_mux_{i}_{k}.ass"   # 按序号唯一，避免并行互相覆盖
+                with tracing.span("ass_build", cues=len(subs), lang=lang, prewrap=prewrap):
+                    ass_path.write_text(build_ass(subs, style, info["width"], info["height"], prewrap,
+                                                  load_sidecar(path)), encoding="utf-8")
+                tracks[k] = (ass_path, lang)
+                texts += [s.text for s in subs]
+            if os.path.isfile(style["font_path"]):
+                fonts = sorted(prepare_fontsdir(style["font_path"], texts).iterdir())
+        with tracing.span("encode", engine="mux", video=video_name, tracks=len(tracks)):
+            mux_subtitles(exe, video_path, output_path, tracks, fonts, info["duration"], on_progress)
+        if manifest is not None:
+            manifest.record(output_path.name, sig)
+        if progress is not None:
+            progress.finish(video_name)
+        langs = "、".join(lang or "默认" for _, lang in tracks)
+        return video_name, "ok", f"已封装 {len(tracks)} 条字幕轨（{langs}）→ {output_path.name}（耗时 {time.time() - t0:.1f}s）"
+    except Exception as e:
+        if progress is not None:
+            progress.finish(video_name, counted=False)
+        return video_name, "error", f"出错: {e}"
 
-    if style.get("bg_enabled"):
-        bg = _hex_to_rgb(style.get("bg_color", "#000000")) + (int(255 * style.get("bg_opacity", 0.5)),)
-        d.rounded_rectangle([tx + l - pad, ty + t - pad, tx + r + pad, ty + b + pad],
-                            radius=style.get("bg_radius", 10), fill=bg)
-    if style.get("shadow_opacity", 0) > 0:
-        sh = _hex_to_rgb(style["shadow_color"]) + (int(255 * style["shadow_opacity"]),)
-        d.multiline_text((tx + sx, ty + sy), wrapped, fill=sh, stroke_width=bold, **common)
-    if outline > 0:
-        edge = _hex_to_rgb(style["stroke_color"]) + (255,)
-        d.multiline_text((tx, ty), wrapped, fill=edge, stroke_width=outline + bold, stroke_fill=edge, **common)
-    fill = _hex_to_rgb(style["font_color"]) + (255,)
-    d.multiline_text((tx, ty), wrapped, fill=fill, stroke_width=bold, stroke_fill=fill, **common)
-
-    x = (W - bw) // 2
-    y = H - style["bottom_offset"] - ty   # 保持"文字顶部≈H-bottom_offset"的旧定位
-    return block, x, y
-
-
-def render_preview_pil(frame_img, text, style):
-    """实时预览：把紧凑字幕块贴到缓存帧上。"""
-    base = frame_img.convert("RGBA")
-    block, x, y = render_block(base.size, text, style)
-    base.alpha_composite(block, (max(0, x), max(0, y)))
-    return base.convert("RGB")
+
+def _progress_line(name, job):
+    """一行运行中任务状态：百分比 / fps / 速度倍率。"""
+    pct = f"{job['out_time'] / job['duration']:.0%}" if job["duration"] else "--"
+    return f"- ⏳ `{name}` {pct}｜{job['fps']:.0f} fps｜{job['speed']:.2f}x"
 
 
 def _save_style(style):
@@ -433,6 +456,61 @@ def _draw_safe_area(img):
     return img
 
 
+def _set_preview_frame(src, t):
+    """设置设计器底图，并记下它的身份（内容哈希、时间、宽度），合成缓存据此判断是否需要重建。"""
+    frame = src.frame(t)
+    st.session_state['preview_frame'] = frame
+    st.session_state['preview_frame_id'] = (src.key, int(round(t * 1000)), frame.width)
+
+
+def _cue_frame(srt_path, t, video_dir):
+    """字幕时间点的底图：视频文件夹里有同名视频则 seek 取帧，否则用预览视频（超出时长时取其末尾附近）。"""
+    if video_dir:
+        for ext in (".mp4", ".mov", ".mkv"):
+            video = Path(video_dir) / (srt_path.stem + ext)
+            if video.exists():
+                return FrameSource(path=video).frame(t)
+    src = st.session_state.get('preview_source')
+    if src is not None:
+        duration = src.info().get("duration") or 0.0
+        return src.frame(min(t, max(0.0, duration - 0.5)))
+    return st.session_state['preview_frame']
+
+
+def _timeline_preview(style):
+    """设计器里的「时间轴预览」：扫描真实 SRT，按渲染宽度 / 行数列出最差的字幕并在其时间点合成预览。"""
+    with st.expander("📏 时间轴预览：找出最长的字幕"):
+        target = st.text_input("SRT 文件或文件夹路径", key="scan_target",
+                               help="填文件夹则扫描其中全部 .srt（如一整季），按同一套排版测量找出最可能溢出的字幕。")
+        video_dir = st.text_input("对应视频文件夹（可选，按文件名匹配）", key="scan_video_dir",
+                                  help="留空则在上方预览视频的对应时间点取帧。")
+        top = st.slider("显示最差的前 N 条", 1, 30, 6, key="scan_top")
+        if st.button("扫描字幕", disabled=not target):
+            p = Path(target)
+            paths = sorted(p.glob("*.srt")) if p.is_dir() else [p]
+            t0 = time.time()
+            ranked, errors = scan_paths(paths, style, top)
+            st.session_state['scan_result'] = (ranked, errors, len(paths), time.time() - t0)
+        if 'scan_result' not in st.session_state:
+            return
+        ranked, errors, n_files, elapsed = st.session_state['scan_result']
+        st.caption(f"扫描 {n_files} 个文件，用时 {elapsed:.2f}s；按「超宽 > 超行 > 缩字 > 行数 > 宽度」排序。")
+        for path, err in errors:
+            st.warning(f"读取失败：{path.name}：{err}")
+        for path, (index, start, end, text), m in ranked:
+            flags = [name for key, name in (("too_wide", "超宽"), ("too_many", "超行"), ("shrunk", "缩字"))
+                     if m[key]]
+            st.markdown(f"**{path.name} #{index}** · {start:.1f}s · {m['lines']} 行 · "
+                        f"宽 {m['width']:.0f}/{style['max_text_width']}px · 字号 {m['font_size']}"
+                        + (f" · ⚠️ {'、'.join(flags)}" if flags else ""))
+            try:
+                frame = _cue_frame(path, (start + end) / 2, video_dir)
+                clean, cue_style = styled(text, style, index, load_sidecar(path))
+                st.image(render_preview_pil(frame, clean, cue_style), use_container_width=True)
+            except Exception as e:
+                st.caption(f"取帧失败：{e}")
+
+
 # --- Main Application ---
 def run():
     if default_font_path is None:
@@ -456,25 +534,43 @@ def run():
             preview_video = st.file_uploader("选择一个视频用于字幕样式预览", type=["mp4", "mov", "mkv"])
             show_guides = st.checkbox("显示安全区参考线", value=False,
                                       help="黄框为标题安全区(5% 边距)，红线为水平中线，便于对齐。")
+            small_preview = st.checkbox("缩小预览（大分辨率源更流畅）", value=True,
+                                        help=f"宽于 {config.PREVIEW_MAX_WIDTH}px 的视频按比例缩小显示；"
+                                             "排版仍按原分辨率计算，与烧录一致。")
             if preview_video is not None:
-                # 预览只需一帧：仅在「新上传」时解码一次，取帧后立即删除临时视频，
-                # 后续每次拖动滑块都复用缓存帧，不再重复读写/解码整段视频。
+                # 预览只需一帧：新上传时按内容哈希查磁盘缓存，未命中才把上传内容分块落盘，
+                # 用 ffmpeg 输入端 seek 只解码一帧（不再整段写盘后用 VideoFileClip 打开）。
                 file_key = getattr(preview_video, "file_id", None) or (preview_video.name, preview_video.size)
                 if st.session_state.get("preview_file_key") != file_key:
-                    tmp = config.TEMP_DIR / "preview_frame_src"
                     try:
-                        tmp.write_bytes(preview_video.getvalue())
-                        with VideoFileClip(str(tmp)) as clip:
-                            t = min(1.0, (clip.duration or 0) / 2)
-                            st.session_state['preview_frame'] = Image.fromarray(clip.get_frame(t))
-                            st.session_state['video_size'] = clip.size
+                        src = FrameSource(preview_video)
+                        info = src.info()
+                        _set_preview_frame(src, src.default_time())
+                        st.session_state['video_size'] = (info["width"], info["height"])
+                        st.session_state['preview_source'] = src
                         st.session_state['preview_file_key'] = file_key
                     except Exception as e:
                         st.error(f"视频加载失败: {e}")
-                        st.session_state.pop('preview_frame', None)
-                        st.session_state.pop('preview_file_key', None)
-                    finally:
-                        tmp.unlink(missing_ok=True)
+                        for k in ('preview_frame', 'preview_frame_id', 'preview_file_key', 'preview_source'):
+                            st.session_state.pop(k, None)
+                src = st.session_state.get('preview_source')
+                if src is not None:
+                    with st.expander("🎞️ 选择代表帧"):
+                        # 缩略图条只在展开并点击后才生成（每张一次 seek，结果按内容哈希缓存到磁盘）
+                        if st.button("生成缩略图条") or st.session_state.get('preview_thumbs_key') == src.key:
+                            st.session_state['preview_thumbs_key'] = src.key
+                            cols = st.columns(4)
+                            for k, (t, thumb) in enumerate(src.thumbnails(8)):
+                                with cols[k % 4]:
+                                    st.image(thumb, caption=f"{t:.1f}s", use_container_width=True)
+                                    if st.button("用这一帧", key=f"thumb_{k}", use_container_width=True):
+                                        _set_preview_frame(src, t)
+                        duration = src.info().get("duration") or 0.0
+                        if duration > 0:
+                            t = st.number_input("或指定时间(秒)", 0.0, float(duration), float(src.default_time()),
+                                                step=1.0, key="preview_frame_time")
+                            if st.button("跳到该时间"):
+                                _set_preview_frame(src, t)
 
         with col2:
             st.subheader("⚙️ 样式参数")
@@ -574,7 +670,13 @@ def run():
                     st.info(f"「{preview_lang_display}」为非拉丁文字，默认 Arial 无法显示，"
                             "请在右侧上传对应字体后再预览。")
                 try:
-                    preview_img = render_preview_pil(st.session_state['preview_frame'], preview_text, style)
+                    # 合成缓存随底图 / 缩放设置重建；拖动滑块只重绘受影响的缓存层
+                    comp_key = (st.session_state.get('preview_frame_id'), small_preview)
+                    if st.session_state.get('preview_compositor_key') != comp_key:
+                        st.session_state['preview_compositor'] = PreviewCompositor(
+                            st.session_state['preview_frame'], config.PREVIEW_MAX_WIDTH if small_preview else None)
+                        st.session_state['preview_compositor_key'] = comp_key
+                    preview_img = st.session_state['preview_compositor'].render(preview_text, style)
                     if show_guides:
                         preview_img = _draw_safe_area(preview_img)
                     st.image(preview_img, caption="字幕样式预览（实时；与最终烧录一致）")
@@ -582,6 +684,8 @@ def run():
                     st.warning(f"⚠️ 预览渲染失败（通常是字体问题）：{e}\n"
                                f"请尝试上传一个标准 .ttf 字体；非拉丁语言需上传对应字体。")
 
+                _timeline_preview(style)
+
     # --- Tab 2: Batch Processing ---
     with tab2:
         style = _load_style()
@@ -616,28 +720,72 @@ def run():
                                       index=config.ENCODE_PRESETS.index(config.DEFAULT_PRESET),
                                       help="越靠后越慢、压缩率越高（体积更小）。CPU 求最小体积选 slow。")
             ffexe = _ffmpeg_with_libass()
-            gpu_ok = bool(ffexe) and _has_encoder(ffexe, "h264_nvenc")
+            anyexe = ffexe or find_ffmpeg()   # 无 libass 时仍用普通 ffmpeg 做解码 / 编码
+            usable = encoders.available(anyexe) if anyexe else ()
             r_col1, r_col2 = st.columns(2)
             with r_col1:
-                concurrency = st.slider("并行任务数", 1, 4, 2,
-                                        help="同时烧录的视频数。单个编码已多线程，单机 2 通常最划算；机器强可调高。")
+                concurrency = st.slider("最大并行任务数", 1, 8, 4,
+                                        help="同时烧录视频数的上限。实际并发由调度器按 CPU 利用率与编码器自动决定："
+                                             "长视频优先，硬件编码会话数受限，空闲核心留给 CPU 任务。")
             with r_col2:
-                enc_choice = st.selectbox("编码器", ["自动", "GPU (NVENC)", "CPU (libx264)"],
-                                          help="CPU(libx264)：压缩率最高，同体积画质最好，但慢。\n"
-                                               "GPU(NVENC)：显卡硬件编码，快数倍，但同画质体积略大。\n"
-                                               "自动：检测到 N 卡用 GPU，否则 CPU。")
-            encoder = (("h264_nvenc" if gpu_ok else "libx264") if enc_choice == "自动"
-                       else "h264_nvenc" if enc_choice.startswith("GPU") else "libx264")
+                enc_choice = st.selectbox(
+                    "编码器", list(_ENCODER_POLICIES) + [e.label for e in encoders.REGISTRY.values()],
+                    help="自动：按策略在本机可用的编码器里挑选（可用性经实际测试编码确认）。\n"
+                         "兼容：只选 H.264，有显卡硬件编码就用（NVENC / QSV / VAAPI），否则 libx264。\n"
+                         "速度优先：最快的可用编码器。体积优先：同画质体积最小（H.265 / AV1，较慢，部分旧设备不支持）。\n"
+                         "CPU(libx264)：压缩率高、兼容最好，但慢；GPU：快数倍，但同画质体积略大。")
+            if enc_choice in _ENCODER_POLICIES:
+                encoder = encoders.choose(_ENCODER_POLICIES[enc_choice], usable)
+            else:
+                encoder = next(n for n, e in encoders.REGISTRY.items() if e.label == enc_choice)
+            spec = encoders.get(encoder)
+            st.caption("本机可用编码器：" + ("、".join(encoders.REGISTRY[n].label for n in usable) or "无")
+                       + "（测试编码确认，结果已缓存）")
+            if st.button("🔄 重新检测编码器", help="换了显卡 / 驱动 / ffmpeg 后点此重测。"):
+                encoders.probe_encoders(anyexe, refresh=True)
+                encoders.available.cache_clear()
+                st.rerun()
             # 明确告诉用户当前取舍：质量/体积优先走 CPU，速度优先走 GPU
-            if enc_choice.startswith("GPU") and not gpu_ok:
-                st.warning("⚠️ 未检测到可用 NVENC，将自动改用 CPU(libx264)。"
-                           "需带 nvenc 的 ffmpeg + N 卡驱动；可装 gyan.dev 完整版 ffmpeg 并加入 PATH。")
-            elif encoder == "h264_nvenc":
-                st.info("🚀 **GPU 模式（速度优先）**：编码快数倍。同画质下体积比 CPU 略大——"
+            if encoder not in usable and encoder != "libx264":
+                st.warning(f"⚠️ 本机无法使用 {spec.label}，将自动改用 CPU(libx264)。"
+                           "硬件编码需对应显卡驱动与带该编码器的 ffmpeg（如 gyan.dev 完整版）。")
+                encoder, spec = "libx264", encoders.get("libx264")
+            if spec.hardware:
+                st.info(f"🚀 **{spec.label}（速度优先）**：编码快数倍。同画质下体积比 CPU 略大——"
                         "想更小就把「压缩质量」调到 28~32，或改用 CPU。")
+            elif spec.codec != "h264":
+                st.info(f"📉 **{spec.label}（体积优先）**：同画质体积明显更小，但编码慢得多；"
+                        "请确认发布平台支持该编码。")
             else:
-                st.success("🎯 **CPU 模式（质量/体积优先）**：压缩率最高、同体积画质最好，但较慢。"
-                           "求最小体积把 preset 选 slow；想快就改 GPU。" + ("" if gpu_ok else "（本机未检测到 NVENC）"))
+                st.success("🎯 **CPU 模式（质量/体积优先）**：压缩率高、兼容性最好，但较慢。"
+                           "求最小体积把 preset 选 slow；想快就改 GPU。"
+                           + ("" if any(encoders.is_hardware(n) for n in usable) else "（本机未检测到可用的硬件编码器）"))
+            engine_choice = st.selectbox(
+                "烧录引擎", list(_ENGINES), help="libass：最快，由 libass 排版（需带 libass 的 ffmpeg）。\n"
+                                                 "PNG 叠加轨：每条字幕用预览同一套渲染器画成 PNG，ffmpeg 原生 overlay 叠加，"
+                                                 "与预览像素级一致，速度接近 libass。\n"
+                                                 "逐帧合成：多进程 NumPy 合成，最慢，仅作兜底。\n"
+                                                 "软字幕封装：不烧录、不重新编码，把字幕作为可开关的字幕轨放进视频，"
+                                                 "每集几秒完成（需平台 / 播放器支持字幕轨）。\n"
+                                                 "自动：有 libass 用 libass，否则用 PNG 叠加轨。")
+            engine = _ENGINES[engine_choice] or ("libass" if ffexe else "overlay")
+            if engine == "libass" and not ffexe:
+                st.warning("⚠️ 未检测到带 libass 的 ffmpeg，将改用 PNG 叠加轨。")
+                engine = "overlay"
+            container = None
+            if engine == "mux":
+                container = _CONTAINERS[st.selectbox(
+                    "软字幕容器", list(_CONTAINERS),
+                    help="MP4 / MOV：mov_text 字幕轨，兼容性最好，但只保留文字（播放器用自己的字体样式）。\n"
+                         "MKV：ASS 字幕轨，保留设计的字体、颜色、描边与位置，字体随文件封装。\n"
+                         "SRT 文件夹若是 Step 1 的输出根目录（下有 English / Thai 等语言子文件夹），"
+                         "同名 SRT 会各成一条语言轨（请用「按文件名匹配」）。")]
+                st.info("📦 **软字幕模式**：视频与音频流直接复制，不重新编码，压缩质量 / 编码器设置不生效。")
+            prewrap = st.checkbox("按预览排版换行（所见即所得）", value=False,
+                                  disabled=not (engine == "libass" or container == ".mkv"),
+                                  help="每条字幕先用预览同一套排版换行、按行数上限缩字，再交给 libass 渲染，"
+                                       "换行、字号与位置与预览一致；关闭则由 libass / 播放器自行换行（旧行为，默认）。"
+                                       "对 libass 烧录与 MKV 软字幕生效；开启后已有输出会按新排版重新烧录一次。")
 
         st.divider()
         if st.button("🚀 开始批量添加字幕", type="primary", use_container_width=True):
@@ -652,29 +800,51 @@ def run():
 
             progress = st.progress(0, "准备开始...")
             log_container = st.container(height=300, border=True)
-            if ffexe:
-                eng = "GPU(NVENC)" if encoder == "h264_nvenc" else "CPU(libx264)"
-                log_container.info(f"⚡ ffmpeg + libass 烧录｜编码器 {eng}｜{concurrency} 并行"
-                                   f"｜共 {len(video_files)} 个，完成一个刷新一条")
-            else:
-                log_container.warning("未检测到带 libass 的 ffmpeg，回退到 moviepy（较慢）")
-
-            threads = max(1, (os.cpu_count() or 4) // concurrency)  # 限每任务线程，减少核心争抢
-            total, done = len(video_files), 0
-            with ThreadPoolExecutor(max_workers=concurrency) as ex:
-                futures = [ex.submit(_burn_one, i, vn, video_dir, srt_dir, output_dir, match_mode,
-                                     srt_files, style, crf, preset, ffexe, threads, encoder)
-                           for i, vn in enumerate(video_files)]
-                for fut in as_completed(futures):
-                    name, status, msg = fut.result()
-                    if status == "ok":
-                        log_container.success(f"✅ {name} {msg}")
-                    elif status == "skip":
-                        log_container.warning(f"⚠️ {name} {msg}，跳过。")
-                    else:
-                        log_container.error(f"❌ {name} {msg}")
-                    done += 1
-                    progress.progress(done / total, f"已完成 {done}/{total}")
-
-            st.balloons()
-            st.success("🎉 所有视频已处理完成！")
+            engine_label = next(k for k, v in _ENGINES.items() if v == engine)
+            log_container.info(f"⚡ 引擎 {engine_label}｜编码器 {spec.label}｜自适应并发（上限 {concurrency}）"
+                               f"｜共 {len(video_files)} 个，完成一个刷新一条")
+
+            manifest = Manifest(output_dir)
+            tracer = tracing.start_run("burn")
+            try:
+                # 先探测全部时长与分辨率：ETA 要覆盖排队中的任务，调度器按 时长×像素 排最长优先
+                infos = {vn: (probe(anyexe, Path(video_dir) / vn) if anyexe
+                              else {"duration": 0.0, "width": 0, "height": 0})
+                         for vn in video_files}
+                batch = BatchProgress({vn: info["duration"] for vn, info in infos.items()})
+                jobs = [BurnJob(vn, (info["duration"] or 0) * max(1, info["width"] * info["height"]),
+                                prefer_gpu=spec.hardware and engine != "mux", payload=i)
+                        for i, (vn, info) in enumerate(infos.items())]
+                # 自动模式下 GPU 会话满了可溢出到 CPU；用户明确选 GPU 时保持全部走 GPU
+                sched = AdaptiveScheduler(concurrency, spill_to_cpu=enc_choice in _ENCODER_POLICIES)
+
+                @tracing.bind   # 调度器线程池里的 span 记入本次运行
+                def work(job, enc, threads):
+                    return _burn_one(job.payload, job.key, video_dir, srt_dir, output_dir, match_mode, srt_files,
+                                     style, crf, preset, ffexe, threads, enc, manifest, batch, enc_choice, engine,
+                                     prewrap, container)
+
+                live = st.empty()   # 运行中任务的实时进度（主线程轮询刷新；工作线程不能直接调用 st.*）
+                total, done = len(video_files), 0
+                for job, result in sched.run(jobs, work, gpu_encoder=encoder if spec.hardware else None,
+                                             cpu_encoder="libx264" if spec.hardware else encoder):
+                    if job is not None:
+                        name, status, msg = result
+                        if status == "ok":
+                            log_container.success(f"✅ {name} {msg}")
+                        elif status == "skip":
+                            log_container.warning(f"⚠️ {name} {msg}，跳过。")
+                        else:
+                            log_container.error(f"❌ {name} {msg}")
+                        done += 1
+                        continue
+                    summ = batch.summary()
+                    progress.progress(min(1.0, max(done / total, summ["percent"])),
+                                      f"已完成 {done}/{total}｜整体 {summ['percent']:.0%}｜剩余约 {format_eta(summ['eta'])}")
+                    live.markdown("\n".join(_progress_line(k, j) for k, j in summ["running"]) or " ")
+                live.empty()
+
+                st.balloons()
+                st.success("🎉 所有视频已处理完成！")
+            finally:
+                show_trace(tracer)   # 出错或被停止时也结束追踪，不让它留在当前会话里继续累积
@@ -4,11 +4,23 @@ import time
 from pathlib import Path
 
 import config  # 必须先于 moviepy 导入：config 会清理无效的 IMAGEMAGICK_BINARY
+from ffmpeg_utils import BatchProgress, find_ffmpeg, format_eta, probe, run_ffmpeg
+from manifest import Manifest, signature
 from ui_utils import validate_dir
 
 from moviepy.editor import VideoFileClip
 
 
+def compress_with_ffmpeg(exe, in_path, out_path, crf, preset, duration=None, on_progress=None):
+    """ffmpeg 直接压缩（libx264 + aac），实时回报进度。失败抛 RuntimeError。"""
+    cmd = [exe, "-nostdin", "-loglevel", "error", "-y", "-i", str(in_path),
+           "-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p",
+           "-c:a", "aac", str(out_path)]
+    code, err = run_ffmpeg(cmd, duration, on_progress)
+    if code != 0:
+        raise RuntimeError(err[-500:] if err else "ffmpeg 失败")
+
+
 def batch_video_compress():
     with st.container(border=True):
         st.subheader("📁 路径设置")
@@ -29,7 +41,8 @@ def batch_video_compress():
         preset = st.selectbox("编码速度 (preset)", config.ENCODE_PRESETS,
                               index=config.ENCODE_PRESETS.index(config.DEFAULT_PRESET),
                               help="越靠后越慢、压缩率越高。medium 通常是速度与体积的良好平衡。")
-        overwrite = st.checkbox("覆盖已存在的输出文件", value=False)
+        overwrite = st.checkbox("强制重新压缩所有文件", value=False,
+                                help="默认只重做源视频或压缩参数有变化的文件；勾选则全部重新压缩。")
 
     st.divider()
 
@@ -45,28 +58,56 @@ def batch_video_compress():
         total = len(video_files)
         progress = st.progress(0, text="任务准备就绪...")
         log_container = st.container(height=400, border=True)
+        live = st.empty()
+        manifest = Manifest(output_dir)
+        exe = find_ffmpeg()
+        # 只探测真正要压缩的文件，且在各自的 try 里探测：未变化的文件不起 ffmpeg，单个文件探测失败不中断整批
+        batch = BatchProgress()
+
+        def show(snap, i, video_name):
+            batch.update(video_name, snap)
+            summ = batch.summary(pending=total - i - 1)
+            pct = f"{snap['percent']:.0%}" if snap["percent"] is not None else "--"
+            progress.progress(min(1.0, summ["percent"]),
+                              text=f"进度: {i + 1}/{total} | 整体 {summ['percent']:.0%} | 剩余约 {format_eta(summ['eta'])}")
+            live.caption(f"⏳ {video_name} {pct}｜{snap['fps']:.0f} fps｜{snap['speed']:.2f}x")
 
         for i, video_name in enumerate(video_files):
             in_path = os.path.join(input_dir, video_name)
             out_path = os.path.join(output_dir, video_name)
-            progress.progress((i + 1) / total, text=f"进度: {i + 1}/{total} | 正在压缩: {video_name}")
+            progress.progress(min(1.0, max(i / total, batch.summary(pending=total - i)["percent"])),
+                              text=f"进度: {i + 1}/{total} | 正在压缩: {video_name}")
 
-            if os.path.exists(out_path) and not overwrite:
-                log_container.info(f"➡️ {video_name} 已存在，跳过")
+            # 旧版本留下的输出（清单无记录）直接认领，避免升级后全部重压
+            sig = signature({"video": in_path}, {"crf": selected_crf, "preset": preset})
+            if not overwrite and manifest.is_fresh(video_name, sig, adopt=True):
+                log_container.info(f"➡️ {video_name} 未变化，跳过")
                 continue
 
             log_container.write(f"🎬 开始压缩: {video_name} (CRF={selected_crf})")
             try:
                 t0 = time.time()
-                with VideoFileClip(in_path) as clip:
-                    clip.write_videofile(
-                        out_path, codec="libx264", audio_codec="aac", preset=preset,
-                        ffmpeg_params=["-crf", str(selected_crf), "-pix_fmt", "yuv420p"],
-                        threads=4, logger=None
-                    )
+                batch.add(video_name, probe(exe, in_path)["duration"] if exe else 0.0)
+                batch.start(video_name)
+                if exe:
+                    compress_with_ffmpeg(exe, in_path, out_path, selected_crf, preset,
+                                         batch.jobs[video_name]["duration"],
+                                         lambda snap: show(snap, i, video_name))
+                else:
+                    with VideoFileClip(in_path) as clip:
+                        clip.write_videofile(
+                            out_path, codec="libx264", audio_codec="aac", preset=preset,
+                            ffmpeg_params=["-crf", str(selected_crf), "-pix_fmt", "yuv420p"],
+                            threads=4, logger=None
+                        )
+                batch.finish(video_name)
+                manifest.record(video_name, sig)
                 log_container.success(f"✅ 压缩完成: {video_name}（耗时 {time.time() - t0:.0f}s）")
             except Exception as e:
+                batch.finish(video_name, counted=False)
                 log_container.error(f"❌ 压缩 {video_name} 时出错: {e}")
+        live.empty()
+        progress.progress(1.0, text=f"已完成 {total}/{total}")
 
         st.balloons()
         st.success("🎉 所有视频压缩完成！")
@@ -0,0 +1,136 @@
+"""译文 SRT 的批量可读性检查：超宽 / 超行（触发自动缩字）/ 语速 / 时长 / 时间重叠。与 Streamlit 无关。
+
+- 时间类指标（CPS、时长、重叠）对整份文件用 NumPy 向量化计算；
+- 行数用与渲染器同一套排版测量（cue_scan.measure_cue）：先用缓存的单字宽度之和快速判定，
+  明显放得下的字幕不必换行排版，只有接近或超出宽度的才精确排版；相同文本只算一次；
+- 上千个文件时按 CPU 核数分批多进程检查；
+- 报告写成 CSV（Excel 可直接打开），被标记的字幕可在 Step 2 中勾选后定向重译。
+"""
+import csv
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+import config
+from cue_scan import measure_cue, read_cues
+from cue_style import styled
+from text_layout import get_measurer
+
+ISSUE_LABELS = {"overflow": "超宽", "lines": "超行", "shrink": "缩字", "cps": "语速过快",
+                "short": "时长过短", "overlap": "时间重叠"}
+REPORT_FIELDS = ("file", "index", "start", "end", "duration", "cps", "lines", "font_size", "issues", "text")
+_QUICK_MARGIN = 0.9        # 单字宽度之和低于最大宽度的这个比例时直接判为放得下（为字距修正留余量）
+PARALLEL_MIN_FILES = 100   # 每个进程至少分到这么多文件才值得多进程（spawn 启动约需 1 秒）
+
+
+def line_issues(text, style, max_lines):
+    """按样式排版一条字幕，返回 (行数, 实际字号, 问题代码元组)。结果按文本与排版参数缓存，
+    整季里重复的台词（「好的」「谢谢」）只排一次。内联样式标注先去掉，字号覆盖项按该条的实际字号排版。"""
+    text, style = styled(text, style)
+    return _line_issues(text, style["font_path"], style["font_size"], style["max_text_width"],
+                        style.get("max_lines", 0), max_lines)
+
+
+@lru_cache(maxsize=65536)
+def _line_issues(text, font_path, font_size, max_width, style_max_lines, max_lines):
+    m = get_measurer(font_path, font_size)
+    paragraphs = text.split("\n")
+    limit = max_width * _QUICK_MARGIN
+    if len(paragraphs) <= max_lines and all(sum(m.width(ch) for ch in p) <= limit for p in paragraphs):
+        return len(paragraphs), font_size, ()
+    metrics = measure_cue(text, {"font_path": font_path, "font_size": font_size, "max_text_width": max_width,
+                                 "max_lines": style_max_lines})
+    issues = tuple(code for code, hit in (("overflow", metrics["too_wide"]), ("shrink", metrics["shrunk"]),
+                                          ("lines", metrics["lines"] > max_lines)) if hit)
+    return metrics["lines"], metrics["font_size"], issues
+
+
+def lint_cues(cues, style=None, max_cps=None, min_duration=None):
+    """检查一份字幕（cue_scan.read_cues 的结果）。style 为 None 时跳过排版类检查。
+    返回被标记的字幕 [dict(REPORT_FIELDS 中除 file 外的字段)]，issues 为问题代码列表。"""
+    if not cues:
+        return []
+    max_cps = config.LINT_MAX_CPS if max_cps is None else max_cps
+    min_duration = config.LINT_MIN_DURATION if min_duration is None else min_duration
+    index, starts, ends, texts = zip(*cues)
+    starts, ends = np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)
+    duration = ends - starts
+    chars = np.fromiter((len("".join(t.split())) for t in texts), dtype=float, count=len(texts))
+    cps = chars / np.maximum(duration, 1e-3)
+    overlap = np.zeros(len(cues), dtype=bool)
+    overlap[1:] = starts[1:] < np.maximum.accumulate(ends)[:-1] - 1e-3   # 与之前任一条重叠
+    flags = {"cps": cps > max_cps, "short": duration < min_duration, "overlap": overlap}
+    if style is not None:
+        max_lines = style.get("max_lines") or config.LINT_MAX_LINES
+        layout = [line_issues(text, style, max_lines) for text in texts]
+        for code in ("overflow", "lines", "shrink"):
+            flags[code] = np.fromiter((code in item[2] for item in layout), dtype=bool, count=len(texts))
+    else:
+        layout = [(text.count("\n") + 1, None, ()) for text in texts]
+
+    rows = []
+    for k in np.flatnonzero(np.logical_or.reduce(list(flags.values()))):
+        lines, font_size, _ = layout[k]
+        rows.append({"index": index[k], "start": round(starts[k], 3), "end": round(ends[k], 3),
+                     "duration": round(float(duration[k]), 3), "cps": round(float(cps[k]), 1),
+                     "lines": lines, "font_size": font_size, "text": texts[k],
+                     "issues": [code for code in ISSUE_LABELS if code in flags and flags[code][k]]})
+    return rows
+
+
+def _lint_batch(paths, style, max_cps, min_duration):
+    rows, total, errors = [], 0, []
+    for path in paths:
+        path = Path(path)
+        try:
+            cues = read_cues(path)
+        except Exception as e:
+            errors.append((path.name, str(e)))
+            continue
+        total += len(cues)
+        rows += [dict(row, file=path.name) for row in lint_cues(cues, style, max_cps, min_duration)]
+    return rows, total, errors
+
+
+def lint_paths(paths, style=None, max_cps=None, min_duration=None, workers=None):
+    """检查多个 SRT。返回 (被标记字幕 [dict，含 file], 检查的字幕总数, 读取失败 [(文件名, 错误)])。
+    文件很多时按 CPU 核数分批多进程检查（结果顺序与 paths 一致）。"""
+    paths = [str(p) for p in paths]
+    workers = min(workers or os.cpu_count() or 1, math.ceil(len(paths) / PARALLEL_MIN_FILES))
+    if workers <= 1:
+        return _lint_batch(paths, style, max_cps, min_duration)
+    per = math.ceil(len(paths) / workers)
+    batches = [paths[i:i + per] for i in range(0, len(paths), per)]
+    rows, total, errors = [], 0, []
+    with ProcessPoolExecutor(max_workers=len(batches), mp_context=get_context("spawn")) as pool:
+        for r, t, e in pool.map(_lint_batch, batches, *([x] * len(batches) for x in (style, max_cps, min_duration))):
+            rows += r
+            total += t
+            errors += e
+    return rows, total, errors
+
+
+def write_report(rows, path):
+    """写 CSV 报告（UTF-8 BOM，Excel 直接打开不乱码）。issues 写成中文标签，以「、」分隔。"""
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(row, issues="、".join(ISSUE_LABELS[c] for c in row["issues"])))
+
+
+def read_report(path):
+    """读回报告，返回 {文件名: [(序号, 问题标签, 文本)]}，供定向重译勾选。报告不存在返回 {}。"""
+    flagged = {}
+    try:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                flagged.setdefault(row["file"], []).append((int(row["index"]), row["issues"], row["text"]))
+    except (OSError, KeyError, ValueError):
+        return {}
+    return flagged
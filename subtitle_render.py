@@ -0,0 +1,152 @@
+"""字幕位图渲染（PIL）与带分层缓存的实时预览。与 Streamlit 无关。
+
+预览、PNG 叠加轨与逐帧合成都用 render_block，保证所见即所得。
+
+分层缓存（设计器里每拖一次滑块都会重绘）：
+1. 字幕块：按 (文本, 影响字形的样式字段) 缓存渲染好的 RGBA 小图——只改「距底部距离」
+   等位置参数时不再重新换行、重画阴影 / 描边 / 文字；
+2. 合成图：PreviewCompositor 按 (字幕块, 粘贴坐标) 缓存最终画面，底图只转一次 RGBA；
+3. 可选缩小预览：4K 源先把底图缩到预览宽度，字幕块按同比例缩放后再贴，合成与传输都更轻。
+"""
+import math
+from collections import OrderedDict
+from functools import lru_cache
+
+from PIL import Image, ImageDraw
+
+from text_layout import _get_font, fit_text
+
+# 影响字幕块像素内容的样式字段（位置类字段如 bottom_offset 不在其中）
+GLYPH_FIELDS = ("font_path", "font_size", "max_text_width", "max_lines", "bold", "stroke_width", "stroke_color",
+                "font_color", "line_spacing", "shadow_opacity", "shadow_color", "shadow_offset",
+                "bg_enabled", "bg_color", "bg_opacity", "bg_padding", "bg_radius", "italic")
+ITALIC_SHEAR = 0.21   # 伪斜体倾斜系数，与 libass 对无斜体字形的字体做的合成倾斜一致
+
+
+def _hex_to_rgb(hex_color):
+    h = hex_color.lstrip("#")
+    return tuple(int(h[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def glyph_key(style):
+    """样式里影响字形的部分，作为缓存键（shadow_offset 从 JSON 读回是 list，统一成 tuple）。"""
+    return tuple(tuple(v) if isinstance(v, list) else v for v in (style.get(k) for k in GLYPH_FIELDS))
+
+
+_SCRATCH = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+
+
+@lru_cache(maxsize=512)
+def _render_glyphs(text, key):
+    """渲染字幕块本体，返回 (img, ty, inset)。ty 为文字绘制基点在块内的纵坐标，
+    inset 为文字区域距块左 / 右边缘的 (左, 右) 距离，定位时要用。结果在多处共享，调用方不得就地修改返回的图像。"""
+    style = {k: v for k, v in zip(GLYPH_FIELDS, key) if v is not None}
+    wrapped, fs = fit_text(text, style["font_path"], style["font_size"], style["max_text_width"],
+                           style.get("max_lines", 0))
+    font = _get_font(style["font_path"], fs)
+    bold = style.get("bold", 0)
+    outline = style.get("stroke_width", 0)
+    spacing = style.get("line_spacing", max(2, int(fs * 0.2)))
+    total = outline + bold
+    sx, sy = style.get("shadow_offset", (0, 2)) if style.get("shadow_opacity", 0) > 0 else (0, 0)
+    common = dict(font=font, anchor="la", align="center", spacing=spacing)
+
+    l, t, r, b = _SCRATCH.multiline_textbbox((0, 0), wrapped, stroke_width=total, **common)
+    # 某些 Pillow 版本 textbbox 返回 float；取整避免 Image.new/坐标报 'float' object cannot be interpreted as an integer
+    l, t, r, b = math.floor(l), math.floor(t), math.ceil(r), math.ceil(b)
+    pad = style.get("bg_padding", 12) if style.get("bg_enabled") else max(2, total)
+    bw = (r - l) + 2 * pad + abs(sx)
+    bh = (b - t) + 2 * pad + abs(sy)
+    block = Image.new("RGBA", (bw, bh), (0, 0, 0, 0))
+    d = ImageDraw.Draw(block)
+    tx = pad - l + max(0, -sx)   # 文字绘制基点，使内容含 pad 并为阴影方向留白
+    ty = pad - t + max(0, -sy)
+
+    if style.get("bg_enabled"):
+        bg = _hex_to_rgb(style.get("bg_color", "#000000")) + (int(255 * style.get("bg_opacity", 0.5)),)
+        d.rounded_rectangle([tx + l - pad, ty + t - pad, tx + r + pad, ty + b + pad],
+                            radius=style.get("bg_radius", 10), fill=bg)
+    if style.get("shadow_opacity", 0) > 0:
+        sh = _hex_to_rgb(style["shadow_color"]) + (int(255 * style["shadow_opacity"]),)
+        d.multiline_text((tx + sx, ty + sy), wrapped, fill=sh, stroke_width=bold, **common)
+    if outline > 0:
+        edge = _hex_to_rgb(style["stroke_color"]) + (255,)
+        d.multiline_text((tx, ty), wrapped, fill=edge, stroke_width=outline + bold, stroke_fill=edge, **common)
+    fill = _hex_to_rgb(style["font_color"]) + (255,)
+    d.multiline_text((tx, ty), wrapped, fill=fill, stroke_width=bold, stroke_fill=fill, **common)
+    inset = (tx + l, bw - (tx + r))
+    if style.get("italic"):
+        # 以底边为基准向右倾斜：输出 (x, y) 取自输入 (x - k·(h - y), y)
+        k, h = ITALIC_SHEAR, block.height
+        block = block.transform((block.width + math.ceil(k * h), h), Image.AFFINE, (1, k, -k * h, 0, 1, 0),
+                                resample=Image.BICUBIC)
+    return block, ty, inset
+
+
+def render_block(frame_size, text, style):
+    """把单条字幕渲染成一张【紧凑】RGBA 小图（背景条+阴影+描边+伪加粗+文字），
+    返回 (img, x, y) 左上角粘贴坐标。预览与烧录共用，保证所见即所得。
+    用小图而非整帧图层：合成成本随文字块大小而非画面分辨率，烧录才不会慢。
+    字幕块按 (文本, 字形样式) 缓存，返回的图像为共享对象，请勿就地修改。
+    style["align"]（小键盘方位，默认 2）决定位置：底行文字顶部在 H-bottom_offset，
+    顶行文字顶部在 bottom_offset（上下对称），中行垂直居中；左右列贴齐最大宽度区域的边缘。"""
+    W, H = frame_size
+    block, ty, (left, right) = _render_glyphs(text, glyph_key(style))
+    align = style.get("align") or 2
+    side = max(0, (W - style["max_text_width"]) // 2)
+    col = (align - 1) % 3
+    x = side - left if col == 0 else W - side - block.width + right if col == 2 else (W - block.width) // 2
+    if align >= 7:
+        y = style["bottom_offset"] - ty
+    elif align >= 4:
+        y = (H - block.height) // 2
+    else:
+        y = H - style["bottom_offset"] - ty   # 保持"文字顶部≈H-bottom_offset"的旧定位
+    return block, x, y
+
+
+def render_preview_pil(frame_img, text, style):
+    """实时预览：把紧凑字幕块贴到缓存帧上。"""
+    base = frame_img.convert("RGBA")
+    block, x, y = render_block(base.size, text, style)
+    base.alpha_composite(block, (max(0, x), max(0, y)))
+    return base.convert("RGB")
+
+
+class PreviewCompositor:
+    """一张预览底图的合成缓存。底图只转换一次 RGBA（以及可选的缩小版），
+    合成结果按 (字形键, 文本, 坐标) 缓存，拖动滑块回到旧值时直接命中。
+
+    max_width：预览最大宽度（像素）；底图更宽时整体缩小预览，None 表示原尺寸。"""
+
+    def __init__(self, frame_img, max_width=None, cache_size=32):
+        self.size = frame_img.size                       # 原始尺寸：排版 / 定位始终按原分辨率
+        self.scale = min(1.0, max_width / frame_img.width) if max_width else 1.0
+        base = frame_img.convert("RGBA")
+        if self.scale < 1.0:
+            base = base.resize((round(frame_img.width * self.scale), round(frame_img.height * self.scale)),
+                               Image.LANCZOS)
+        self.base = base
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+    def render(self, text, style):
+        """返回 RGB 预览图（缩小模式下为缩小后的尺寸）。"""
+        block, x, y = render_block(self.size, text, style)
+        key = (glyph_key(style), text, x, y)
+        hit = self._cache.get(key)
+        if hit is not None:
+            self._cache.move_to_end(key)
+            return hit
+        out = self.base.copy()
+        if self.scale < 1.0:
+            small = block.resize((max(1, round(block.width * self.scale)), max(1, round(block.height * self.scale))),
+                                 Image.LANCZOS)
+            out.alpha_composite(small, (max(0, round(x * self.scale)), max(0, round(y * self.scale))))
+        else:
+            out.alpha_composite(block, (max(0, x), max(0, y)))
+        out = out.convert("RGB")
+        self._cache[key] = out
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return out
@@ -4,13 +4,24 @@
     python tests/test_core.py        # 无需 pytest，直接运行
     pytest tests/                    # 装了 pytest 也可
 """
+import json
 import os
 import sys
 
 # 让测试能从仓库根目录导入各模块
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import tempfile
+from pathlib import Path
+
 import config
+import ffmpeg_utils as F
+import manifest as M
+import pil_burn as P
+import scheduler as S
+import subtitle_lint as SL
+import subtitle_render as R
+import text_layout as L
 import translator as T
 from step1 import _natural_sort_key
 import step3
@@ -40,13 +51,14 @@ SRT = "\n\n".join(
 
 
 def test_chunking():
-    assert T._parse_srt(SRT) is not None
+    cues = T._parse_srt(SRT)
+    assert cues is not None
     saved = config.CHUNK_CUES
     try:
         config.CHUNK_CUES = 2
-        assert len(T._chunk_srt(SRT)) == 3  # 5 条字幕，每块 2 条 -> 3 块
+        assert [len(c) for c in T._chunk_cues(cues)] == [2, 2, 1]  # 5 条字幕，每块 2 条 -> 3 块
         config.CHUNK_CUES = 100
-        assert len(T._chunk_srt(SRT)) == 1  # 不超阈值则单块
+        assert len(T._chunk_cues(cues)) == 1  # 不超阈值则单块
     finally:
         config.CHUNK_CUES = saved
 
@@ -77,6 +89,614 @@ def test_wrap_cjk_and_kinsoku():
     assert all(not step3._is_combining_mark(ln[0]) for ln in lines if ln)
 
 
+def test_fit_text_binary_search_matches_linear():
+    if not step3.default_font_path:
+        return
+    fp = step3.default_font_path
+    text = "alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu xi omicron pi rho"
+    for size, max_lines in ((64, 1), (64, 2), (48, 3), (13, 1)):
+        fs = size   # 旧实现：每次减 2 直到满足行数或到达最小字号
+        while True:
+            wrapped = L.wrap_text_pil(text, fp, fs, 400)
+            if wrapped.count("\n") + 1 <= max_lines or fs <= L.MIN_FIT_SIZE:
+                break
+            fs -= 2
+        assert L.fit_text(text, fp, size, 400, max_lines) == (wrapped, fs)
+
+
+def test_measurer_incremental_width():
+    if not step3.default_font_path:
+        return
+    m = L.get_measurer(step3.default_font_path, 40)
+    line, w = "AV", m.width("AV")
+    for atom in (" ", "To", "Wa", " ", "yes."):
+        _, est = m.fits(line, w, atom, 10_000)
+        line, w = line + atom, est
+        assert abs(w - m.width(line)) < 0.5   # 原子宽 + 字距修正累加 ≈ 整串精确宽度
+    assert abs(m.line_width(line) - m.width(line)) < 0.5
+    assert L._atoms("Hi  there.") == ["Hi", " ", " ", "there."]   # ASCII 快速切分与逐字符切分一致
+
+
+class _ContextFont:
+    """模拟 raqm 上下文字形：字宽随前后字符变化（连写的中间形更宽），字距对修正无法覆盖。"""
+    layout_engine = L.ImageFont.Layout.RAQM
+
+    def getlength(self, s):
+        w = 0.0
+        for k, ch in enumerate(s):
+            w += 6 + ord(ch) % 7
+            if ch != " ":
+                w += 3 * (0 < k < len(s) - 1 and s[k - 1] != " " and s[k + 1] != " ")
+        return w
+
+
+def test_wrap_raqm_matches_exact_greedy():
+    from benchmarks import bench_render as BR
+    font = _ContextFont()
+    m = L.TextMeasurer(font)
+
+    def exact(atoms, max_width):   # 旧实现：每个原子都整串精确测量
+        lines, current = [], ""
+        for atom in atoms:
+            if atom == " " and not current:
+                continue
+            if not current or font.getlength(current + atom) <= max_width:
+                current += atom
+            else:
+                lines.append(current.rstrip())
+                current = "" if atom == " " else atom
+        if current.strip():
+            lines.append(current.rstrip())
+        return lines
+
+    for script in ("cjk", "thai", "arabic", "latin"):
+        for text in BR.corpus(script, 40):
+            atoms = L._atoms(text)
+            for max_width in (60, 150, 400):
+                assert L._wrap_atoms(m, atoms, max_width) == exact(atoms, max_width), (script, text, max_width)
+
+def test_preview_layered_cache():
+    if not step3.default_font_path:
+        return
+    from PIL import Image
+    style = {"font_path": step3.default_font_path, "font_size": 40, "font_color": "#FFFFFF",
+             "stroke_color": "#000000", "stroke_width": 2, "bold": 1, "bottom_offset": 80,
+             "max_text_width": 600, "shadow_opacity": 0.0, "bg_enabled": False}
+    b1, x1, y1 = R.render_block((1280, 720), "Hello", style)
+    b2, x2, y2 = R.render_block((1280, 720), "Hello", dict(style, bottom_offset=120))
+    assert b1 is b2 and x1 == x2 and y2 == y1 - 40             # 只改位置：复用同一字幕块
+    assert R.render_block((1280, 720), "Hello", dict(style, font_color="#FFE000"))[0] is not b1
+    comp = R.PreviewCompositor(Image.new("RGB", (2560, 1440)), max_width=1280)
+    img = comp.render("Hello", style)
+    assert img.size == (1280, 720) and img.mode == "RGB"
+    assert comp.render("Hello", style) is img                  # 同位置命中合成缓存
+
+
+def test_cue_scan_ranks_worst_cues():
+    if not step3.default_font_path:
+        return
+    import cue_scan as C
+    style = {"font_path": step3.default_font_path, "font_size": 40, "stroke_width": 2, "bold": 1,
+             "max_text_width": 400, "max_lines": 2}
+    srt = ("1\n00:00:01,000 --> 00:00:02,000\nHi\n\n"
+           "2\n00:00:03,000 --> 00:00:05,000\n" + "word " * 14 + "\n\n"
+           "3\n00:00:06,000 --> 00:00:07,000\nSupercalifragilisticexpialidocious!!\n\n"
+           "4\n00:00:08,000 --> 00:00:09,000\nA somewhat longer line of text\n")
+    with tempfile.TemporaryDirectory() as d:
+        path = Path(d) / "e01.srt"
+        path.write_text(srt, encoding="utf-8")
+        cues = C.read_cues(path)
+        assert [c[0] for c in cues] == [1, 2, 3, 4] and cues[1][1:3] == (3.0, 5.0)
+        ranked = C.rank_cues(cues, style, top=3)
+        assert [c[0] for c, _ in ranked] == [3, 2, 4]          # 超宽 > 缩字 > 普通
+        assert ranked[0][1]["too_wide"] and ranked[1][1]["shrunk"] and ranked[1][1]["lines"] <= 2
+        top, errors = C.scan_paths([path, Path(d) / "missing.srt"], style, top=1)
+        assert top[0][1][0] == 3 and len(errors) == 1
+
+
+def test_subtitle_lint_flags_and_report():
+    cues = [(1, 0.0, 2.0, "Hello there"),
+            (2, 2.0, 2.5, "Short"),                                   # 时长过短
+            (3, 2.4, 4.0, "This line is spoken way too quickly!!"),   # 与上一条重叠 + 语速过快
+            (4, 5.0, 9.0, ("word " * 40).strip())]
+    rows = SL.lint_cues(cues, None, max_cps=15, min_duration=0.8)
+    issues = {r["index"]: r["issues"] for r in rows}
+    assert 1 not in issues and issues[2] == ["short"] and issues[3] == ["cps", "overlap"]
+    if step3.default_font_path:
+        style = {"font_path": step3.default_font_path, "font_size": 40, "max_text_width": 600, "max_lines": 2}
+        issues = {r["index"]: r["issues"] for r in SL.lint_cues(cues, style, max_cps=15, min_duration=0.8)}
+        assert issues[4][:2] == ["lines", "shrink"] and 1 not in issues   # 缩到最小字号仍超 2 行
+        assert SL.line_issues("Hi", style, 2) == (1, 40, ())
+    with tempfile.TemporaryDirectory() as d:
+        report = Path(d) / "r.csv"
+        SL.write_report([dict(r, file="e01.srt") for r in rows], report)
+        assert [i for i, _, _ in SL.read_report(report)["e01.srt"]] == [2, 3, 4]
+        assert SL.read_report(Path(d) / "missing.csv") == {}
+
+
+def test_retranslate_only_flagged_cues():
+    from types import SimpleNamespace
+    sent = []
+
+    def create(model, messages, **kw):
+        sent.append(messages[1]["content"])
+        body = messages[1]["content"].split("\n", 1)[1].replace("Line", "Short")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=body))], usage=None)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    out, _, replaced = T.retranslate_cues(client, SRT, [2, 4], "English", "gpt-5.4-mini", {}, "- be brief")
+    texts = [c.text for c in T._parse_srt(out)]
+    assert replaced == 2 and texts == ["Line 1", "Short 2", "Line 3", "Short 4", "Line 5"]
+    assert "Line 1" not in sent[0] and "Line 2" in sent[0]      # 只发送被选中的字幕
+
+
+def test_mock_openai_server_drives_translate_with_retries():
+    from openai import OpenAI
+    from benchmarks.bench_translate import synth_episode
+    from benchmarks.mock_openai import MockOpenAI
+    delay, chunk = config.RETRY_BASE_DELAY, config.CHUNK_CUES
+    config.RETRY_BASE_DELAY, config.CHUNK_CUES = 0.001, 10
+    try:
+        with MockOpenAI(error_rate=0.3, malformed_rate=0.2, seed=3) as server:
+            client = OpenAI(base_url=server.base_url, api_key="mock", max_retries=0)   # 只走 translator 自己的重试
+            out, cost = T.translate_srt(client, synth_episode(30), "Thai", "gpt-5.4-mini", {})
+            stats = dict(server.stats)
+    finally:
+        config.RETRY_BASE_DELAY, config.CHUNK_CUES = delay, chunk
+    subs = T._parse_srt(out)
+    assert len(subs) == 30 and all(c.text.startswith("[Thai] ") for c in subs)
+    assert stats["rate_limited"] and stats["malformed"] and stats["ok"] == 3     # 3 块，各自重试到成功
+    assert stats["requests"] == stats["ok"] + stats["rate_limited"] + stats["malformed"] and cost > 0
+
+
+def test_tracing_spans_summary_and_exports():
+    import threading
+    import tracing
+    from openai import OpenAI
+    from benchmarks.bench_translate import synth_episode
+    from benchmarks.mock_openai import MockOpenAI
+    with tracing.span("noop") as sp:   # 没有激活的追踪：什么也不记
+        sp.set(x=1)
+    tracer = tracing.start_run("test")
+    delay, chunk = config.RETRY_BASE_DELAY, config.CHUNK_CUES
+    config.RETRY_BASE_DELAY, config.CHUNK_CUES = 0.001, 10
+    try:
+        with MockOpenAI(error_rate=0.3, seed=3) as server:
+            client = OpenAI(base_url=server.base_url, api_key="mock", max_retries=0)
+            with tracing.span("episode", lang="Thai"):
+                T.translate_srt(client, synth_episode(30), "Thai", "gpt-5.4-mini", {})
+            worker = threading.Thread(target=tracing.bind(
+                lambda: T.update_memory(client, "1\n00:00:01,000 --> 00:00:02,000\nhi\n", {}, "gpt-5.4-nano")))
+            worker.start()
+            worker.join()
+
+            def stray_work():
+                with tracing.span("stray"):
+                    pass
+            stray = threading.Thread(target=stray_work)   # 未 bind 的线程不记入
+            stray.start()
+            stray.join()
+        try:
+            with tracing.span("encode", encoder="libx264"):
+                raise RuntimeError("boom")
+        except RuntimeError:
+            pass
+    finally:
+        config.RETRY_BASE_DELAY, config.CHUNK_CUES = delay, chunk
+    with tempfile.TemporaryDirectory() as d:
+        paths = tracing.finish_run(tracer, d)
+        assert tracing.current() is None
+        rows = {r["stage"]: r for r in json.loads(paths["summary"].read_text(encoding="utf-8"))["stages"]}
+        assert {"episode", "translate_chunk", "chat", "retry_sleep", "parse", "memory_update", "encode"} <= set(rows)
+        assert rows["chat"]["count"] > 3 and rows["retry_sleep"]["count"] == rows["chat"]["count"] - 4
+        ep = rows["episode"]
+        assert ep["self_s"] < ep["total_s"] and abs(sum(r["share"] for r in rows.values()) - 1) < 1e-3
+        events = json.loads(paths["trace"].read_text(encoding="utf-8"))["traceEvents"]
+        spans = [e for e in events if e["ph"] == "X"]
+        assert len({e["tid"] for e in spans}) == 2                       # 主线程 + 记忆更新线程
+        assert any(e["name"] == "chat" and e["args"].get("prompt_tokens") for e in spans)
+        assert any(e["name"] == "encode" and e["args"]["error"] == "RuntimeError" for e in spans)
+        prom = paths["prom"].read_text(encoding="utf-8")
+        # chat 继承外层 episode 的 lang 标签；token 按 prompt / completion 分开计数
+        assert 'lantrans_stage_seconds_count{run="test",stage="chat",lang="Thai",model="gpt-5.4-mini"}' in prom
+        assert 'lantrans_tokens_total{run="test",stage="chat",lang="Thai",model="gpt-5.4-mini",kind="completion"}' in prom
+        assert "| chat |" in tracing.format_summary(tracer)
+        assert "stray" not in rows
+
+
+def test_tracing_runs_are_scoped_per_thread():
+    import threading
+    import tracing
+    seen = {}
+
+    def session(name):
+        tracer = tracing.start_run(name)
+        try:
+            with tracing.span(f"{name}_work"):
+                barrier.wait()
+            seen[name] = tracer
+        finally:
+            tracing.finish_run(tracer, out_dir)
+        seen[f"{name}_after"] = tracing.current()
+
+    barrier = threading.Barrier(2)
+    with tempfile.TemporaryDirectory() as out_dir:
+        threads = [threading.Thread(target=session, args=(n,)) for n in ("translate", "burn")]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert [sp.name for sp in seen["translate"].spans] == ["translate_work"]   # 两个会话同时运行互不混入
+    assert [sp.name for sp in seen["burn"].spans] == ["burn_work"]
+    assert seen["translate_after"] is None and seen["burn_after"] is None and tracing.current() is None
+
+
+def _fake_client(prompts, lang="X"):
+    """桩客户端：记录每次请求的 user 内容，按 [语言] 前缀“翻译”；记忆更新请求原样返回空 JSON。"""
+    from types import SimpleNamespace
+    from benchmarks.mock_openai import fake_translate
+
+    def create(model, messages, **kw):
+        user = messages[1]["content"]
+        prompts.append(user)
+        out = fake_translate(user.split("Translate the following subtitles:\n", 1)[1], lang) \
+            if "Translate the following subtitles:" in user else "{}"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=out))], usage=None)
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def test_segment_store_exact_fuzzy_and_reuse():
+    from segment_store import SegmentStore, normalize
+    assert normalize("{\\an8}<i>Ｈｅｌｌｏ,   World！</i>") == "hello, world!"
+    prompts = []
+    client = _fake_client(prompts)
+
+    ep1 = "1\n00:00:01,000 --> 00:00:02,000\n上集回顾\n\n2\n00:00:03,000 --> 00:00:04,000\n明天董事会之前必须把合同签了\n"
+    ep2 = ("1\n00:00:05,000 --> 00:00:06,000\n上集回顾\n\n"
+           "2\n00:00:07,000 --> 00:00:08,000\n明天董事会之前必须把合同签好\n\n"
+           "3\n00:00:09,000 --> 00:00:10,000\n妈\n")
+    with tempfile.TemporaryDirectory() as d:
+        store = SegmentStore(Path(d) / "seg.json")
+        out1, _ = T.translate_srt(client, ep1, "X", "m", {}, store=store)
+        assert store.learn(ep1, out1) == 2 and store.lookup("上集回顾") == "[X] 上集回顾"
+        store.save()
+        store = SegmentStore(Path(d) / "seg.json")                      # 重新加载
+        assert [s for s, _, _ in store.near("明天董事会之前必须把合同签好")][0] > 0.6
+        out2, _ = T.translate_srt(client, ep2, "X", "m", {}, store=store)
+        sent = prompts[-1]
+        assert "上集回顾" not in sent.split("Translate the following subtitles:")[1]   # 精确命中不送模型
+        assert "明天董事会之前必须把合同签了 => [X] 明天董事会之前必须把合同签了" in sent   # 近似命中作参考
+        subs = T._parse_srt(out2)
+        assert [c.index for c in subs] == [1, 2, 3] and subs[0].text == "[X] 上集回顾" and subs[2].text == "[X] 妈"
+        assert store.stats() == {"hits": 1, "hinted": 1, "misses": 1}
+        n = len(prompts)
+        store.learn(ep2, out2)
+        T.translate_srt(client, ep2, "X", "m", {}, store=store)          # 全部命中：不发请求
+        assert len(prompts) == n
+        small = SegmentStore(max_items=2)
+        for k in range(3):
+            small.add(f"明天董事会之前必须把合同签了{k}", f"line {k}")
+        assert len(small) == 2 and small.lookup("明天董事会之前必须把合同签了0") is None   # 最早学到的被淘汰
+        assert [t for _, _, t in small.near("明天董事会之前必须把合同签了0")] == ["line 2", "line 1"]
+        fixed = out2.replace("[X] 妈", "Mom")                              # Step 2 重译改正了一条
+        assert store.correct(out2, fixed) == 1 and store.lookup("妈") == "Mom"
+        assert store.lookup("上集回顾") == "[X] 上集回顾"
+
+        # Step 1 与 Step 2 各持一个实例：Step 1 之后的保存不会盖掉 Step 2 已写回的改正
+        store.save()
+        step2 = SegmentStore(Path(d) / "seg.json")
+        assert step2.correct(out1, out1.replace("[X] 上集回顾", "Previously")) == 1
+        step2.save()
+        store.learn(ep1, out1)                                           # 原样重学旧译文不算改动
+        store.add("新台词", "new line")
+        store.save()
+        assert store.lookup("上集回顾") == "Previously"                   # 保存时同步了别处的改正
+        merged = SegmentStore(Path(d) / "seg.json")
+        assert merged.lookup("上集回顾") == "Previously" and merged.lookup("新台词") == "new line"
+
+
+def test_cue_align_repairs_only_unaligned_cues():
+    from types import SimpleNamespace
+    from cue_align import align
+    from srt_cues import Cue, format_srt, parse_srt
+    source = parse_srt(SRT)                                           # Line 1..5，第 i 条 i 秒到 i+1 秒
+    bad = [Cue(1, 1040, 2000, "A1"),                                  # 时间戳抄错
+           Cue(3, 3000, 5000, "A3+A4"),                               # 合并 3、4；漏掉 2
+           Cue(5, 5000, 5500, "A5a"), Cue(6, 5500, 6000, "A5b")]      # 拆分
+    a = align(source, bad)
+    assert a.texts == {0: "A1", 4: "A5a\nA5b"} and a.unaligned == [1, 2, 3]
+    assert a.counts() == {"drifted": 1, "split": 1, "merged": 2, "missing": 1}
+    assert align(source, source).unaligned == [] and align(source, []).missing == [0, 1, 2, 3, 4]
+
+    sent, repair = [], [True]
+
+    def create(model, messages, **kw):
+        asked = parse_srt(messages[1]["content"].split("subtitles:\n", 1)[1])
+        sent.append([c.index for c in asked])
+        out = bad if len(sent) == 1 or not repair[0] else [Cue(c.index, c.start, c.end, c.text.replace("Line", "B")) for c in asked]
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=format_srt(out)))], usage=None)
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    out, _ = T.translate_srt(client, SRT, "X", "m", {})
+    assert sent == [[1, 2, 3, 4, 5], [2, 3, 4]]                      # 只补译对不齐的字幕
+    subs = T._parse_srt(out)
+    assert [c.text for c in subs] == ["A1", "B 2", "B 3", "B 4", "A5a\nA5b"] and subs[0].start == 1000
+    sent.clear()
+    repair[0] = False                                                 # 补译也对不齐：几轮之后报错
+    try:
+        T.translate_srt(client, SRT, "X", "gpt-5.4-mini", {})
+        assert False
+    except T.AlignmentError as e:
+        assert len(sent) == 1 + config.ALIGN_REPAIR_ROUNDS
+        assert e.cost > 0                                             # 放弃前各轮请求的费用随异常带回
+
+    def flaky(model, messages, **kw):                                # 第二块请求失败（如重试用尽的 API 错误）
+        sent.append(1)
+        if len(sent) == 2:
+            raise RuntimeError("upstream down")
+        asked = parse_srt(messages[1]["content"].split("subtitles:\n", 1)[1])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=format_srt(asked)))],
+                               usage=SimpleNamespace(prompt_tokens=1000, completion_tokens=500))
+    client.chat.completions.create = flaky
+    sent.clear()
+    chunk, config.CHUNK_CUES = config.CHUNK_CUES, 2
+    try:
+        T.translate_srt(client, SRT, "X", "gpt-5.4-mini", {})
+        assert False
+    except RuntimeError as e:
+        assert e.cost == config.estimate_cost(1000, 500, "gpt-5.4-mini")   # 第一块的费用不丢
+    finally:
+        config.CHUNK_CUES = chunk
+
+
+def test_latency_deadlines_and_hedged_requests():
+    import threading
+    import time
+    import latency
+    from types import SimpleNamespace
+    saved = config.HEDGE_MIN_DELAY, config.HEDGE_MIN_SAMPLES
+    config.HEDGE_MIN_DELAY, config.HEDGE_MIN_SAMPLES = 0.05, 20
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            stats = latency.LatencyStats(Path(d) / "lat.json")
+            assert stats.hedge_delay("m", 100) is None                       # 样本不足：不对冲
+            for k in range(20):
+                stats.record("m", 0.01 * (k + 1), 100)                       # 0.1 ~ 2 ms/token
+            p = stats.percentiles("m")
+            assert p["n"] == 20 and p["p50"] < p["p95"] <= 0.002 + 1e-9
+            assert abs(stats.hedge_delay("m", 100) - 0.2) < 1e-6             # p95 按预计输出 token 换算
+
+            calls, release = [], threading.Event()
+
+            def slow_then_fast():
+                calls.append(time.perf_counter())
+                if len(calls) == 1:
+                    release.wait(5)                                          # 第一个请求卡住
+                    return "primary"
+                return "hedge"
+            t0 = time.perf_counter()
+            out, hedged, won, losers = latency.call(slow_then_fast, "m", 10, stats)
+            assert (out, hedged, won) == ("hedge", True, True)
+            assert time.perf_counter() - t0 < 1 and stats.hedges == stats.hedge_wins == 1
+            release.set()
+            assert len(losers) == 1 and losers[0].result(1) == "primary"    # 作废的请求交回调用方计费
+            assert latency.call(lambda: "ok", "m", 10, stats) == ("ok", False, False, [])
+            stats.save()
+            assert latency.LatencyStats(Path(d) / "lat.json").percentiles("m")["n"] == stats.percentiles("m")["n"]
+    finally:
+        config.HEDGE_MIN_DELAY, config.HEDGE_MIN_SAMPLES = saved
+
+    seen = []
+
+    def create(model, messages, **kw):
+        seen.append(kw.get("timeout"))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="{}"))], usage=None)
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    T._chat(client, "m-test", "sys", "user", expected_tokens=500)
+    assert seen == [latency.deadline(500)] and latency.deadline(500) > latency.deadline(10)   # 截止时间随输出长度放宽
+    options = []
+    client.with_options = lambda **kw: options.append(kw) or client
+    T._chat(client, "m-test", "sys", "user")
+    assert options == [{"max_retries": 0}]                             # SDK 不再自行重试，截止时间即上限
+
+    def resp(prompt, completion):
+        return SimpleNamespace(usage=SimpleNamespace(prompt_tokens=prompt, completion_tokens=completion))
+    one = T._usage_cost(resp(1000, 500), "gpt-5.4-mini", 0, 0)
+    hedged = resp(1000, 500)
+    hedged.hedge_losers = ([resp(1000, 300)], 1)                       # 一个已返回、一个仍在运行
+    assert abs(T._usage_cost(hedged, "gpt-5.4-mini", 0, 0)
+               - (2 * one + T._usage_cost(resp(1000, 300), "gpt-5.4-mini", 0, 0))) < 1e-12
+
+    # 作废副本的 token 记为 hedge_* 类；运行结束后才返回的也在 finish_run 时补记
+    import threading
+    import tracing
+    from concurrent.futures import Future
+    finished, late = Future(), Future()
+    finished.set_result(resp(100, 30))
+    tracer = tracing.start_run("hedge")
+    with tracing.span("chat", model="m-test") as sp:
+        T._attach_losers(resp(100, 50), [finished, late], sp)
+    threading.Timer(0.05, late.set_result, (resp(100, 20),)).start()
+    with tempfile.TemporaryDirectory() as d:
+        prom = tracing.finish_run(tracer, d)["prom"].read_text(encoding="utf-8")
+    assert 'stage="chat",model="m-test",kind="hedge_completion"} 50' in prom
+    assert 'stage="chat",model="m-test",kind="hedge_prompt"} 200' in prom
+
+
+def test_backend_router_failover_headroom_and_cost():
+    from backends import Backend, Router, parse_duration
+    from benchmarks.bench_translate import synth_episode
+    from benchmarks.mock_openai import MockOpenAI
+    assert parse_duration("6m0s") == 360 and parse_duration("20ms") == 0.02 and parse_duration("") is None
+    saved = config.BACKENDS, config.RETRY_BASE_DELAY, config.CHUNK_CUES, config.HEDGE_REQUESTS
+    config.BACKENDS = [{"name": "a", "api_key_env": "LANTRANS_TEST_NO_SUCH_KEY"},
+                       {"name": "b", "api_key": "k", "cost": {"*": {"input": 0.0, "output": 0.0}}}]
+    config.RETRY_BASE_DELAY, config.CHUNK_CUES, config.HEDGE_REQUESTS = 0.001, 10, False
+    try:
+        assert [b["name"] for b in config.backend_specs()] == ["b"]          # 没有 Key 的后端忽略
+        assert config.estimate_cost(10**6, 0, "gpt-5.4-mini", "b") == 0.0    # 后端自己的价格表
+        assert config.estimate_cost(10**6, 0, "gpt-5.4-mini", "a") == 0.75   # 表里没有的按 MODEL_COST
+        with MockOpenAI(server_error_rate=1.0) as bad, MockOpenAI() as good:
+            router = Router([Backend({"name": "bad", "api_key": "x", "base_url": bad.base_url}, max_retries=0),
+                             Backend({"name": "a", "api_key": "x", "base_url": good.base_url}, max_retries=0)])
+            out, cost = T.translate_srt(router, synth_episode(30), "Thai", "gpt-5.4-mini", {})
+            assert len(T._parse_srt(out)) == 30 and cost > 0
+            assert bad.stats["requests"] == 1 and good.stats["ok"] == 3 and router.failovers == 1   # 坏后端冷却
+        with MockOpenAI(request_limit=1) as small, MockOpenAI() as big:
+            router = Router([Backend({"name": "a", "api_key": "x", "base_url": small.base_url}, max_retries=0),
+                             Backend({"name": "b", "api_key": "x", "base_url": big.base_url}, max_retries=0)])
+            out, cost = T.translate_srt(router, synth_episode(60), "Thai", "gpt-5.4-mini", {})
+            stats = router.stats()
+            assert len(T._parse_srt(out)) == 60 and small.stats["ok"] == 1 and big.stats["ok"] == 5
+            assert stats["a"]["headroom"] == 0 and stats["a"]["cooling"]   # 额度用尽：冷却到重置时间
+            assert 0 < cost < config.estimate_cost(small.stats["prompt_tokens"] + big.stats["prompt_tokens"],
+                                                   small.stats["completion_tokens"] + big.stats["completion_tokens"],
+                                                   "gpt-5.4-mini")        # b 的请求按 0 计费
+    finally:
+        config.BACKENDS, config.RETRY_BASE_DELAY, config.CHUNK_CUES, config.HEDGE_REQUESTS = saved
+
+
+def test_shared_blocks_translated_once_and_spliced():
+    from shared_blocks import find_blocks
+    from step1 import _process_single_language
+    opening = ["星光照亮我", "你是我的梦", "一路向前走", "永不回头"]
+
+    def ep(lines, t0=0):
+        return "\n".join(f"{k + 1}\n00:00:{t0 + 2 * k:02d},000 --> 00:00:{t0 + 2 * k + 1:02d},000\n{x}\n"
+                         for k, x in enumerate(lines))
+    episodes = {"ep1.srt": ep(opening + ["第一集台词", "再见"]),
+                "ep2.srt": ep(["上集回顾"] + [f"<i>{x}</i>" for x in opening] + ["第二集台词"], 10),
+                "ep3.srt": ep(["完全不同", "的一集", "没有", "片头", "曲子"])}
+    blocks = find_blocks(episodes)
+    assert len(blocks) == 1 and len(blocks[0]) == 4
+    assert blocks[0].occurrences == [("ep1.srt", 0), ("ep2.srt", 1)]   # 格式标签不影响匹配
+    assert find_blocks(episodes, min_cues=5) == []
+    recap = ["上集说到", "他离开了家", "她一直在等"]
+    split = find_blocks({"e1.srt": ep(recap + ["甲"]), "e2.srt": ep(recap + opening + ["乙"]),
+                         "e3.srt": ep(opening + ["丙"]), "e4.srt": ep(recap + ["丁"])}, min_cues=3)
+    assert [(len(b), b.occurrences) for b in split] == [                # 回顾与片头在 e2 里紧挨着，也各成一块
+        (3, [("e1.srt", 0), ("e2.srt", 0), ("e4.srt", 0)]), (4, [("e2.srt", 3), ("e3.srt", 0)])]
+
+    prompts = []
+    mem_db = config.MEMORY_DB
+    with tempfile.TemporaryDirectory() as d:
+        src = Path(d) / "src"
+        src.mkdir()
+        for name, text in episodes.items():
+            (src / name).write_text(text, encoding="utf-8")
+        config.MEMORY_DB = Path(d) / "memory.sqlite3"
+        try:
+            logs, _ = _process_single_language("X", sorted(episodes), _fake_client(prompts), src, Path(d) / "out",
+                                               "m", "m", False, False, blocks)
+        finally:
+            config.MEMORY_DB = mem_db
+        sent = [p.split("Translate the following subtitles:\n")[1] for p in prompts if "Translate the" in p]
+        assert sum("星光照亮我" in s for s in sent) == 1                  # 片头只送模型一次
+        assert not any("星光照亮我" in s and "第一集台词" in s for s in sent)
+        ep2 = T._parse_srt((Path(d) / "out" / "X" / "ep2.srt").read_text(encoding="utf-8"))
+        assert [c.text for c in ep2] == ["[X] 上集回顾"] + [f"[X] {x}" for x in opening] + ["[X] 第二集台词"]
+        assert ep2[1].start == 12000 and len(ep2) == 6            # 按本集自己的时间轴填入
+        assert "复用 4 条" in next(x for x in logs if "ep2.srt" in x)
+
+
+def test_memory_store_deltas_versions_and_concurrency():
+    import threading
+    from memory_store import MemoryStore
+    with tempfile.TemporaryDirectory() as d:
+        legacy = Path(d) / "drama_memory_Thai.json"
+        legacy.write_text(json.dumps({"episode_count": 2, "characters": {"张三": "Somchai"}, "terminology": {},
+                                      "style_notes": "casual"}), encoding="utf-8")
+        mem_path, config.memory_path = config.memory_path, lambda lang: Path(d) / f"drama_memory_{lang}.json"
+        try:
+            db = MemoryStore(Path(d) / "m.sqlite3")
+            mem, v = db.load("Thai")                                     # 首次读取导入旧版 JSON
+        finally:
+            config.memory_path = mem_path
+        assert v == 1 and mem["characters"] == {"张三": "Somchai"} and mem["episode_count"] == 2
+        assert db.languages() == ["Thai"]
+
+        # 两个会话基于同一版本各自提交：双方新增的键都保留，只写改动的条目
+        a = {**mem, "characters": {"张三": "Somchai", "李四": "Anan"}}
+        b = {**mem, "terminology": {"董事会": "board"}, "style_notes": "formal"}
+        v2 = db.commit("Thai", a, v, "ep3.srt")
+        v3 = db.commit("Thai", b, v, "ep4.srt")
+        mem, v = db.load("Thai")
+        assert (v2, v3, v) == (2, 3, 3) and mem["episode_count"] == 4 and mem["style_notes"] == "formal"
+        assert mem["characters"] == {"张三": "Somchai", "李四": "Anan"} and mem["terminology"] == {"董事会": "board"}
+        assert [h[3] for h in db.history("Thai")] == [1, 1, 1]                  # 每版只记一条改动
+
+        old, ver = db.as_of_episode("Thai", 3)
+        assert ver == 2 and "董事会" not in old["terminology"] and old["characters"]["李四"] == "Anan"
+        assert db.as_of_episode("Thai", 1) == ({"episode_count": 0, "characters": {}, "terminology": {},
+                                                "style_notes": ""}, 0)
+
+        errors = []
+
+        def writer(k):
+            try:
+                for j in range(5):
+                    m, base = db.load("Thai")
+                    db.commit("Thai", {**m, "terminology": {f"t{k}_{j}": {"note": k}}}, base, f"w{k}_{j}.srt")
+            except Exception as e:   # noqa: BLE001
+                errors.append(e)
+        threads = [threading.Thread(target=writer, args=(k,)) for k in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        mem, v = db.load("Thai")
+        assert not errors and v == 23 and mem["episode_count"] == 24
+        assert len(mem["terminology"]) == 21 and mem["terminology"]["t3_4"] == {"note": 3}
+        import sqlite3
+        from contextlib import closing
+        with closing(sqlite3.connect(str(db.path))) as raw:               # 最新记忆读 latest 表，与按历史重建一致
+            assert json.dumps(db._snapshot(raw, "Thai", v, latest=True)) == json.dumps(db._snapshot(raw, "Thai", v))
+            raw.execute("DELETE FROM latest")                             # 模拟升级前的旧库：打开时从 entries 回填
+            raw.execute("PRAGMA user_version=0")
+            raw.commit()
+        assert MemoryStore(db.path).load("Thai") == (mem, v)
+        saved = config.MAX_MEMORY_ITEMS
+        config.MAX_MEMORY_ITEMS = 5
+        try:
+            assert list(db.load("Thai")[0]["terminology"]) == list(mem["terminology"])[-5:]   # 只取最近更新的
+        finally:
+            config.MAX_MEMORY_ITEMS = saved
+        db.reset("Thai")
+        assert db.languages() == [] and db.load("Thai")[1] == 0
+
+
+def test_render_benchmark_regression_check():
+    from benchmarks import bench_render as BR
+    base = {"cases": {"a": {"norm": 1.0, "font": "x.ttf"}, "b": {"norm": 1.0, "font": "x.ttf"}}}
+    cur = {"cases": {"a": {"norm": 1.6, "font": "x.ttf"}, "b": {"norm": 1.2, "font": "y.ttf"},
+                     "c": {"norm": 9.0, "font": "x.ttf"}}}
+    assert BR.compare(cur, base, 0.5) == ([("a", 1.6)], ["b", "c"])   # 字体不同 / 新增项不判定
+    res = BR.run(n=10, repeat=1, sizes=(32,), line_limits=(2,), scripts=("cjk",), filter_="cjk")
+    assert {"_chunk_cues/cjk", "_parse_srt/cjk"} <= set(res["cases"])   # 与字体无关的项总会运行
+    if BR.pick_font("cjk")[0] is None:                                 # 缺字的字体不拿来测、不进基线
+        assert "cjk" in res["skipped"] and "wrap_text_pil/cjk/32" not in res["cases"]
+    assert len(BR.corpus("thai", 5)) == 5 and BR.corpus("cjk", 3) == BR.corpus("cjk", 3)   # 语料固定
+    if not step3.default_font_path:
+        return
+    res = BR.run(n=10, repeat=1, sizes=(32,), line_limits=(2,), scripts=("latin",), filter_="wrap_")
+    assert set(res["cases"]) == {"wrap_text_pil/latin/32", "_wrap_and_fit/latin/32/l2"}
+    assert all(c["per_cue_us"] > 0 and c["norm"] > 0 for c in res["cases"].values())
+
+
+def test_srt_cues_parse_format_roundtrip():
+    from srt_cues import Cue, format_srt, format_time, parse_srt, renumber
+    text = ("\ufeff1\r\n00:00:01,000 --> 00:00:02,500\r\nHello\r\n世界\r\n\r\n"
+            "garbage block\n\n"
+            "00:01:02.007 --> 01:00:00,000 X1:0\n\n"               # 缺序号、小数点毫秒、空文本
+            "7\n00:00:03,000 --> 00:00:04,000\nBye\n")
+    cues = parse_srt(text)
+    assert cues == [Cue(1, 1000, 2500, "Hello\n世界"), Cue(2, 62007, 3600000, ""), Cue(7, 3000, 4000, "Bye")]
+    assert format_time(3723004) == "01:02:03,004" and format_time(-5) == "00:00:00,000"
+    out = format_srt(renumber(cues))
+    assert out.startswith("1\n00:00:01,000 --> 00:00:02,500\nHello\n世界\n\n2\n") and out.endswith("3\n00:00:03,000 --> 00:00:04,000\nBye\n")
+    assert parse_srt(out) == cues and parse_srt("no subtitles here") == []
+    assert T._parse_srt("") is None and cues[0].timing == (1000, 2500)
+
+
 def test_ass_helpers():
     assert step3._ass_color("#FFFFFF", 1.0) == "&H00FFFFFF"
     assert step3._ass_color("#000000", 0.5) == "&H7F000000"   # alpha 127, BGR 000000
@@ -85,15 +705,310 @@ def test_ass_helpers():
 
 
 def test_build_ass():
-    import pysrt
+    from srt_cues import parse_srt
     style = {"font_path": step3.default_font_path or "x", "font_size": 48, "font_color": "#FFFFFF",
              "stroke_color": "#000000", "stroke_width": 2, "bold": 1, "bottom_offset": 80,
              "max_text_width": 1500, "shadow_color": "#000000", "shadow_opacity": 0.5,
              "shadow_offset": (0, 2), "bg_enabled": False}
-    subs = pysrt.from_string("1\n00:00:01,000 --> 00:00:02,000\nHello\n世界")
+    subs = parse_srt("1\n00:00:01,000 --> 00:00:02,000\nHello\n世界")
     ass = step3.build_ass(subs, style, 1920, 1080)
     assert "[V4+ Styles]" in ass and "PlayResX: 1920" in ass
     assert "Dialogue:" in ass and "Hello\\N世界" in ass  # 换行转为 \N
+    if step3.default_font_path:
+        long = "1\n00:00:01,000 --> 00:00:02,000\n" + "word " * 30
+        ass = step3.build_ass(parse_srt(long), dict(style, max_text_width=600, max_lines=2), 1920, 1080,
+                              prewrap=True)
+        line = ass.strip().splitlines()[-1]
+        wrapped, fs = step3._wrap_and_fit(("word " * 30).strip(), dict(style, max_text_width=600, max_lines=2))
+        assert "WrapStyle: 2" in ass and "\\pos(960,1000)" in line     # 关闭自动换行，按预览定位
+        assert line.endswith(wrapped.replace("\n", "\\N"))
+        assert f"\\fs{step3._ass_size(style['font_path'], fs)}}}" in line   # 缩字条目带字号覆盖
+
+
+def test_cue_style_annotations_and_sidecar():
+    from srt_cues import parse_srt
+    import cue_style as CS
+    clean, ov = CS.parse_annotations('{\\an8}<i>Hello</i>\n<font color="#ffe000">世界</font>')
+    assert clean == "Hello\n世界" and ov == {"align": 8, "italic": True, "font_color": "#FFE000"}
+    assert CS.parse_annotations("plain") == ("plain", {})
+    with tempfile.TemporaryDirectory() as d:
+        srt = Path(d) / "ep1.srt"
+        (Path(d) / "ep1.styles.json").write_text('{"2-3": {"position": "top"}, "3": {"bold": true}}', encoding="utf-8")
+        side = CS.load_sidecar(srt)
+        assert side[2] == {"align": 8} and side[3] == {"align": 8, "bold": True} and 1 not in side
+        assert CS.resolve(2, "{\\an1}x", side) == ("x", (("align", 8),))   # 旁路样式表优先
+    style = {"font_path": step3.default_font_path or "x", "font_size": 48, "font_color": "#FFFFFF",
+             "stroke_color": "#000000", "stroke_width": 2, "bold": 1, "bottom_offset": 80,
+             "max_text_width": 1500, "shadow_color": "#000000", "shadow_opacity": 0.0,
+             "shadow_offset": (0, 2), "bg_enabled": False}
+    subs = parse_srt("1\n00:00:01,000 --> 00:00:02,000\n{\\an8}<i>Hi</i>\n\n"
+                     "2\n00:00:03,000 --> 00:00:04,000\n<font color=\"#FF0000\">Red</font>")
+    lines = step3.build_ass(subs, style, 1920, 1080).strip().splitlines()
+    assert lines[-2].endswith("{\\an8\\i1}Hi") and lines[-1].endswith("{\\c&H0000FF&}Red")
+    if not step3.default_font_path:
+        return
+    assert "\\an8\\pos(960,80)" in step3.build_ass(subs, style, 1920, 1080, prewrap=True)   # 顶部：文字顶在距顶 80px
+    b, x, y = R.render_block((1920, 1080), "Hello", style)
+    bt, xt, yt = R.render_block((1920, 1080), "Hello", dict(style, align=8))
+    assert bt is b and yt - 80 == y - (1080 - 80)               # 同一字幕块，上下对称定位
+    bi, _, _ = R.render_block((1920, 1080), "Hello", dict(style, italic=True))
+    assert bi.width > b.width                                   # 斜体错切后更宽
+
+
+def test_font_subset_fontsdir_cached_by_glyphs():
+    if not step3.default_font_path:
+        return
+    import font_subset as FS
+    with tempfile.TemporaryDirectory() as d:
+        a = FS.prepare_fontsdir(step3.default_font_path, ["Hello", "world"], d)
+        files = list(a.iterdir())
+        assert len(files) == 1                                   # 目录里只有这一个字体
+        assert FS.prepare_fontsdir(step3.default_font_path, ["world", "Hello"], d) == a   # 同字形集合命中缓存
+        font = L.ImageFont.truetype(str(files[0]), 24)
+        assert font.getname()[0] == L.ImageFont.truetype(step3.default_font_path, 24).getname()[0]
+        try:
+            import fontTools  # noqa: F401
+        except ImportError:
+            return
+        assert FS.prepare_fontsdir(step3.default_font_path, ["Zebra"], d) != a
+        assert files[0].stat().st_size < os.path.getsize(step3.default_font_path)
+
+
+def test_manifest_staleness():
+    with tempfile.TemporaryDirectory() as d:
+        src, out = Path(d) / "a.srt", Path(d) / "out"
+        src.write_text("1", encoding="utf-8")
+        m = M.Manifest(out)
+        sig = M.signature({"srt": src}, {"lang": "Thai"})
+        assert not m.is_fresh("a.srt", sig)            # 尚无输出
+        out.mkdir()
+        (out / "a.srt").write_text("x", encoding="utf-8")
+        assert not m.is_fresh("a.srt", sig)            # 无记录且不认领 → 过期
+        m.record("a.srt", sig)
+        assert M.Manifest(out).is_fresh("a.srt", sig)  # 落盘后重新加载仍有效
+        assert not m.is_fresh("a.srt", M.signature({"srt": src}, {"lang": "Malay"}))  # 设置变了
+        src.write_text("2", encoding="utf-8")
+        os.utime(src, ns=(1, 1))
+        assert not m.is_fresh("a.srt", M.signature({"srt": src}, {"lang": "Thai"}))  # 源内容变了
+
+
+def test_manifest_adopt_and_sampled_hash():
+    with tempfile.TemporaryDirectory() as d:
+        (Path(d) / "old.mp4").write_bytes(b"x")
+        m = M.Manifest(d)
+        assert m.is_fresh("old.mp4", {"inputs": {}, "settings": "s"}, adopt=True)
+        assert "old.mp4" in M.Manifest(d).entries
+        big = Path(d) / "big.bin"
+        big.write_bytes(bytes(M._FULL_HASH_LIMIT + 10))
+        fp = M.file_fingerprint(big)
+        with open(big, "r+b") as f:   # 改动采样段（文件开头）后指纹应变化
+            f.write(b"\x01")
+        os.utime(big, ns=(2, 2))
+        assert M.file_fingerprint(big) != fp
+    assert M._cached_digest.cache_info().maxsize == M._HASH_CACHE_SIZE   # 常驻进程里缓存有上限
+
+
+def test_preview_frame_source_cache():
+    import io
+    import subprocess
+    from preview_frames import FrameSource
+    exe = F.find_ffmpeg()
+    if not exe:
+        return
+    with tempfile.TemporaryDirectory() as d:
+        clip = Path(d) / "clip.mp4"
+        subprocess.run([exe, "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=size=320x240:rate=10:duration=3",
+                        "-pix_fmt", "yuv420p", str(clip)], check=True, stdin=subprocess.DEVNULL)
+        src = FrameSource(path=clip, cache_dir=Path(d) / "cache")
+        assert src.key == M.file_fingerprint(clip) == FrameSource(io.BytesIO(clip.read_bytes())).key
+        info = src.info()
+        assert (info["width"], info["height"]) == (320, 240) and src.default_time() == 1.0
+        assert src.frame(1.0).size == (320, 240)
+        thumbs = list(src.thumbnails(2))
+        assert [round(t, 2) for t, _ in thumbs] == [0.75, 2.25] and thumbs[0][1].width == 240
+        again = FrameSource(path=clip, cache_dir=Path(d) / "cache")
+        again.exe = None                                     # 不调用 ffmpeg：信息与帧都应从磁盘缓存读出
+        assert again.info() == info and again.frame(1.0).size == (320, 240)
+
+
+def test_preview_frame_cache_is_capped():
+    import preview_frames as PF
+    with tempfile.TemporaryDirectory() as d:
+        d = Path(d)
+        for k in range(PF.KEEP_FRAMES + 5):
+            p = d / f"k_{k}_0.png"
+            p.write_bytes(b"")
+            os.utime(p, (k, k))
+        (d / "k.json").write_text("{}")
+        newest = d / f"k_{PF.KEEP_FRAMES + 4}_0.png"
+        PF._prune_frames(d, keep=newest)
+        left = sorted(d.glob("*.png"), key=lambda p: p.stat().st_mtime)
+        assert len(left) == PF.KEEP_FRAMES and newest in left and (d / "k.json").exists()
+        assert left[0].name == "k_5_0.png"          # 最久未用的先删
+
+
+def test_soft_subtitle_mux_tracks():
+    import subprocess
+    import soft_subs as SS
+    with tempfile.TemporaryDirectory() as d:
+        root = Path(d) / "srt"
+        for lang in ("Thai", "English"):
+            (root / lang).mkdir(parents=True)
+            (root / lang / "ep1.srt").write_text("1\n00:00:00,500 --> 00:00:01,500\nHi\n", encoding="utf-8")
+        tracks = SS.subtitle_tracks(root, "ep1.srt")
+        assert [lang for _, lang in tracks] == ["English", "Thai"]     # 按 LANG_OPTIONS 顺序
+        assert SS.subtitle_tracks(root / "Thai", "ep1.srt") == [(root / "Thai" / "ep1.srt", "Thai")]
+        cmd = SS.mux_command("ffmpeg", "v.mp4", "out.mp4", tracks)
+        assert "-c:v" in cmd and cmd[cmd.index("-c:v") + 1] == "copy" and "mov_text" in cmd
+        assert "language=eng" in cmd and "language=tha" in cmd
+        try:
+            SS.subtitle_codec("out.avi")
+            assert False, "不支持的容器应报错"
+        except ValueError:
+            pass
+        exe = F.find_ffmpeg()
+        if not exe:
+            return
+        clip = Path(d) / "ep1.mp4"
+        subprocess.run([exe, "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=size=160x120:rate=10:duration=2",
+                        "-pix_fmt", "yuv420p", str(clip)], check=True, stdin=subprocess.DEVNULL)
+        for out, codec in ((Path(d) / "out.mp4", "mov_text"), (Path(d) / "out.mkv", "ass")):
+            SS.mux_subtitles(exe, clip, out, tracks)
+            err = subprocess.run([exe, "-hide_banner", "-i", str(out)], capture_output=True, text=True,
+                                 stdin=subprocess.DEVNULL).stderr
+            assert err.count(f"Subtitle: {codec}") == 2 and "(eng)" in err and "(tha)" in err
+            assert "Video: h264" in err                                # 视频流原样复制
+
+
+def test_ffmpeg_progress_parser():
+    p = F.ProgressParser(duration=10.0)
+    lines = ["frame=50", "fps=25.0", "out_time_us=2000000", "speed=2.5x", "progress=continue",
+             "out_time_us=N/A", "progress=end"]
+    snaps = [s for s in map(p.feed, lines) if s]
+    assert snaps[0] == {"out_time": 2.0, "fps": 25.0, "speed": 2.5, "percent": 0.2, "done": False}
+    assert snaps[1]["done"] and snaps[1]["percent"] == 1.0
+
+
+def test_batch_progress_eta():
+    b = F.BatchProgress({"a": 10.0, "b": 30.0})
+    b.start("a")
+    b.update("a", {"out_time": 5.0, "fps": 0, "speed": 0})
+    s = b.summary()
+    assert abs(s["percent"] - 5 / 40) < 1e-9 and s["eta"] is not None and len(s["running"]) == 1
+    b.finish("b", counted=False)   # 跳过的任务不再计入剩余量
+    assert abs(b.summary()["percent"] - 0.5) < 1e-9
+    assert abs(b.summary(pending=1)["percent"] - 5 / 20) < 1e-9   # 未探测的任务按平均时长估算
+    assert F.format_eta(3725) == "1h02m" and F.format_eta(65) == "1m05s" and F.format_eta(None) == "--"
+
+
+def test_scheduler_lpt_and_nvenc_limit():
+    import threading
+    jobs = [S.BurnJob(k, c, prefer_gpu=True) for k, c in (("s", 1), ("l", 9), ("m", 5), ("x", 3), ("y", 2))]
+    seen, lock, peak = [], threading.Lock(), {"gpu": 0, "cur": 0}
+
+    def fn(job, enc, threads):
+        with lock:
+            seen.append((job.key, enc, threads))
+            if enc == "h264_nvenc":
+                peak["cur"] += 1
+                peak["gpu"] = max(peak["gpu"], peak["cur"])
+        import time
+        time.sleep(0.05)
+        with lock:
+            if enc == "h264_nvenc":
+                peak["cur"] -= 1
+        return job.key
+
+    sched = S.AdaptiveScheduler(4, cpu_count=8, nvenc_sessions=2, spill_to_cpu=True, load_fn=lambda: 1.0)
+    results = [r for j, r in sched.run(jobs, fn, gpu_encoder="h264_nvenc", poll=0.01) if j is not None]
+    assert sorted(results) == ["l", "m", "s", "x", "y"]
+    assert [k for k, _, _ in seen[:2]] == ["l", "m"]               # 最长任务优先拿到 GPU
+    assert peak["gpu"] <= 2                                        # NVENC 会话受限
+    assert any(enc == "libx264" for _, enc, _ in seen)             # 其余溢出到 CPU
+
+
+def test_scheduler_cpu_threads_rebalance():
+    sched = S.AdaptiveScheduler(4, cpu_count=16, load_fn=lambda: 0.2, settle=0)
+    q = [S.BurnJob(str(i), 1) for i in range(6)]
+    job, enc, th = sched.pick(q, None)
+    assert enc == "libx264" and th == 4                            # 16 核 / 4 个并发槽
+    assert sched.threads_for("libx264", queued_cpu=1) == 16        # 尾部只剩一个任务：拿满空闲核心
+    sched.running = {object(): (S.BurnJob("a", 1), "libx264", 16)}
+    assert sched._cpu_admits()                                     # 预算用尽但实测利用率低 → 超额放行
+    sched.load_fn = lambda: 0.99
+    assert not sched._cpu_admits()
+
+
+def test_scheduler_gpu_job_skips_cpu_blocked_head():
+    sched = S.AdaptiveScheduler(4, cpu_count=8, nvenc_sessions=2, load_fn=lambda: 0.99, settle=0)
+    sched.running = {object(): (S.BurnJob("x264", 9), "libx264", 8)}   # CPU 预算已满
+    q = [S.BurnJob("cpu", 5), S.BurnJob("gpu", 1, prefer_gpu=True)]
+    job, enc, _ = sched.pick(q, "h264_nvenc")
+    assert job.key == "gpu" and enc == "h264_nvenc"                # 队首等 CPU 时 GPU 不空等
+    assert sched.pick(q[:1], "h264_nvenc") is None
+
+
+def test_encoder_registry_policy_and_probe_cache():
+    import encoders as E
+    assert E.video_args("libx264", 23, "medium") == step3._vcodec_args("libx264", 23, "medium")
+    assert E.video_args("libx265", 23, "slow")[2:6] == ["-preset", "slow", "-crf", "28"]   # x265 CRF 高 5 档观感相当
+    assert E.video_args("libsvtav1", 23, "fast")[2:6] == ["-preset", "8", "-crf", "34"]
+    assert E.is_hardware("h264_qsv") and not E.is_hardware("libx265")
+    assert E.choose("compat", ("libx264", "libx265")) == "libx264"          # 兼容：只选 H.264
+    assert E.choose("compat", ("libx264", "h264_nvenc")) == "h264_nvenc"
+    assert E.choose("size", ("libx264", "libx265")) == "libx265"
+    assert E.choose("speed", ()) == "libx264"                               # 都不可用时兜底
+    sched = S.AdaptiveScheduler(2, cpu_count=8, load_fn=lambda: 0.2, settle=0)
+    assert sched.pick([S.BurnJob("a", 1)], None, "libx265")[1] == "libx265"   # CPU 任务用所选软件编码器
+    exe = F.find_ffmpeg()
+    if not exe:
+        return
+    with tempfile.TemporaryDirectory() as d:
+        cache = Path(d) / "probe.json"
+        found = E.probe_encoders(exe, cache_file=cache)
+        assert found["libx264"] and set(found) == set(E.REGISTRY)
+        cached = json.loads(cache.read_text(encoding="utf-8"))
+        key = next(iter(cached))
+        cached[key]["libx264"] = "from-cache"
+        cache.write_text(json.dumps(cached), encoding="utf-8")
+        assert E.probe_encoders(exe, cache_file=cache)["libx264"] == "from-cache"   # 跨会话复用，不再测试编码
+        assert E.probe_encoders(exe, refresh=True, cache_file=cache)["libx264"] is True
+
+
+def test_pil_burn_composite_only_active_interval():
+    import numpy as np
+    from PIL import Image
+    block = Image.new("RGBA", (4, 2), (255, 0, 0, 255))
+    # 第二条位于画面外左侧一半：应被裁剪；相同文本只渲染一次
+    calls = []
+
+    def render(size, text):
+        calls.append(text)
+        return block, (-2 if text == "b" else 1), 1
+
+    ov = P.build_overlays([(0.1, 0.2, "a"), (0.0, 0.1, "b"), (0.3, 0.4, "a")], (8, 4), render)
+    assert calls == ["a", "b"] and [o[0] for o in ov] == [0.0, 0.1, 0.3]
+    assert ov[0][4].shape[:2] == (2, 2) and ov[0][2] == 0
+    frames = [np.zeros((4, 8, 3), np.uint8) for _ in range(5)]
+    out = []
+    n = P.composite_frames(iter(frames).__next__, out.append, 0, 10.0, ov, max_frames=5)
+    assert n == 5
+    assert out[0][1, 0, 0] == 255 and out[0][1, 2, 0] == 0      # t=0.0：只有 b（裁剪后宽 2）
+    assert out[1][1, 1, 0] == 255 and out[1][1, 0, 0] == 0      # t=0.1：b 已结束，a 出现
+    assert not out[2].any()                                     # t=0.2：无字幕，整帧不动
+
+
+def test_overlay_track_timeline():
+    import numpy as np
+    px = np.full((1, 1, 4), 255, np.uint8)
+    ov = [(1.0, 3.0, 0, 0, px), (2.0, 4.0, 1, 0, px), (6.0, 7.0, 0, 0, px)]
+    assert P.overlay_timeline(ov) == [(1.0, 2.0, (0,)), (2.0, 3.0, (0, 1)), (3.0, 4.0, (1,)),
+                                      (4.0, 6.0, ()), (6.0, 7.0, (2,))]
+    with tempfile.TemporaryDirectory() as d:
+        listing = P.write_overlay_track(ov, (4, 2), d).read_text(encoding="utf-8").splitlines()
+        assert listing[0] == "ffconcat version 1.0"
+        assert listing[1:3] == [f"file '{(Path(d) / 'blank.png').as_posix()}'", "duration 1.000"]   # 开头空白
+        assert len(list(Path(d).glob("cue_*.png"))) == 4   # 4 种不同的活跃组合（空白复用 blank.png）
 
 
 def _run():
@@ -0,0 +1,224 @@
+"""字幕排版（按像素宽度换行、避头尾、按行数上限自动缩字）与带缓存的文字测量。
+与 Streamlit 无关，供 Step 3 预览 / 烧录及其它需要「与渲染器同一套测量」的地方共用。
+
+测量层（TextMeasurer）取代原先每个原子都 font.getlength(整行 + 原子) 的做法（行越长越慢，
+总体随行长平方增长）：
+- 每个 (字体, 字号) 一个测量器，缓存原子宽度与相邻字符的字距修正（kerning pair）；
+- 行宽增量累加：行宽 + 原子宽 + 字距修正。基础排版下只在接近行宽上限时才整行精确测量一次；
+  raqm 排版（连写、上下文字形）的估算误差没有固定上界，改为按估算找出断行位置后整行精确复核
+  （该行放得下、再多一个原子放不下），每行通常只需两次测量。两种情况结果都与逐次精确测量一致；
+- 按行数上限缩字改为在候选字号上二分查找，不再每 2px 整段重排一次；
+- 换行结果按 (文本, 字体, 字号, 宽度) 缓存，预览反复重绘、批量渲染重复台词直接命中。
+"""
+import re
+from functools import lru_cache
+
+from PIL import ImageFont
+
+MIN_FIT_SIZE = 12    # 按行数上限缩字时的最小字号
+
+
+_CONTROL_RE = re.compile("[\x00-\x08\x0b-\x1f]")
+
+
+def safe_text(text):
+    """去掉控制字符（保留换行 / 制表符）与首尾空白。"""
+    if not text:
+        return ""
+    return _CONTROL_RE.sub("", text).strip()
+
+
+def _is_breakable_char(ch):
+    """无空格断行语言（中日韩、泰文及全角标点）——可在字符之间换行。"""
+    o = ord(ch)
+    return (0x4E00 <= o <= 0x9FFF or   # CJK 统一表意文字
+            0x3040 <= o <= 0x30FF or   # 日文平假名 / 片假名
+            0xAC00 <= o <= 0xD7A3 or   # 韩文谚文
+            0x0E00 <= o <= 0x0E7F or   # 泰文
+            0x3000 <= o <= 0x303F or   # CJK 标点
+            0xFF00 <= o <= 0xFFEF)     # 全角字符
+
+
+def _is_combining_mark(ch):
+    """组合附加符号 / 泰文元音声调符号——不应出现在行首，需附着到前一字符。"""
+    o = ord(ch)
+    return (0x0300 <= o <= 0x036F or
+            o == 0x0E31 or 0x0E34 <= o <= 0x0E3A or 0x0E47 <= o <= 0x0E4E)
+
+
+# 避头尾：这些标点不应出现在行首，需并入上一行行尾
+_LEADING_FORBIDDEN = "，。、！？；：）】》」』’”·.,!?;:)]}>"
+
+
+def _apply_kinsoku(lines):
+    """把出现在行首的收尾标点移到上一行末尾（中日韩避头尾规则的简化版）。"""
+    out = []
+    for line in lines:
+        while out and line and line[0] in _LEADING_FORBIDDEN:
+            out[-1] += line[0]
+            line = line[1:]
+        if line:
+            out.append(line)
+    return out
+
+
+@lru_cache(maxsize=16)
+def _get_font(font_path, font_size):
+    """缓存字体对象，避免一集数百条字幕时反复从磁盘加载。"""
+    return ImageFont.truetype(font_path, font_size)
+
+
+class TextMeasurer:
+    """某个 (字体, 字号) 的宽度测量缓存。用 get_measurer() 获取共享实例。"""
+
+    def __init__(self, font):
+        self.font = font
+        # 基础排版下「原子宽 + 字距修正」的累加与整串测量只差浮点舍入；
+        # raqm 排版（阿拉伯文连写等）会随上下文改变字形，估算误差没有固定上界，由 wrap 按行精确复核。
+        basic = getattr(font, "layout_engine", None) == ImageFont.Layout.BASIC
+        self.slack = 1.0 if basic else None
+        self._widths = {}
+        self._pairs = {}
+
+    def width(self, s):
+        """整串宽度（缓存）。"""
+        w = self._widths.get(s)
+        if w is None:
+            try:
+                w = self.font.getlength(s)
+            except AttributeError:
+                bbox = self.font.getbbox(s)
+                w = bbox[2] - bbox[0]
+            if len(self._widths) > 20000:   # 长剧集也不让缓存无限增长
+                self._widths.clear()
+            self._widths[s] = w
+        return w
+
+    def kern(self, a, b):
+        """字符 a 后紧跟字符 b 时相对两者独立宽度之和的修正量（字距对）。"""
+        key = a + b
+        k = self._pairs.get(key)
+        if k is None:
+            k = self._pairs[key] = self.width(key) - self.width(a) - self.width(b)
+        return k
+
+    def fits(self, line, line_w, atom, max_width):
+        """判断 line + atom 是否不超过 max_width。返回 (是否放得下, 新行宽)。
+        先用增量估算；基础排版下估算值落在上限附近（slack 内）时整串精确测量。
+        raqm 排版只返回估算值，精确结果由 _wrap_atoms 按行复核。"""
+        est = line_w + self.width(atom) + self.kern(line[-1], atom[0])
+        if self.slack is not None and abs(est - max_width) <= self.slack:
+            est = self.width(line + atom)
+        return est <= max_width, est
+
+    def line_width(self, line):
+        """一行排好的文字的宽度：基础排版下用缓存的原子宽 + 字距修正累加（与整串测量只差浮点舍入），
+        免去对每行都整串测量；raqm 排版会随上下文改变字形，仍整串测量。"""
+        if self.slack is None or not line:
+            return self.width(line)
+        atoms = _atoms(line)
+        w = self.width(atoms[0])
+        for prev, atom in zip(atoms, atoms[1:]):
+            w += self.width(atom) + self.kern(prev[-1], atom[0])
+        return w
+
+
+_SPACE_SPLIT = re.compile("( )")
+
+
+@lru_cache(maxsize=64)
+def get_measurer(font_path, font_size):
+    return TextMeasurer(_get_font(font_path, font_size))
+
+
+def _atoms(paragraph):
+    """切成原子：空格、拉丁单词、单个 CJK/泰文字符（组合符号附着到前一原子）。"""
+    if paragraph.isascii():   # 纯 ASCII 没有可断字符与组合符号：按空格切分即可（结果相同）
+        return [a for a in _SPACE_SPLIT.split(paragraph) if a]
+    atoms, buf = [], ""
+    for ch in paragraph:
+        if _is_combining_mark(ch):
+            if buf:
+                buf += ch
+            elif atoms:
+                atoms[-1] += ch
+            else:
+                buf += ch
+        elif ch == ' ' or _is_breakable_char(ch):
+            if buf:
+                atoms.append(buf)
+                buf = ""
+            atoms.append(ch)
+        else:
+            buf += ch
+    if buf:
+        atoms.append(buf)
+    return atoms
+
+
+@lru_cache(maxsize=4096)
+def wrap_text_pil(text, font_path, font_size, max_width):
+    """按像素宽度换行。拉丁文按单词换行；中日韩/泰文等无空格语言按字符换行。"""
+    m = get_measurer(font_path, font_size)
+    lines = []
+    for paragraph in text.split('\n'):
+        # 避头尾仅在同一段（同一原始行）内处理，避免跨行合并
+        lines.extend(_apply_kinsoku(_wrap_atoms(m, _atoms(paragraph), max_width)))
+    return "\n".join(lines)
+
+
+def _wrap_atoms(m, atoms, max_width):
+    """把一段的原子贪心排成行（行首空格跳过、行尾空格去掉），与逐原子整串精确测量的结果一致。
+
+    raqm 排版下先按估算找到断行位置，再整串精确复核「这一行放得下、再加一个原子就放不下」，
+    不满足时逐个原子前后挪动。行宽随原子增多单调不减，因此复核通过的断行就是精确贪心的断行。"""
+    exact = m.slack is None
+    lines, i, n = [], 0, len(atoms)
+    while i < n:
+        if atoms[i] == ' ':
+            i += 1      # 跳过行首空格
+            continue
+        current, cur_w, j = atoms[i], m.width(atoms[i]), i + 1
+        while j < n:
+            ok, new_w = m.fits(current, cur_w, atoms[j], max_width)
+            if not ok:
+                break
+            current, cur_w, j = current + atoms[j], new_w, j + 1
+        if exact:
+            while j - i > 1 and m.width(current) > max_width:
+                j -= 1
+                current = current[:len(current) - len(atoms[j])]
+            while j < n and m.width(current + atoms[j]) <= max_width:
+                current, j = current + atoms[j], j + 1
+        if current.strip():
+            lines.append(current.rstrip())
+        i = j
+    return lines
+
+
+@lru_cache(maxsize=4096)
+def fit_text(text, font_path, font_size, max_width, max_lines=0):
+    """换行，并在 max_lines>0 时缩小字号以满足行数上限。返回 (换行后文本, 实际字号)。
+    候选字号为 font_size, font_size-2, ...（到 MIN_FIT_SIZE 为止），二分查找最大的满足者；
+    都不满足则用最小候选。行数随字号单调不增，结果与逐档递减一致。"""
+    wrapped = wrap_text_pil(text, font_path, font_size, max_width)
+    if not max_lines or wrapped.count("\n") + 1 <= max_lines or font_size <= MIN_FIT_SIZE:
+        return wrapped, font_size
+    sizes = [font_size]
+    while sizes[-1] > MIN_FIT_SIZE:
+        sizes.append(sizes[-1] - 2)
+    lo, hi = 1, len(sizes) - 1          # sizes[0] 已知放不下；在 [lo, hi] 里找第一个放得下的
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if wrap_text_pil(text, font_path, sizes[mid], max_width).count("\n") + 1 <= max_lines:
+            hi = mid
+        else:
+            lo = mid + 1
+    return wrap_text_pil(text, font_path, sizes[lo], max_width), sizes[lo]
+
+
+def _wrap_and_fit(text, style):
+    """换行，并在设置了 max_lines 时自动缩小字号以满足行数上限。
+    返回 (换行后文本, 实际字号)。"""
+    return fit_text(text, style["font_path"], style["font_size"], style["max_text_width"],
+                    style.get("max_lines", 0))
@@ -99,7 +99,7 @@ def inject_css():
 
 def render_header():
     """品牌栏 + API 状态。"""
-    if config.get_api_key():
+    if config.backend_specs():
         status = '<div class="lt-status lt-ok">🟢 API 已连接</div>'
     else:
         status = '<div class="lt-status lt-bad">🔴 未检测到 API Key</div>'
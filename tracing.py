@@ -0,0 +1,297 @@
+"""轻量的阶段追踪：记录流水线各阶段（请求、重试等待、解析、记忆更新、探测、ASS 生成、编码……）的耗时与属性，
+导出为 Chrome trace（chrome://tracing / Perfetto 打开）、Prometheus 文本指标与按阶段汇总的耗时分布。与 Streamlit 无关。
+
+用法：
+    tracer = tracing.start_run("translate")         # 在当前线程（上下文）激活
+    try:
+        with tracing.span("chat", model=m, lang=lang) as sp:
+            resp = ...
+            sp.set(prompt_tokens=..., completion_tokens=...)
+        pool.submit(tracing.bind(work), ...)         # 工作线程里的 span 也记入同一次运行
+    finally:
+        paths = tracing.finish_run(tracer)           # 写出 .trace.json / .prom / .summary.json
+    print(tracing.format_summary(tracer))
+
+没有激活的追踪时 span 几乎零开销（直接返回空对象），纯函数与单元测试不受影响。
+激活的追踪存在 contextvar 里，只对启动它的线程与经 bind() 包装、交给工作线程的函数可见：
+Streamlit 多个会话同时跑 Step 1 / Step 3 时各记各的，互不混入。同一线程内的嵌套 span 记为父子关系，
+汇总按「自身耗时」（减去嵌套子阶段）统计，各阶段之和不会重复计算。
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from concurrent.futures import wait
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import config
+
+LABEL_KEYS = ("lang", "model", "encoder", "engine", "backend")   # 导出为 Prometheus 标签的属性（基数有限）
+TOKEN_KEYS = ("prompt_tokens", "completion_tokens",                # 导出为 lantrans_tokens_total 的属性，
+              "hedge_prompt_tokens", "hedge_completion_tokens")    # kind 取去掉 _tokens 的部分
+
+_active = contextvars.ContextVar("lantrans_tracer", default=None)
+_local = threading.local()
+
+
+class Span:
+    """一个阶段。start / end 为 perf_counter 秒；child 为同线程内嵌套子阶段的耗时之和。"""
+    __slots__ = ("name", "attrs", "start", "end", "tid", "child", "parent")
+
+    def __init__(self, name, attrs, parent):
+        self.name, self.attrs, self.parent = name, attrs, parent
+        self.tid = threading.get_ident()
+        self.child = 0.0
+        self.start = time.perf_counter()
+        self.end = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, **counts):
+        """累加数值属性（如同一请求的多个对冲副本的 token）。"""
+        for k, v in counts.items():
+            self.attrs[k] = self.attrs.get(k, 0) + v
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    @property
+    def self_time(self):
+        return max(0.0, self.duration - self.child)
+
+    def labels(self):
+        """LABEL_KEYS 中的属性；自身没有的沿父阶段继承（如 chat 继承外层 episode 的 lang）。"""
+        out, sp = {}, self
+        while sp is not None:
+            for k in LABEL_KEYS:
+                if k not in out and sp.attrs.get(k) is not None:
+                    out[k] = sp.attrs[k]
+            sp = sp.parent
+        return out
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, **counts):
+        pass
+
+
+_NULL = _NullSpan()
+
+
+class Tracer:
+    """一次运行（如一批翻译 / 一批烧录）的全部阶段。线程安全。"""
+
+    def __init__(self, name="run"):
+        self.name = name
+        self.started_at = datetime.now()
+        self.t0 = time.perf_counter()
+        self.t1 = None
+        self.spans = []
+        self.thread_names = {}
+        self.deferred = []       # [(future, fn)]：结束前仍在运行的异步结果，finish_run 时补记
+        self._lock = threading.Lock()
+
+    @property
+    def wall(self):
+        return (self.t1 or time.perf_counter()) - self.t0
+
+    def add(self, sp):
+        with self._lock:
+            self.spans.append(sp)
+            self.thread_names.setdefault(sp.tid, threading.current_thread().name)
+
+    def defer(self, future, fn):
+        with self._lock:
+            self.deferred.append((future, fn))
+
+    def flush(self, timeout):
+        """等待补记的异步结果（合计最多 timeout 秒），对已完成的调用 fn(future)；超时仍未完成的不记。"""
+        with self._lock:
+            pending, self.deferred = self.deferred, []
+        if pending:
+            wait([f for f, _ in pending], timeout=timeout)
+        for f, fn in pending:
+            if f.done():
+                fn(f)
+
+    # --- 汇总 ---
+    def summary(self):
+        """按阶段汇总，返回 [dict(stage, count, total_s, self_s, max_s, share)]，按自身耗时降序。
+        share 为自身耗时占全部阶段自身耗时之和的比例（并行时各线程的时间都计入）。"""
+        rows = {}
+        for sp in self.spans:
+            r = rows.setdefault(sp.name, {"stage": sp.name, "count": 0, "total_s": 0.0, "self_s": 0.0, "max_s": 0.0})
+            r["count"] += 1
+            r["total_s"] += sp.duration
+            r["self_s"] += sp.self_time
+            r["max_s"] = max(r["max_s"], sp.duration)
+        busy = sum(r["self_s"] for r in rows.values()) or 1.0
+        out = sorted(rows.values(), key=lambda r: r["self_s"], reverse=True)
+        for r in out:
+            r["share"] = r["self_s"] / busy
+            for k in ("total_s", "self_s", "max_s"):
+                r[k] = round(r[k], 4)
+            r["share"] = round(r["share"], 4)
+        return out
+
+    # --- 导出 ---
+    def chrome_trace(self):
+        """Chrome trace 事件格式（完整事件 ph=X，时间单位微秒）。"""
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in self.thread_names.items()]
+        for sp in self.spans:
+            events.append({"name": sp.name, "cat": sp.name.split(".")[0], "ph": "X", "pid": pid, "tid": sp.tid,
+                           "ts": round((sp.start - self.t0) * 1e6, 1), "dur": round(sp.duration * 1e6, 1),
+                           "args": {k: v if isinstance(v, (int, float, str, bool)) or v is None else str(v)
+                                    for k, v in sp.attrs.items()}})
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"run": self.name, "started_at": self.started_at.isoformat(timespec="seconds")}}
+
+    def prometheus(self):
+        """Prometheus 文本格式（可交给 node_exporter 的 textfile collector）。"""
+        def labels(d):
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                                  for k, v in d.items()) + "}"
+
+        stages, self_time, tokens = {}, {}, {}
+        for sp in self.spans:
+            lab = sp.labels()
+            key = (("stage", sp.name),) + tuple((k, lab[k]) for k in LABEL_KEYS if k in lab)
+            s = stages.setdefault(key, [0.0, 0])
+            s[0] += sp.duration
+            s[1] += 1
+            self_time[key] = self_time.get(key, 0.0) + sp.self_time
+            for kind in TOKEN_KEYS:
+                if isinstance(sp.attrs.get(kind), int):
+                    tk = key + (("kind", kind[:-len("_tokens")]),)
+                    tokens[tk] = tokens.get(tk, 0) + sp.attrs[kind]
+        run = {"run": self.name}
+        lines = ["# HELP lantrans_run_wall_seconds Wall time of the run.",
+                 "# TYPE lantrans_run_wall_seconds gauge",
+                 f"lantrans_run_wall_seconds{labels(run)} {self.wall:.6f}",
+                 "# HELP lantrans_stage_seconds Time spent in each pipeline stage (including nested stages).",
+                 "# TYPE lantrans_stage_seconds summary"]
+        for key, (total, count) in sorted(stages.items()):
+            lab = labels({**run, **dict(key)})
+            lines += [f"lantrans_stage_seconds_sum{lab} {total:.6f}", f"lantrans_stage_seconds_count{lab} {count}"]
+        lines += ["# HELP lantrans_stage_self_seconds_total Stage time excluding nested stages.",
+                  "# TYPE lantrans_stage_self_seconds_total counter"]
+        lines += [f"lantrans_stage_self_seconds_total{labels({**run, **dict(key)})} {t:.6f}"
+                  for key, t in sorted(self_time.items())]
+        if tokens:
+            lines += ["# HELP lantrans_tokens_total Tokens reported by the API, by stage "
+                      "(hedge_* kinds are the abandoned hedge copies).",
+                      "# TYPE lantrans_tokens_total counter"]
+            lines += [f"lantrans_tokens_total{labels({**run, **dict(key)})} {n}" for key, n in sorted(tokens.items())]
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def span(name, **attrs):
+    """记录一个阶段；没有激活的追踪时什么也不做。异常照常抛出，并在属性里记下异常类型。"""
+    tracer = _active.get()
+    if tracer is None:
+        yield _NULL
+        return
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    sp = Span(name, attrs, stack[-1] if stack else None)
+    stack.append(sp)
+    try:
+        yield sp
+    except BaseException as e:
+        sp.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        sp.end = time.perf_counter()
+        stack.pop()
+        if sp.parent is not None:
+            sp.parent.child += sp.duration
+        tracer.add(sp)
+
+
+def current():
+    return _active.get()
+
+
+def defer(future, fn):
+    """future 完成后要记到 span 上的内容（fn(future)）。在当前运行结束时统一补记，
+    不依赖 done 回调的时机：回调可能在 finish_run 写出文件之后才触发。没有激活的追踪时什么也不做。"""
+    tracer = _active.get()
+    if tracer is not None:
+        tracer.defer(future, fn)
+
+
+def start_run(name):
+    """开始一次运行并在当前上下文激活（同一上下文里之前未结束的被替换）。"""
+    tracer = Tracer(name)
+    _active.set(tracer)
+    return tracer
+
+
+def bind(fn):
+    """包装 fn，使它在任意线程里运行时都记入当前激活的追踪（线程池不会自动继承 contextvar）。
+    没有激活的追踪时原样返回 fn。"""
+    tracer = _active.get()
+    if tracer is None:
+        return fn
+
+    def run(*args, **kwargs):
+        token = _active.set(tracer)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _active.reset(token)
+    return run
+
+
+def finish_run(tracer, out_dir=None):
+    """结束追踪并写出 <名称>_<时间>.trace.json / .prom / .summary.json，返回 {类型: 路径}。
+    out_dir 默认 config.TRACE_DIR；只保留最近 config.TRACE_KEEP 次运行的文件。
+    写出前最多等 config.TRACE_FLUSH_TIMEOUT 秒，补记 defer() 登记的异步结果。"""
+    tracer.t1 = tracer.t1 or time.perf_counter()
+    tracer.flush(config.TRACE_FLUSH_TIMEOUT)
+    if _active.get() is tracer:
+        _active.set(None)
+    out_dir = Path(out_dir or config.TRACE_DIR)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stem = f"{tracer.name}_{tracer.started_at:%Y%m%d_%H%M%S}"
+    paths = {"trace": out_dir / f"{stem}.trace.json", "prom": out_dir / f"{stem}.prom",
+             "summary": out_dir / f"{stem}.summary.json"}
+    paths["trace"].write_text(json.dumps(tracer.chrome_trace(), ensure_ascii=False), encoding="utf-8")
+    paths["prom"].write_text(tracer.prometheus(), encoding="utf-8")
+    paths["summary"].write_text(json.dumps({"run": tracer.name, "wall_s": round(tracer.wall, 4),
+                                            "stages": tracer.summary()}, ensure_ascii=False, indent=1),
+                                encoding="utf-8")
+    _prune(out_dir)
+    return paths
+
+
+def _prune(out_dir):
+    runs = sorted(out_dir.glob("*.summary.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in runs[config.TRACE_KEEP:]:
+        stem = old.name[:-len(".summary.json")]
+        for suffix in (".trace.json", ".prom", ".summary.json"):
+            (out_dir / f"{stem}{suffix}").unlink(missing_ok=True)
+
+
+def format_summary(tracer, top=10):
+    """Markdown 表格：各阶段次数、自身耗时、占比与最长一次，供界面展示。"""
+    rows = tracer.summary()[:top]
+    lines = [f"总耗时 **{tracer.wall:.1f}s**；各阶段按自身耗时排序（不含嵌套子阶段，并行时各线程累加）：", "",
+             "| 阶段 | 次数 | 自身耗时 | 占比 | 最长一次 |", "|---|---:|---:|---:|---:|"]
+    lines += [f"| {r['stage']} | {r['count']} | {r['self_s']:.2f}s | {r['share']:.0%} | {r['max_s']:.2f}s |"
+              for r in rows]
+    return "\n".join(lines)
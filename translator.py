@@ -2,29 +2,34 @@
 与 Streamlit 无关，纯函数，方便测试与复用。
 
 健壮性设计：
-- OpenAI 调用带指数退避重试（限流 / 超时 / 5xx）。
+- 请求经后端池（backends）分摊到多个 Key / 端点，单个后端出错自动换下一个；OpenAI 调用带指数退避重试（限流 / 超时 / 5xx），每个请求按预计输出长度设截止时间，慢于历史 p95 时对冲（latency）。
 - 长 SRT 按字幕条数分块翻译，避免输出被截断。
-- 译文落盘前清洗 markdown 围栏并用 pysrt 校验、重排序号。
+- 译文落盘前清洗 markdown 围栏、解析校验并重排序号；每集只解析一次（srt_cues），分块、校验、合并都直接用字幕列表。
+- 每块译文逐条对齐回原文（cue_align）：漏译、合并的字幕只把这几条重新请求，不整块重发。
 - 翻译记忆条目设上限，避免逐集膨胀。
 """
 import json
 import re
 import time
 
-import pysrt
 from openai import (OpenAI, RateLimitError, APITimeoutError,
                     APIConnectionError, InternalServerError)
 
 import config
+import latency
+import tracing
+from backends import Router
+from cue_align import align
+from srt_cues import format_srt, parse_srt, renumber
 
 EMPTY_MEMORY = {"episode_count": 0, "characters": {}, "terminology": {}, "style_notes": ""}
 _RETRYABLE = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
 
 
-def get_client() -> OpenAI | None:
-    """返回 OpenAI 客户端；未配置 Key 时返回 None。"""
-    api_key = config.get_api_key()
-    return OpenAI(api_key=api_key) if api_key else None
+def get_client() -> Router | None:
+    """返回按 config.BACKENDS 建好的后端池（用法同 OpenAI 客户端，见 backends）；一个 Key 都没配置时返回 None。"""
+    specs = config.backend_specs()
+    return Router.from_specs(specs) if specs else None
 
 
 # ---------------- 记忆读写 ----------------
@@ -39,11 +44,6 @@ def load_memory(path) -> dict:
         return dict(EMPTY_MEMORY)
 
 
-def save_memory(memory: dict, path) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(memory, f, ensure_ascii=False, indent=2)
-
-
 def trim_memory(memory: dict) -> dict:
     """裁剪记忆，避免逐集累积导致 prompt 无限膨胀。就地修改并返回。"""
     for key in ("characters", "terminology"):
@@ -58,30 +58,80 @@ def trim_memory(memory: dict) -> dict:
 
 # ---------------- 底层调用 ----------------
 
-def _chat(client: OpenAI, model: str, system: str, user: str):
-    """带指数退避重试的 chat.completions 调用。"""
+def _chat(client: OpenAI, model: str, system: str, user: str, expected_tokens: int | None = None):
+    """带指数退避重试的 chat.completions 调用。expected_tokens 为预计输出 token 数（默认按 user 估算），
+    决定单次请求的截止时间与对冲时机（见 latency）。"""
+    expected = expected_tokens or latency.estimate_tokens(user)
+    kwargs = dict(
+        model=model,
+        messages=[{"role": "system", "content": system}, {"role": "user", "content": user}],
+        timeout=latency.deadline(expected),
+    )
+    if config.TRANSLATE_TEMPERATURE is not None:
+        kwargs["temperature"] = config.TRANSLATE_TEMPERATURE
+    # SDK 自带的重试会让一次卡住的请求拖到约 3 倍截止时间才超时；重试统一由下面的退避循环负责
+    api = client.with_options(max_retries=0) if hasattr(client, "with_options") else client
     last_err = None
     for attempt in range(config.RETRY_ATTEMPTS):
         try:
-            kwargs = dict(
-                model=model,
-                messages=[{"role": "system", "content": system}, {"role": "user", "content": user}],
-            )
-            if config.TRANSLATE_TEMPERATURE is not None:
-                kwargs["temperature"] = config.TRANSLATE_TEMPERATURE
-            return client.chat.completions.create(**kwargs)
+            with tracing.span("chat", model=model, attempt=attempt) as sp:
+                resp, hedged, hedge_won, losers = latency.call(lambda: api.chat.completions.create(**kwargs),
+                                                               model, expected)
+                if hedged:
+                    sp.set(hedged=True, hedge_won=hedge_won)
+                    _attach_losers(resp, losers, sp)
+                if getattr(resp, "backend", None):
+                    sp.set(backend=resp.backend)
+                usage = getattr(resp, "usage", None)
+                if usage:
+                    sp.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+            return resp
         except _RETRYABLE as e:
             last_err = e
             if attempt < config.RETRY_ATTEMPTS - 1:
-                time.sleep(config.RETRY_BASE_DELAY * (2 ** attempt))
+                delay = config.RETRY_BASE_DELAY * (2 ** attempt)
+                with tracing.span("retry_sleep", model=model, attempt=attempt, error=type(e).__name__, delay_s=delay):
+                    time.sleep(delay)
     raise last_err
 
 
+def _record_loser(future, sp):
+    """把作废的对冲请求的实际用量累加到 chat span 的 hedge_* token 上。"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    usage = getattr(future.result(), "usage", None)
+    if usage:
+        sp.add(hedge_prompt_tokens=usage.prompt_tokens, hedge_completion_tokens=usage.completion_tokens)
+
+
+def _attach_losers(resp, losers, sp):
+    """对冲时作废、但已经发出的请求同样计费。已返回的带上实际响应，仍在运行的记个数
+    （_usage_cost 先按胜出请求的用量估算），都挂在 resp.hedge_losers 上。已返回的用量立即记到 span，
+    仍在运行的登记给追踪，在本次运行结束时补记（见 tracing.defer）。"""
+    done, running = [], 0
+    for f in losers:
+        if f.done():
+            if f.exception() is None:
+                done.append(f.result())
+            _record_loser(f, sp)
+        else:
+            running += 1
+            tracing.defer(f, lambda g: _record_loser(g, sp))
+    resp.hedge_losers = (done, running)
+
+
 def _usage_cost(resp, model, fb_in, fb_out) -> float:
-    """优先用 API 返回的真实 usage；缺失时回退到分词估算。"""
-    if getattr(resp, "usage", None):
-        return config.estimate_cost(resp.usage.prompt_tokens, resp.usage.completion_tokens, model)
-    return config.estimate_cost(fb_in, fb_out, model)
+    """优先用 API 返回的真实 usage；缺失时回退到分词估算。经后端池时按实际后端的价格表计。
+    对冲作废的请求一并计入：已返回的按其用量，仍在运行的按本响应的费用估算。"""
+    def one(r):
+        backend = getattr(r, "backend", None)
+        if getattr(r, "usage", None):
+            return config.estimate_cost(r.usage.prompt_tokens, r.usage.completion_tokens, model, backend)
+        return config.estimate_cost(fb_in, fb_out, model, backend)
+
+    cost = one(resp)
+    done, running = getattr(resp, "hedge_losers", ((), 0))
+    return cost + sum(one(r) for r in done) + running * cost
 
 
 # ---------------- SRT 清洗与分块 ----------------
@@ -96,65 +146,186 @@ def _clean_srt(text: str) -> str:
 
 
 def _parse_srt(text: str):
-    """尝试解析为 SRT；成功且非空返回 SubRipFile，否则 None。"""
-    try:
-        subs = pysrt.from_string(text)
-        return subs if len(subs) else None
-    except Exception:
-        return None
+    """尝试解析为 SRT；成功且非空返回 [Cue]（见 srt_cues），否则 None。"""
+    return parse_srt(text) or None
 
 
-def _chunk_srt(srt_content: str):
-    """把 SRT 拆成若干块（每块至多 CHUNK_CUES 条字幕）。解析失败则整体作为一块。"""
-    source = _parse_srt(srt_content)
-    if source is None:
-        return [srt_content]
-    cues = list(source)
-    if len(cues) <= config.CHUNK_CUES:
-        return [srt_content]
-    return ["\n".join(str(c) for c in cues[i:i + config.CHUNK_CUES])
-            for i in range(0, len(cues), config.CHUNK_CUES)]
+def _chunk_cues(cues):
+    """把字幕列表按 CHUNK_CUES 条一块切分（translate_srt 的分块）。"""
+    return [cues[i:i + config.CHUNK_CUES] for i in range(0, len(cues), config.CHUNK_CUES)]
 
 
-def _system_prompt(target_lang: str, memory: dict) -> str:
+class AlignmentError(ValueError):
+    """补译后仍与原文对不齐。cost 为放弃前已花掉的费用（含同一集里已完成的块与各轮补译），调用方应计入总费用。"""
+
+    def __init__(self, message, cost=0.0):
+        super().__init__(message)
+        self.cost = cost
+
+
+def _charge(e: Exception, cost: float):
+    """把已花掉的费用记到离开翻译函数的异常上（e.cost 累加）。任何失败（对不齐、重试用尽的 API 错误、超时）
+    都带着到此为止的费用抛出，调用方用 getattr(e, "cost", 0.0) 计入总费用。"""
+    e.cost = getattr(e, "cost", 0.0) + cost
+
+
+def _system_prompt(target_lang: str, memory: dict, instructions: str = "") -> str:
+    extra = f"\n{instructions.strip()}\n" if instructions else ""
     return f"""You are a professional subtitle translator for short dramas, specializing in localization. Your task is to translate subtitles into {target_lang}.
 - **Translate names into a localized form that is natural and culturally appropriate for {target_lang} speakers.** For example, if translating 'John' to Spanish, 'Juan' might be a good option.
 - Preserve the original SRT format exactly, including the index numbers and timestamps.
 - Maintain the original tone and style of the dialogue.
 - Use the provided memory to ensure consistency for character names and terminology.
 - Do not add any translator notes, explanations, or markdown fences — output raw SRT only.
-
+{extra}
 Current memory: {json.dumps(memory, ensure_ascii=False)}
 """
 
 
 # ---------------- 对外 API ----------------
 
-def translate_srt(client: OpenAI, srt_content: str, target_lang: str, model: str, memory: dict):
-    """翻译单个 SRT（必要时分块），返回 (译文, 费用)。译文已清洗并重排序号。"""
-    system_prompt = _system_prompt(target_lang, memory)
-    chunks = _chunk_srt(srt_content)
-
-    parts, total_cost = [], 0.0
-    for chunk in chunks:
-        user_prompt = f"Translate the following subtitles:\n{chunk}"
-        part = ""
-        # 单块若解析失败最多重试一次（覆盖模型偶发的格式跑偏）
-        for attempt in range(2):
-            resp = _chat(client, model, system_prompt, user_prompt)
+def _split_known(source, store=None, prefilled=None):
+    """从已解析的字幕列表里拆出已有译文的字幕：返回 (待翻译的块 [(字幕列表, 参考译文)], 已有译文的字幕列表)。
+    prefilled 为 {字幕位置（从 0 起）: 译文}（如共享片头块的译文），其次查片段存储的精确命中；
+    其余按 CHUNK_CUES 分块，有 store 时每块附上近似命中的参考译文（去重）。"""
+    prefilled = prefilled or {}
+    reused, novel = [], []
+    for pos, c in enumerate(source):
+        text = prefilled.get(pos)
+        if text is None and store is not None:
+            text = store.lookup(c.text)
+            store.hits += text is not None
+        if text is not None:
+            c.text = text
+            reused.append(c)
+        else:
+            novel.append(c)
+    chunks = []
+    for cues in _chunk_cues(novel):
+        hints = {}
+        if store is not None:
+            for c in cues:
+                near = store.near(c.text)
+                store.hinted += bool(near)
+                store.misses += not near
+                hints.update((src, tgt) for _, src, tgt in near)
+        chunks.append((cues, list(hints.items())))
+    return chunks, reused
+
+
+def _hint_block(hints) -> str:
+    lines = "\n".join(f"- {src} => {tgt.replace(chr(10), ' / ')}" for src, tgt in hints)
+    return (f"Approved translations of similar lines from earlier episodes (reuse their wording and names "
+            f"where the meaning matches; they are references, not part of the input):\n{lines}\n\n")
+
+
+def _translate_chunk(client, cues, hints, system_prompt, target_lang, model):
+    """翻译一块字幕，逐条对齐回原文；对不齐的（漏译 / 合并）只把这几条再请求，最多 ALIGN_REPAIR_ROUNDS 轮。
+    返回 (逐条译文 [str]，与 cues 一一对应, 费用)；补译后仍有对不齐的抛 AlignmentError。
+    抛出的任何异常都带着已花的费用（e.cost，见 _charge）。"""
+    texts, pending, cost = [None] * len(cues), list(range(len(cues))), 0.0
+    for attempt in range(1 + config.ALIGN_REPAIR_ROUNDS):
+        ask = [cues[p] for p in pending]
+        user_prompt = (_hint_block(hints) if hints else "") + f"Translate the following subtitles:\n{format_srt(ask)}"
+        with tracing.span("translate_chunk", lang=target_lang, model=model, attempt=attempt, cues=len(ask)) as sp:
+            try:
+                resp = _chat(client, model, system_prompt, user_prompt, latency.estimate_tokens(format_srt(ask)))
+            except Exception as e:
+                _charge(e, cost)   # 前几轮补译已经计费
+                raise
             part = _clean_srt(resp.choices[0].message.content)
-            total_cost += _usage_cost(resp, model, len(system_prompt.split()) + len(user_prompt.split()), len(part.split()))
-            if _parse_srt(part) is not None or attempt == 1:
-                break
-        parts.append(part)
-
-    merged = "\n\n".join(parts)
-    # 校验 + 重排序号，得到干净连续的 SRT
-    parsed = _parse_srt(merged)
-    if parsed is not None:
-        parsed.clean_indexes()
-        merged = "\n".join(str(c) for c in parsed)
-    return merged, total_cost
+            cost += _usage_cost(resp, model, len(system_prompt.split()) + len(user_prompt.split()), len(part.split()))
+            with tracing.span("parse", lang=target_lang):
+                aligned = align(ask, _parse_srt(part) or [])
+            sp.set(**aligned.counts())
+        for p, text in aligned.texts.items():
+            texts[pending[p]] = text
+        pending = [pending[p] for p in aligned.unaligned]
+        if not pending:
+            return texts, cost
+    shown = ", ".join(str(cues[p].index) for p in pending[:5]) + ("…" if len(pending) > 5 else "")
+    raise AlignmentError(f"译文有 {len(pending)} 条字幕与原文对不齐（序号 {shown}）", cost)
+
+
+def translate_srt(client: OpenAI, srt_content: str, target_lang: str, model: str, memory: dict,
+                  instructions: str = "", store=None, prefilled=None):
+    """翻译单个 SRT（必要时分块），返回 (译文, 费用)。译文沿用原文时间轴，序号重排为 1..n。
+    instructions 为追加到系统提示里的额外要求（如定向重译时要求更简洁）。
+    传入 store（segment_store.SegmentStore）时，精确命中的字幕直接用已有译文、不送模型，
+    近似命中的作为参考译文附在请求里；prefilled（{字幕位置: 译文}）中的字幕同样不送模型。
+    全部已有译文时不发任何请求。补译后仍与原文对不齐时抛 AlignmentError（ValueError 的子类，不写出错位的字幕）。
+    任何异常（含 API 错误、超时）的 cost 属性都是本集到失败时已花掉的费用。"""
+    system_prompt = _system_prompt(target_lang, memory, instructions)
+    with tracing.span("parse", lang=target_lang):
+        source = _parse_srt(srt_content)
+    if source is None:   # 原文本身无法解析：整体送模型（格式跑偏重试一次），原样返回交给调用方
+        return _translate_unparsed(client, srt_content, system_prompt, target_lang, model)
+    if store is not None or prefilled:
+        with tracing.span("segment_lookup", lang=target_lang) as sp:
+            chunks, reused = _split_known(source, store, prefilled)
+            sp.set(reused=len(reused), chunks=len(chunks))
+    else:
+        chunks = [(cues, []) for cues in _chunk_cues(source)]
+
+    total_cost = 0.0
+    for chunk, hints in chunks:
+        try:
+            texts, cost = _translate_chunk(client, chunk, hints, system_prompt, target_lang, model)
+        except Exception as e:
+            _charge(e, total_cost)   # 之前已完成的块同样已经计费
+            raise
+        total_cost += cost
+        for c, text in zip(chunk, texts):
+            c.text = text
+    # 每条字幕（含已有译文的）都已就地换成译文，原文的顺序与时间轴不变；重排序号得到干净连续的 SRT
+    return format_srt(renumber(source)), total_cost
+
+
+def _translate_unparsed(client, srt_content, system_prompt, target_lang, model):
+    """原文无法解析时的兜底：整体送模型，译文仍无法解析就原样返回。"""
+    user_prompt = f"Translate the following subtitles:\n{srt_content}"
+    part, cost = "", 0.0
+    for attempt in range(2):
+        with tracing.span("translate_chunk", lang=target_lang, model=model, attempt=attempt):
+            try:
+                resp = _chat(client, model, system_prompt, user_prompt)
+            except Exception as e:
+                _charge(e, cost)
+                raise
+        part = _clean_srt(resp.choices[0].message.content)
+        cost += _usage_cost(resp, model, len(system_prompt.split()) + len(user_prompt.split()), len(part.split()))
+        parsed = _parse_srt(part)
+        if parsed is not None:
+            return format_srt(renumber(parsed)), cost
+    return part, cost
+
+
+def concise_instructions(target_lang: str, max_cps: float, max_lines: int) -> str:
+    """定向重译（可读性检查标记的字幕）时追加的要求：保持原意，压缩到可读范围内。"""
+    return (f"- These subtitles were flagged as too long to read comfortably. Rewrite each one in {target_lang} "
+            f"more concisely: at most {max_lines} short line(s) and no more than {max_cps:g} characters "
+            f"per second of its display time. Keep the meaning, names and tone; never merge or split cues.")
+
+
+def retranslate_cues(client: OpenAI, srt_content: str, indexes, target_lang: str, model: str, memory: dict,
+                     instructions: str = ""):
+    """只重译序号在 indexes 中的字幕，其余原样保留。返回 (新 SRT, 费用, 实际替换条数)。
+    选中的字幕单独组成一份 SRT 送去翻译；译文按时间轴对回原位（翻译会重排序号，时间轴不变），
+    对不上的保持原文。"""
+    source = _parse_srt(srt_content)
+    wanted = set(indexes)
+    picked = [c for c in source if c.index in wanted] if source is not None else []
+    if not picked:
+        return srt_content, 0.0, 0
+    translated, cost = translate_srt(client, format_srt(picked), target_lang, model, memory, instructions)
+    by_time = {c.timing: c.text for c in (_parse_srt(translated) or [])}
+    replaced = 0
+    for c in picked:
+        text = by_time.get(c.timing)
+        if text and text.strip():
+            c.text = text
+            replaced += 1
+    return format_srt(source), cost, replaced
 
 
 def update_memory(client: OpenAI, translated_srt: str, memory: dict, model: str):
@@ -172,7 +343,9 @@ Translated SRT:
 {translated_srt}
 """
     try:
-        resp = _chat(client, model, mem_system, mem_user)
+        with tracing.span("memory_update", model=model):
+            resp = _chat(client, model, mem_system, mem_user,
+                         latency.estimate_tokens(json.dumps(memory, ensure_ascii=False)) + 200)
     except Exception as e:
         return None, 0.0, f"记忆更新出错: {e}"
 
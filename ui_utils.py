@@ -2,6 +2,8 @@
 import os
 import streamlit as st
 
+import tracing
+
 
 def validate_dir(path: str, exts=None, key: str = ""):
     """对文件夹路径做实时校验并就地给出反馈。
@@ -23,3 +25,16 @@ def validate_dir(path: str, exts=None, key: str = ""):
     else:
         st.warning("⚠️ 文件夹内未找到匹配文件")
     return files
+
+
+def show_trace(tracer):
+    """结束一次运行的追踪，写出追踪文件并在折叠块里展示各阶段耗时分布。"""
+    try:
+        paths = tracing.finish_run(tracer)
+    except OSError as e:
+        st.caption(f"追踪文件写入失败：{e}")
+        return
+    with st.expander("⏱️ 耗时分布"):
+        st.markdown(tracing.format_summary(tracer))
+        st.caption(f"Chrome trace：`{paths['trace']}`（chrome://tracing 或 ui.perfetto.dev 打开）｜"
+                   f"Prometheus 指标：`{paths['prom']}`")